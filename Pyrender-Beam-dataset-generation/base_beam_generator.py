@@ -1,64 +1,187 @@
 import numpy as np
-import pandas as pd
 from utils import beam_generator
+from run_journal import RunJournal, artifact_key
+from manifest import export_excel, write_table
+from partition import partition_file
+from mesh_io import MESH_FORMATS, export_mesh, load_mesh_file, mesh_path
+import instrumentation
+import functools
 import os
-def generate_beam_meshes(output_dir="./base_beams",
-                         split = 4,
-                         num_heights=3, num_widths=3, start_height=0.02,
-                         end_height=0.05, min_width_ratio=1, max_width_ratio=2):
+
+
+def beam_grid(num_heights=3, num_widths=3, start_height=0.02, end_height=0.05, min_width_ratio=1,
+              max_width_ratio=2):
     """
-    Generate a set of beam meshes based on specified parameters. The function creates 3D models of beams
-    with varying heights and widths, exports them as .obj files, and then saves the metadata for each
-    generated beam in an Excel spreadsheet.
+    List the dimensions of the base beams without generating their meshes.
 
     Args:
-    - output_dir (str): Directory where the generated .obj files and Excel metadata file will be saved.
-    - num_heights (int): Number of distinct beam heights.
-    - num_widths (int): Number of distinct beam widths for each height.
-    - start_height (float): Minimum beam height.
-    - end_height (float): Maximum beam height.
-    - min_width_ratio (float): Minimum width as a ratio of the height.
-    - max_width_ratio (float): Maximum width as a ratio of the height.
-    """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    - Same as generate_beam_meshes.
 
+    Returns:
+    - list: One dict per beam with its Name, Length, Height and Width, in the order the beams are generated.
+    """
     # Compute the heights for the beams using a non-linear function for diversity.
     heights = [start_height - (i / (num_heights - 1)) ** 0.85 * (start_height - end_height) for i in range(num_heights)]
 
     # Calculate corresponding widths for each height by multiplying with a set of width ratios.
     widths = np.outer(heights, np.linspace(min_width_ratio, max_width_ratio, num_widths))
 
-    # Initialize a list to store metadata about each generated beam.
-    beam_data = []
+    # Assume a fixed length of 1 for simplicity. Can be modified if needed.
+    return [{"Name": f"beam_{i * num_widths + j:04d}", "Length": 1, "Height": height, "Width": width}
+            for i, height in enumerate(heights) for j, width in enumerate(widths[i])]
+
+
+def _build_beam(shape, split, resolution):
+    """Generate the mesh of a base beam."""
+    # Use the utility function to generate the 3D mesh for the beam.
+    with instrumentation.stage("base.mesh"):
+        beam = beam_generator(shape, split, resolution)
+    instrumentation.count("base.beams")
+    return beam
+
+
+def _load_beam(path):
+    """Read back the mesh of a base beam that an earlier run exported."""
+    with instrumentation.stage("base.load"):
+        return load_mesh_file(path)
+
 
+def iter_beam_meshes(split=4,
+                     num_heights=3, num_widths=3, start_height=0.02,
+                     end_height=0.05, min_width_ratio=1, max_width_ratio=2,
+                     resolution=None, names=None):
+    """
+    Generate beam meshes one at a time, without writing anything to disk. A mesh is only generated
+    when its beam is used, so that a resumed run does not generate the beams it already has.
+
+    Args:
+    - names (set): Optional names of the beams to generate, e.g. the beams of one partition of a
+                   sharded run. None generates every beam of the grid.
+    - The remaining arguments are those of generate_beam_meshes, without output_dir.
+
+    Yields:
+    - tuple: (record, beam), where record is a dict with the Name, Path (None until the beam is
+             exported), Length, Height and Width of the beam, and the Key of its inputs, and beam is
+             a function without arguments that generates its Trimesh.
+    """
     # Iterate over each combination of height and width.
-    for i, height in enumerate(heights):
-        for j, width in enumerate(widths[i]):
-            # Assume a fixed length of 1 for simplicity. Can be modified if needed.
-            shape = (1, height, width)
+    for record in beam_grid(num_heights, num_widths, start_height, end_height, min_width_ratio, max_width_ratio):
+        if names is not None and record["Name"] not in names:
+            continue
+        shape = (record["Length"], record["Height"], record["Width"])
+
+        record.update(Path=None, Key=artifact_key(stage="base", shape=shape, split=split, resolution=resolution))
+        yield record, functools.partial(_build_beam, shape, split, resolution)
 
-            # Use the utility function to generate the 3D mesh for the beam.
-            beam = beam_generator(shape, split)
 
+def export_beam_meshes(beams, output_dir="./base_beams", resume=False, manifest_dir="./manifest",
+                       excel_report=False, partition=None, mesh_format='obj'):
+    """
+    Export beams as they pass through, and write the beams table of the dataset manifest once all
+    beams have been consumed.
+
+    Args:
+    - beams (iterable): (record, beam) pairs as yielded by iter_beam_meshes.
+    - output_dir (str): Directory where the mesh files will be saved.
+    - resume (bool): Skip the beams that the journal of output_dir lists with the same inputs and whose
+                     mesh file still exists. Their meshes are neither generated nor exported; they are
+                     read back from the file if a later stage uses them.
+    - manifest_dir (str): Directory of the dataset manifest.
+    - excel_report (bool): Also save the beams table as output_dir/mesh_meta.xlsx.
+    - partition (str): Name of the partition of a sharded run, see partition.partition_name. The journal
+                       and the Excel report of the partition get their own file names in output_dir.
+    - mesh_format (str): File format of the meshes, one of mesh_io.MESH_FORMATS.
+
+    Yields:
+    - tuple: The same (record, beam) pairs, with the Path of the record filled in. beam is the generated
+             Trimesh, or for a skipped beam a function without arguments that loads its mesh file.
+    """
+    assert mesh_format in MESH_FORMATS, f"Invalid mesh_format. Choose one of {MESH_FORMATS}."
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Initialize a list to store metadata about each generated beam.
+    beam_data = []
+
+    num_skipped = 0
+
+    with RunJournal(output_dir, resume, partition) as journal:
+        for record, beam in beams:
             # Define the filename to store the beam's 3D model.
-            filename = f'{output_dir}/beam_{i * num_widths + j:04d}.obj'
+            filename = mesh_path(output_dir, record["Name"], mesh_format)
 
-            # Export the 3D model of the beam to the specified filename.
-            beam.export(filename, file_type='obj')
+            if journal.is_done(record["Key"], [filename]):
+                # Read back only if a later stage needs the mesh
+                beam = functools.partial(_load_beam, filename)
+                num_skipped += 1
+            else:
+                beam = beam() if callable(beam) else beam
+                with instrumentation.stage("base.export"):
+                    # Export the 3D model of the beam to the specified filename.
+                    export_mesh(beam, filename, mesh_format)
+                    journal.record(record["Key"], [filename], name=record["Name"])
 
             # Append the metadata of the current beam to the beam_data list.
-            beam_data.append([f"beam_{i * num_widths + j:04d}", filename, 1, height, width])
+            record["Path"] = filename
+            beam_data.append(record)
+            yield record, beam
+
+    if num_skipped:
+        print(f"Skipped {num_skipped} beam meshes already in {output_dir}")
 
-    # Convert the list of metadata into a DataFrame for easier manipulation and storage.
-    df = pd.DataFrame(beam_data, columns=["Name", "Path", "Length", "Height", "Width"])
+    # Save the metadata as the typed beams table of the manifest.
+    with instrumentation.stage("manifest"):
+        write_table(manifest_dir, "beams", beam_data)
+        if excel_report:
+            export_excel(manifest_dir, os.path.join(output_dir, partition_file("mesh_meta.xlsx", partition)), ["beams"])
 
-    # Save the metadata into an Excel file in the specified directory.
-    df.to_excel(f"{output_dir}/mesh_meta.xlsx", index=False)
+
+def generate_beam_meshes(output_dir="./base_beams",
+                         split = 4,
+                         num_heights=3, num_widths=3, start_height=0.02,
+                         end_height=0.05, min_width_ratio=1, max_width_ratio=2,
+                         resolution=None, resume=False, manifest_dir="./manifest", excel_report=False, names=None,
+                         partition=None, mesh_format='obj'):
+    """
+    Generate a set of beam meshes based on specified parameters. The function creates 3D models of beams
+    with varying heights and widths, exports them as mesh files, and then saves the metadata for each
+    generated beam in the beams table of the dataset manifest.
+
+    Args:
+    - output_dir (str): Directory where the generated mesh files will be saved.
+    - num_heights (int): Number of distinct beam heights.
+    - num_widths (int): Number of distinct beam widths for each height.
+    - start_height (float): Minimum beam height.
+    - end_height (float): Maximum beam height.
+    - min_width_ratio (float): Minimum width as a ratio of the height.
+    - max_width_ratio (float): Maximum width as a ratio of the height.
+    - resolution (tuple): Optional (length, height, width) number of segments of a structured surface
+                          grid, e.g. (64, 4, 4). None keeps the uniform subdivision given by split.
+    - resume (bool): Keep the beams of a previous run in output_dir that were generated with the
+                     same parameters instead of exporting them again.
+    - manifest_dir (str): Directory of the dataset manifest. The beams table is written there as
+                          beams.parquet, or beams.csv when pyarrow is not installed.
+    - excel_report (bool): Also save the metadata as output_dir/mesh_meta.xlsx, as earlier versions did.
+    - names (set): Optional names of the beams to generate. None generates all of them.
+    - partition (str): Name of the partition of a sharded run, which generates the beams named by its jobs.
+    - mesh_format (str): 'obj' writes text OBJ files. 'ply' (binary PLY), 'glb' (glTF binary) and 'npz'
+                         (NumPy archive of the vertex and face arrays) store float32 vertices in binary,
+                         which is smaller and faster to write and read.
+
+    Returns:
+    - dict: The generated beam meshes keyed by name, which generate_deformed_meshes can use
+            through base_meshes instead of reloading the mesh files. Beams skipped on resume
+            are not loaded and not included.
+    """
+    beams = iter_beam_meshes(split, num_heights, num_widths, start_height, end_height, min_width_ratio,
+                             max_width_ratio, resolution, names)
+    beams = export_beam_meshes(beams, output_dir, resume, manifest_dir, excel_report, partition, mesh_format)
+    beams = {record["Name"]: beam for record, beam in beams}
 
     print(
-        f"Successfully generated {num_heights * num_widths} beam meshes and saved metadata to {output_dir}/mesh_meta.xlsx")
+        f"Successfully generated {len(beams)} beam meshes and saved metadata to {manifest_dir}")
+    return {name: beam for name, beam in beams.items() if not callable(beam)}
 
 
-# Execute the function to generate the beam meshes.
-generate_beam_meshes()
+if __name__ == "__main__":
+    # Execute the function to generate the beam meshes.
+    generate_beam_meshes()
@@ -0,0 +1,320 @@
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import instrumentation
+
+
+# Shape of the benchmark beam: length, height and width as in generate_beam_meshes
+BEAM_SHAPE = (1, 0.03, 0.05)
+
+
+def _beam(split):
+    """Benchmark beam with split subdivision passes, without the vertex count printout of beam_generator."""
+    from utils import beam_generator
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return beam_generator(BEAM_SHAPE, split)
+
+
+def _measure(fn, repeat):
+    """Run fn repeat times and return its fastest and median wall time in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def _result(benchmark, params, items, unit, times):
+    seconds, median_seconds = times
+    return {"benchmark": benchmark, "params": params, "items": items, "unit": unit, "seconds": seconds,
+            "median_seconds": median_seconds, "throughput": items / seconds if seconds > 0 else None,
+            "peak_rss_mb": instrumentation.peak_rss_mb()}
+
+
+def bench_beam_generator(split=4, repeat=3):
+    """Generate one subdivided beam with beam_generator."""
+    faces = len(_beam(split).faces)
+    return [_result("beam_generator", {"split": split, "faces": faces}, 1, "beams",
+                    _measure(lambda: _beam(split), repeat))]
+
+
+def bench_deformation(beam_type='cantilever', split=4, num_loads=64, repeat=3):
+    """Deform a beam for a batch of loads with batch_cantilever or batch_simple_support_beam."""
+    from utils import batch_cantilever, batch_simple_support_beam
+
+    vertices = _beam(split).vertices
+    loads = np.linspace(-100, 100, num_loads)
+    if beam_type == 'simple_support':
+        deform = lambda: batch_simple_support_beam(vertices, loads, 0.9, 69e9, 1e-8)
+    else:
+        deform = lambda: batch_cantilever(vertices, loads, 69e9, 1e-8, 1)
+    return [_result(beam_type, {"split": split, "vertices": len(vertices), "num_loads": num_loads}, num_loads,
+                    "meshes", _measure(deform, repeat))]
+
+
+def bench_fe_solver(beam_type='cantilever', split=4, resolution=(64, 8, 8), num_loads=64, repeat=3):
+    """Assemble and factorize the finite element model of a beam, and deform it for a batch of loads."""
+    from fe_solver import FESolver
+
+    beam = _beam(split)
+    solver = FESolver(beam, beam_type, 69e9, resolution=resolution)
+    loads = np.linspace(-100, 100, num_loads)
+    # Cantilevers are loaded at their free end
+    location = None if beam_type == 'cantilever' else 0.5
+    params = {"beam_type": beam_type, "split": split, "resolution": list(resolution), "dofs": len(solver.free)}
+    return [_result("fe_factorize", params, 1, "beams",
+                    _measure(lambda: FESolver(beam, beam_type, 69e9, resolution=resolution), repeat)),
+            _result("fe_solve", dict(params, num_loads=num_loads), num_loads, "meshes",
+                    _measure(lambda: solver.deform(loads, location), repeat))]
+
+
+def bench_planner(beam_type='cantilever', num_beams=1000, num_locations=10, num_meshes=100, repeat=3):
+    """Plan the jobs table of a sweep over beams, load locations and displacement targets with plan_jobs."""
+    from base_beam_generator import beam_grid
+    from deformed_beam_generator import plan_jobs
+
+    beams = beam_grid(num_beams, 1)
+    locations = list(np.linspace(0.05, 0.95, num_locations))
+    plan = lambda: plan_jobs(beams, beam_type, num_meshes, locations=locations)
+    params = {"beam_type": beam_type, "num_beams": num_beams, "num_locations": num_locations,
+              "num_meshes": num_meshes}
+    return [_result("planner", params, len(plan()), "jobs", _measure(plan, repeat))]
+
+
+def bench_mesh_io(mesh_format='obj', split=4, repeat=3):
+    """Export a beam to a mesh file and load it back, as the pipeline stages do."""
+    from mesh_io import export_mesh, load_mesh_file, mesh_path
+
+    beam = _beam(split)
+    with tempfile.TemporaryDirectory() as directory:
+        path = mesh_path(directory, "beam", mesh_format)
+        export_times = _measure(lambda: export_mesh(beam, path, mesh_format), repeat)
+        params = {"split": split, "faces": len(beam.faces), "megabytes": os.path.getsize(path) / (1 << 20)}
+        import_times = _measure(lambda: load_mesh_file(path), repeat)
+    return [_result(f"{mesh_format}_export", params, 1, "meshes", export_times),
+            _result(f"{mesh_format}_import", params, 1, "meshes", import_times)]
+
+
+def _views(backend, img_size, split, num_views):
+    """Renderer, scene and camera poses of num_views views of the benchmark beam, framed as in the pipeline."""
+    from pose_sampler import camera_poses, mesh_rng, sample_angles
+    from randering_img_depth import BeamScene, NumpyScene, make_renderer
+    from utils import normalize_mesh
+
+    yfov = np.pi / 3
+    mesh = normalize_mesh(_beam(split))
+    renderer = make_renderer(backend, img_size)
+    scene = (NumpyScene if backend == 'numpy' else BeamScene)(yfov, 1.5, np.array([1.0, 0.90, 0.7]))
+    scene.set_mesh(mesh)
+    distance = np.linalg.norm(mesh.bounds[1] - mesh.bounds[0]) / np.tan(yfov / 2)
+    poses = camera_poses(sample_angles(num_views, rng=mesh_rng(0, "benchmark")), mesh.bounds.mean(axis=0), distance)
+    return renderer, scene if backend == 'numpy' else scene.scene, scene, poses
+
+
+def bench_render(img_size=(512, 512), backend='pyrender', split=4, num_views=10, repeat=3):
+    """Render color and depth of num_views views with renderer.render."""
+    renderer, render_scene, scene, poses = _views(backend, img_size, split, num_views)
+
+    def render():
+        for pose in poses:
+            scene.set_pose(pose)
+            renderer.render(render_scene)
+
+    # The first render uploads the mesh
+    renderer.render(render_scene)
+    times = _measure(render, repeat)
+    renderer.delete()
+    return [_result("render", {"backend": backend, "img_size": list(img_size), "split": split}, num_views, "images",
+                    times)]
+
+
+def bench_encoding(img_size=(512, 512), png_compression=3, split=4, repeat=3):
+    """Encode a rendered view: the color PNG and the depth map in every depth format."""
+    from image_writer import AsyncImageWriter
+    from randering_img_depth import DEPTH_FORMATS, encode_depth
+    from shards import encode_npy
+
+    # The NumPy backend needs no OpenGL context and approximates the pyrender depth maps
+    renderer, render_scene, scene, poses = _views('numpy', img_size, split, 1)
+    scene.set_pose(poses[0])
+    color, depth = renderer.render(render_scene)
+    color = (color * 255).astype(np.uint8)
+
+    params = {"img_size": list(img_size), "png_compression": png_compression}
+    with AsyncImageWriter(1, 1, png_compression) as writer:
+        results = [_result("png_color", params, 1, "images", _measure(lambda: writer.encode_png(color, rgb=True),
+                                                                     repeat))]
+        for depth_format in DEPTH_FORMATS:
+            encode = encode_npy if depth_format == 'npy' else writer.encode_png
+            times = _measure(lambda: encode(encode_depth(depth, depth_format)), repeat)
+            results.append(_result(f"depth_{depth_format}", params, 1, "images", times))
+    return results
+
+
+BENCHMARKS = {
+    "beam_generator": bench_beam_generator,
+    "deformation": bench_deformation,
+    "fe_solver": bench_fe_solver,
+    "planner": bench_planner,
+    "mesh_io": bench_mesh_io,
+    "render": bench_render,
+    "encoding": bench_encoding,
+}
+
+
+def _run_case(name, kwargs, platform_name=None):
+    """Run one benchmark case, in a fresh worker process so its peak RSS is its own."""
+    if platform_name is not None:
+        os.environ["PYOPENGL_PLATFORM"] = platform_name
+    return BENCHMARKS[name](**kwargs)
+
+
+def _cases(benchmarks, splits, beam_types, num_loads, img_sizes, backend, num_views, png_compression, repeat,
+           mesh_formats):
+    """List the (benchmark, kwargs) cases of a run."""
+    cases = []
+    if "beam_generator" in benchmarks:
+        cases += [("beam_generator", dict(split=split, repeat=repeat)) for split in splits]
+    if "deformation" in benchmarks:
+        cases += [("deformation", dict(beam_type=beam_type, split=split, num_loads=num_loads, repeat=repeat))
+                  for beam_type in beam_types for split in splits]
+    if "fe_solver" in benchmarks:
+        cases += [("fe_solver", dict(beam_type=beam_type, num_loads=num_loads, repeat=repeat))
+                  for beam_type in beam_types]
+    if "planner" in benchmarks:
+        cases += [("planner", dict(beam_type=beam_type, repeat=repeat)) for beam_type in beam_types]
+    if "mesh_io" in benchmarks:
+        cases += [("mesh_io", dict(mesh_format=mesh_format, split=split, repeat=repeat))
+                  for mesh_format in mesh_formats for split in splits]
+    if "render" in benchmarks:
+        cases += [("render", dict(img_size=img_size, backend=backend, num_views=num_views, repeat=repeat))
+                  for img_size in img_sizes]
+    if "encoding" in benchmarks:
+        cases += [("encoding", dict(img_size=img_size, png_compression=png_compression, repeat=repeat))
+                  for img_size in img_sizes]
+    return cases
+
+
+def _git_commit():
+    """Commit of the working tree, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(output="benchmark.json",
+                   benchmarks=tuple(BENCHMARKS),
+                   splits=(2, 3, 4, 5),
+                   beam_types=('cantilever', 'simple_support'),
+                   num_loads=64,
+                   img_sizes=((256, 256), (512, 512), (1024, 1024), (1792, 1792)),
+                   backend='pyrender',
+                   platform_name=None,
+                   num_views=10,
+                   png_compression=3,
+                   repeat=3,
+                   mesh_formats=('obj', 'ply', 'glb', 'npz')):
+    """
+    Benchmark the stages of the pipeline and write the results to a JSON file, to be compared across commits.
+
+    Every case runs in its own spawned process, so the peak RSS of a result is that of its case alone.
+    The timings are the fastest and the median of repeat runs.
+
+    Args:
+    - output (str): Path of the JSON file.
+    - benchmarks (list): Benchmarks to run, keys of BENCHMARKS.
+    - splits (list): Subdivision passes of the beams of the mesh, deformation and mesh file benchmarks.
+    - beam_types (list): 'cantilever' and/or 'simple_support' for the deformation, FE solver and planner benchmarks.
+    - num_loads (int): Number of loads deformed in one batch.
+    - img_sizes (list): (width, height) image sizes of the render and encoding benchmarks.
+    - backend (str): Render backend, 'pyrender' or 'numpy'.
+    - platform_name (str): PYOPENGL_PLATFORM of the pyrender backend, 'egl' or 'osmesa'.
+    - num_views (int): Number of views rendered per run of the render benchmark.
+    - png_compression (int): PNG compression level of the encoding benchmark.
+    - repeat (int): Number of timed runs of every case.
+    - mesh_formats (list): Mesh file formats of the export and import benchmark, see mesh_io.MESH_FORMATS.
+
+    Returns:
+    - dict: The report: commit, environment and one result per case with its parameters, number of
+            items, fastest and median seconds, throughput in items per second and peak RSS in MiB.
+    """
+    cases = _cases(benchmarks, splits, beam_types, num_loads, img_sizes, backend, num_views, png_compression, repeat,
+                   mesh_formats)
+    results = []
+    for name, kwargs in cases:
+        # A new process per case; spawn, as the render workers, so no OpenGL context is inherited
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            for result in pool.apply(_run_case, (name, kwargs, platform_name)):
+                results.append(result)
+                print(f"{result['benchmark']:<16}{json.dumps(result['params']):<60}"
+                      f"{result['throughput']:>12.2f} {result['unit']}/s{result['peak_rss_mb']:>10.1f} MiB")
+
+    report = {"commit": _git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+              "cpu_count": os.cpu_count(), "results": results}
+    with open(output, "w") as report_file:
+        json.dump(report, report_file, indent=4)
+    print(f"Benchmark results saved to {output}")
+    return report
+
+
+def compare(baseline, report):
+    """
+    Print the throughput of every result of a report relative to the same case of a baseline report.
+
+    Args:
+    - baseline (dict): Earlier report, e.g. of the previous commit.
+    - report (dict): Report to compare.
+    """
+    previous = {(result["benchmark"], json.dumps(result["params"], sort_keys=True)): result
+                for result in baseline["results"]}
+    for result in report["results"]:
+        old = previous.get((result["benchmark"], json.dumps(result["params"], sort_keys=True)))
+        if old is not None and old["throughput"] and result["throughput"]:
+            print(f"{result['benchmark']:<16}{json.dumps(result['params']):<60}"
+                  f"{result['throughput'] / old['throughput']:>8.2f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the dataset generation pipeline.")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file of the results.")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help="Benchmarks to run.")
+    parser.add_argument("--splits", type=int, nargs="+", default=[2, 3, 4, 5])
+    parser.add_argument("--beam-types", nargs="+", choices=['cantilever', 'simple_support'],
+                        default=['cantilever', 'simple_support'])
+    parser.add_argument("--num-loads", type=int, default=64)
+    parser.add_argument("--img-sizes", type=int, nargs="+", default=[256, 512, 1024, 1792],
+                        help="Square image sizes of the render and encoding benchmarks.")
+    parser.add_argument("--backend", choices=['pyrender', 'numpy'], default="pyrender")
+    parser.add_argument("--platform", choices=["egl", "osmesa"], default=None)
+    parser.add_argument("--num-views", type=int, default=10)
+    parser.add_argument("--png-compression", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mesh-formats", nargs="+", choices=['obj', 'ply', 'glb', 'npz'],
+                        default=['obj', 'ply', 'glb', 'npz'])
+    parser.add_argument("--compare", default=None, metavar="FILE", help="Earlier results to compare with.")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.output, args.only, args.splits, args.beam_types, args.num_loads,
+                            [(size, size) for size in args.img_sizes], args.backend, args.platform, args.num_views,
+                            args.png_compression, args.repeat, args.mesh_formats)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(json.load(baseline_file), report)
@@ -0,0 +1,332 @@
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from deformed_store import DeformedMeshStore
+from randering_img_depth import list_meshes
+from render_index import read_index
+from shards import decode_member, map_member, sample_key
+from utils import BaseMeshCache
+
+
+# Fields a sample can hold, besides its key, mesh, view, camera pose and labels
+FIELDS = ['image', 'depth', 'vertices', 'mask', 'normals', 'vertex_ids']
+
+# Fields of the index records that locate or describe a view or its mesh file rather than label its mesh
+VIEW_FIELDS = ['Mesh', 'View', 'Key', 'CameraPose', 'Roll', 'Pitch', 'Yaw', 'Image', 'Depth', 'DepthIndex',
+               'Mask', 'Normals', 'VertexIds', 'Shard', 'Members', 'Path', 'Store', 'Sample']
+
+# Index record field and shard member of the fields stored per view, and whether the image is RGB
+_VIEW_DATA = {
+    'image': ('Image', 'png', True),
+    'mask': ('Mask', 'mask.png', False),
+    'normals': ('Normals', 'normals.png', True),
+}
+
+
+def _deformed_info_labels(deformed_dir):
+    """
+    Labels of the deformed meshes of deformed_info.json, keyed by mesh name, for images rendered without
+    a manifest, whose index records have no labels. Force is the magnitude of the load there.
+    """
+    info_path = os.path.join(deformed_dir, "deformed_info.json")
+    if not os.path.isfile(info_path):
+        return {}
+    with open(info_path) as json_file:
+        deformed_info = json.load(json_file)
+
+    labels = {}
+    for beam, locations in deformed_info.items():
+        for location, forces in locations.items():
+            for force, entry in forces.items():
+                if entry.get("Path"):
+                    name = os.path.splitext(os.path.basename(entry["Path"]))[0]
+                elif entry.get("Store") and DeformedMeshStore.is_store(entry["Store"]):
+                    name = DeformedMeshStore(entry["Store"]).samples[entry["Sample"]]["name"]
+                else:
+                    continue
+                labels[name] = {"Beam": beam, "Location": float(location), "Force": float(force),
+                                "E": entry["E"], "I": entry["I"]}
+    return labels
+
+
+def _listed_records(image_dir):
+    """
+    Records of the views of image directories rendered without a render index: image_<k>.png, with
+    depth_<k>.png if present, in every subdirectory.
+    """
+    records = []
+    for name in sorted(os.listdir(image_dir)):
+        mesh_subdir = os.path.join(image_dir, name)
+        if not os.path.isdir(mesh_subdir):
+            continue
+        images = sorted(fname for fname in os.listdir(mesh_subdir)
+                        if fname.startswith("image_") and fname.endswith(".png"))
+        for view, fname in enumerate(images):
+            depth = fname.replace("image_", "depth_", 1)
+            records.append({"Mesh": name, "View": view, "Key": sample_key(name, view), "Image": f"{name}/{fname}",
+                            "Depth": f"{name}/{depth}" if os.path.isfile(os.path.join(mesh_subdir, depth)) else None})
+    return records
+
+
+class BeamDataset:
+    """
+    Random-access reader of rendered views, their depth maps and passes, the deformed vertices of their
+    meshes and the labels of the beams, for training.
+
+    The samples are listed once from the render index of the image directory, in the order of
+    mesh_img_dictionary.json (mesh name, then view), so any sample is read in constant time by index or
+    key, without listing directories. Data is memory-mapped wherever the storage format allows: depth
+    maps and vertex ids saved as .npy (per mesh or as shard members), tar shards, and the vertices of a
+    DeformedMeshStore. PNG images are decoded with OpenCV, which releases the GIL, into an LRU cache.
+    Mesh files are loaded once into an LRU cache of meshes.
+
+    Returned arrays may be shared with the caches and memory maps, so callers must not modify them in
+    place. The reader is safe to use from several threads, and iterate() prefetches samples on a thread
+    pool. Any training framework can wrap it, e.g. as a map-style dataset with __len__ and __getitem__.
+    """
+
+    def __init__(self, image_dir, deformed_dir=None, fields=None, cache_size=256, mesh_cache_size=32,
+                 threads=4, prefetch=0):
+        """
+        Args:
+        - image_dir (str): Directory of the rendered images or shards and their render index.
+        - deformed_dir (str): Optional directory of the deformed meshes. Meshes are looked up there by
+                              name, otherwise at the Path or Store of their index records. Its
+                              deformed_info.json labels meshes rendered without a manifest.
+        - fields (list): Fields of FIELDS to read. None reads all of them. Fields a view was rendered
+                         without, e.g. 'mask', are None in its samples.
+        - cache_size (int): Maximum number of decoded PNG images kept in memory.
+        - mesh_cache_size (int): Maximum number of loaded mesh files kept in memory.
+        - threads (int): Number of threads of iterate() and prefetch_samples().
+        - prefetch (int): Default number of samples iterate() loads ahead. 0 loads them in the caller.
+        """
+        self.image_dir = image_dir
+        self.fields = list(FIELDS if fields is None else fields)
+        assert all(field in FIELDS for field in self.fields), f"Invalid fields. Choose from {FIELDS}."
+        self.cache_size = cache_size
+        self.threads = threads
+        self.prefetch = prefetch
+
+        records = list(read_index(image_dir).values()) or _listed_records(image_dir)
+        self.records = sorted(records, key=lambda record: (record["Mesh"], record["View"]))
+        self.keys = [record["Key"] for record in self.records]
+        self._positions = {key: i for i, key in enumerate(self.keys)}
+
+        self._sources = dict(list_meshes(deformed_dir)) if deformed_dir is not None else {}
+        self._info_labels = _deformed_info_labels(deformed_dir) if deformed_dir is not None else {}
+
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._meshes = BaseMeshCache(mesh_cache_size)
+        self._maps = {}
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._mesh_lock = threading.Lock()
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        """
+        Read a sample.
+
+        Args:
+        - index (int or str): Position of the sample, or its key, e.g. 'cantilever_beam_0000_0p9_165p0/0003'.
+
+        Returns:
+        - dict: 'key', 'mesh' and 'view' of the sample, 'camera_pose' (4x4 camera-to-world pose, None for
+                directories without an index), 'labels' of its mesh (Beam, BeamType, Location, Force, E,
+                I, ... as recorded by the deformation stage), and the requested fields:
+                'image': (H, W, 3) uint8 RGB image.
+                'depth': (H, W) depth map as stored: float for 'npy' depth maps, uint16 for 'png16'
+                and uint8 for 'png8' (see camera.json for the encoding).
+                'vertices': (V, 3) deformed vertices of the mesh.
+                'mask': (H, W) uint8 silhouette, 'normals': (H, W, 3) uint8 RGB camera-frame normals
+                and 'vertex_ids': (H, W) int32 vertex ids, for views rendered with these outputs.
+        """
+        record = self.records[self._positions[index] if isinstance(index, str) else index]
+        sample = {
+            "key": record["Key"],
+            "mesh": record["Mesh"],
+            "view": record["View"],
+            "camera_pose": np.array(record["CameraPose"]) if "CameraPose" in record else None,
+            "labels": self.labels(record),
+        }
+        for field in self.fields:
+            if field == 'depth':
+                sample[field] = self._depth(record)
+            elif field == 'vertex_ids':
+                sample[field] = self._vertex_ids(record)
+            elif field == 'vertices':
+                sample[field] = self.vertices(record["Mesh"], record)
+            else:
+                sample[field] = self._view_image(record, field)
+        return sample
+
+    def __iter__(self):
+        return self.iterate()
+
+    def index(self, key):
+        """Return the position of the sample with a key."""
+        return self._positions[key]
+
+    def labels(self, record):
+        """Labels of the mesh of an index record, from the record or else from deformed_info.json."""
+        labels = dict(self._info_labels.get(record["Mesh"], {}))
+        labels.update((field, value) for field, value in record.items() if field not in VIEW_FIELDS)
+        return labels
+
+    def vertices(self, name, record=None):
+        """
+        Return the (V, 3) deformed vertices of a mesh: a zero-copy view of the memory map of a
+        DeformedMeshStore, or the vertices of a mesh file from the mesh cache. None if the mesh is not found.
+
+        Args:
+        - name (str): Name of the mesh.
+        - record (dict): Optional index record of a view of the mesh, whose Path or Store and Sample
+                         locate the mesh when deformed_dir does not hold it.
+        """
+        source = self._sources.get(name)
+        if source is None and record is not None:
+            if record.get("Store") is not None:
+                source = (record["Store"], int(record["Sample"]))
+            else:
+                source = record.get("Path")
+        if source is None:
+            return None
+        if isinstance(source, tuple):
+            store_dir, sample = source
+            with self._lock:
+                if store_dir not in self._stores:
+                    self._stores[store_dir] = DeformedMeshStore(store_dir)
+            return self._stores[store_dir].vertices(sample)
+        # Mesh files are loaded once for all views of the mesh
+        with self._mesh_lock:
+            return self._meshes.get(source).vertices
+
+    def prefetch_samples(self, indices):
+        """
+        Load samples on the thread pool in the background, so their images are in the cache when read.
+
+        Returns:
+        - list: One Future per sample, whose result is the sample.
+        """
+        return [self._pool().submit(self.__getitem__, index) for index in indices]
+
+    def iterate(self, indices=None, prefetch=None):
+        """
+        Iterate over samples in order, loading up to prefetch samples ahead on the thread pool.
+
+        Args:
+        - indices (iterable): Positions or keys of the samples, e.g. a shuffled permutation. None
+                              iterates over all samples.
+        - prefetch (int): Number of samples loaded ahead. None uses the prefetch of the reader.
+
+        Yields:
+        - dict: The samples, see __getitem__.
+        """
+        indices = range(len(self)) if indices is None else indices
+        prefetch = self.prefetch if prefetch is None else prefetch
+        if prefetch <= 0:
+            for index in indices:
+                yield self[index]
+            return
+
+        pending = deque()
+        for index in indices:
+            pending.append(self._pool().submit(self.__getitem__, index))
+            if len(pending) > prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        """Stop the thread pool and release the caches and memory maps."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._images.clear()
+        self._maps.clear()
+        self._stores.clear()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads)
+            return self._executor
+
+    def _map(self, path, shard=False):
+        """Memory map of a .npy file, or the uint8 memory map of a shard, opened once."""
+        with self._lock:
+            if path not in self._maps:
+                self._maps[path] = np.memmap(path, dtype=np.uint8, mode="r") if shard else np.load(path, mmap_mode="r")
+            return self._maps[path]
+
+    def _shard_member(self, record, extension):
+        shard_map = self._map(os.path.join(self.image_dir, record["Shard"]), shard=True)
+        return map_member(shard_map, record, extension)
+
+    def _cached(self, key, decode):
+        """Decoded image of the LRU cache for a key, decoding it on a miss."""
+        with self._lock:
+            if key in self._images:
+                self.hits += 1
+                self._images.move_to_end(key)
+                return self._images[key]
+            self.misses += 1
+        # Decoded outside the lock, so several threads decode at once
+        image = decode()
+        with self._lock:
+            self._images[key] = image
+            while len(self._images) > self.cache_size:
+                self._images.popitem(last=False)
+        return image
+
+    def _decode_png(self, record, field, extension, rgb):
+        import cv2
+
+        if record.get("Shard") is not None:
+            image = decode_member(extension, self._shard_member(record, extension))
+        else:
+            image = cv2.imread(os.path.join(self.image_dir, record[field]), cv2.IMREAD_UNCHANGED)
+        if rgb and image.ndim == 3:
+            # Images are stored in the BGR channel order of OpenCV
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA if image.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+        return image
+
+    def _view_image(self, record, field):
+        column, extension, rgb = _VIEW_DATA[field]
+        if record.get(column) is None and extension not in record.get("Members", {}):
+            return None
+        return self._cached((record["Key"], field), lambda: self._decode_png(record, column, extension, rgb))
+
+    def _depth(self, record):
+        members = record.get("Members", {})
+        if "depth.npy" in members:
+            return self._shard_member(record, "depth.npy")
+        if "depth.png" in members or (record.get("Depth") or "").endswith(".png"):
+            return self._cached((record["Key"], 'depth'), lambda: self._decode_png(record, "Depth", "depth.png", False))
+        if record.get("Depth") is not None:
+            # Raw depths of all views of a mesh share one .npy file
+            return self._map(os.path.join(self.image_dir, record["Depth"]))[record["DepthIndex"]]
+        return None
+
+    def _vertex_ids(self, record):
+        if "vertex_ids.npy" in record.get("Members", {}):
+            return self._shard_member(record, "vertex_ids.npy")
+        if record.get("VertexIds") is not None:
+            return self._map(os.path.join(self.image_dir, record["VertexIds"]))[record["View"]]
+        return None
@@ -1,18 +1,342 @@
+import functools
 import json
 import numpy as np
-import pandas as pd
-import trimesh
 from utils import *
+from deformed_store import DeformedMeshStore
+from run_journal import RunJournal, artifact_key, mesh_digest
+from manifest import read_beam_meta, to_frame, write_table
+from partition import partition_file
+from mesh_io import MESH_FORMATS, export_mesh, mesh_path
+from fe_solver import FE_RESOLUTION, POISSON_RATIO, SOLVERS, get_solver
+import instrumentation
+
+
+def _load(beam):
+    """The mesh of a base beam, which may be given as a function that generates or loads it."""
+    return beam() if callable(beam) else beam
+
+
+def exported_keys(output_dir, mesh_format, resume=True, partition=None):
+    """
+    Keys of the deformed meshes that a previous run exported to output_dir in mesh_format and that
+    still exist, to skip with iter_deformed_meshes.
+
+    Args:
+    - output_dir (str): Directory of the deformed meshes.
+    - mesh_format (str): Format of the deformed meshes. A store or None (see export_deformed_meshes)
+                         is written anew, so nothing is skipped.
+    - resume (bool): False skips nothing.
+    - partition (str): Name of the partition of a sharded run, whose journal is read.
+
+    Returns:
+    - frozenset: The keys of the exported meshes.
+    """
+    if not resume or mesh_format not in MESH_FORMATS:
+        return frozenset()
+    with RunJournal(output_dir, resume, partition) as journal:
+        return frozenset(journal.done_keys(lambda entry: [mesh_path(output_dir, entry["name"], mesh_format)]))
+
+
+def _first_occurrences(values):
+    """The distinct values of an array, in the order they first appear."""
+    values = np.asarray(values, dtype=np.float64)
+    _, first = np.unique(values, return_index=True)
+    return values[np.sort(first)]
+
+
+def plan_jobs(beams,
+              beam_type='cantilever',
+              num_meshes=5,
+              youngs_modulus=69000000000,
+              max_displacement=-0.03,
+              min_displacement=0.03,
+              locations=[0.9, 0.1],
+              first_job=0):
+    """
+    Expand the parameter grid into the deterministic table of all deformed meshes to generate, e.g. to
+    split it between the nodes of a sharded run with partition.partition_jobs.
+
+    The forces of every beam, load location and displacement target (num_meshes targets evenly spaced
+    from min_displacement to max_displacement) are estimated as one NumPy array in float precision.
+    Configurations that give the same deformed mesh are planned once, at their first occurrence:
+    repeated locations and displacement targets, equal forces at a location, zero forces, which leave
+    the beam undeformed wherever they are applied, and, for a cantilever, whose load is always at its
+    free end with either solver, every location after the first.
+
+    Args:
+    - beams (list or DataFrame): Records of the base beams with their Name, Height and Width, e.g. from
+                                 base_beam_generator.beam_grid or the beams table of the manifest.
+    - first_job (int): Number of the first job.
+    - The remaining arguments are those of generate_deformed_meshes.
+
+    Returns:
+    - DataFrame: The jobs table of the manifest, one row per job with the Job number, the base Beam
+                 name, the BeamType, the load Location and Force, E and I, in the order the deformed
+                 meshes are generated: beam by beam, then location by location.
+    """
+    import pandas as pd
+
+    beams = beams if isinstance(beams, pd.DataFrame) else pd.DataFrame(list(beams))
+    if len(beams) == 0:
+        return to_frame("jobs", [])
+    names = beams["Name"].to_numpy(dtype=object)
+    moment_inertia = beams["Height"].to_numpy(dtype=np.float64) * beams["Width"].to_numpy(dtype=np.float64) ** 3 / 12
+    locations = _first_occurrences(locations)
+    displacements = _first_occurrences(np.linspace(min_displacement, max_displacement, num_meshes))
+
+    # (beams, locations, displacements) grid of forces; adding 0.0 turns -0.0 into 0.0
+    if beam_type == 'simple_support':
+        forces = simple_support_beam_force_estimation(1, displacements[None, None, :], youngs_modulus,
+                                                      moment_inertia[:, None, None], locations[None, :, None])
+    else:  # For 'cantilever'
+        forces = cantilever_power_estimation(1, displacements[None, None, :], youngs_modulus,
+                                             moment_inertia[:, None, None])
+        forces = np.broadcast_to(forces, (len(names), len(locations), len(displacements)))
+    forces = forces + 0.0
+
+    keep = np.ones(forces.shape, dtype=bool)
+    if beam_type == 'cantilever':
+        # Both solvers load a cantilever at its free end, whatever the location
+        keep[:, 1:] = False
+    # Equal forces at a location: flag all but the first of each run of a stable sort
+    order = np.argsort(forces, axis=2, kind="stable")
+    sorted_forces = np.take_along_axis(forces, order, axis=2)
+    repeated = np.zeros(forces.shape, dtype=bool)
+    np.put_along_axis(repeated, order[:, :, 1:], sorted_forces[:, :, 1:] == sorted_forces[:, :, :-1], axis=2)
+    keep &= ~repeated
+    # Zero forces at any location give the same mesh as the first one of the beam
+    zero = (forces == 0) & keep
+    keep &= ~zero | (np.cumsum(zero.reshape(len(names), -1), axis=1).reshape(forces.shape) == 1)
+
+    beam_index, location_index, _ = np.nonzero(keep)
+    jobs = pd.DataFrame({
+        "Job": first_job + np.arange(len(beam_index)),
+        "Beam": names[beam_index],
+        "BeamType": beam_type,
+        "Location": locations[location_index],
+        "Force": forces[keep],
+        "E": float(youngs_modulus),
+        "I": moment_inertia[beam_index],
+    })
+    return to_frame("jobs", jobs)
+
+
+def iter_deformed_meshes(beams,
+                         beam_type='cantilever',
+                         num_meshes=5,
+                         youngs_modulus=69000000000,
+                         max_displacement=-0.03,
+                         min_displacement=0.03,
+                         locations=[0.9, 0.1],
+                         jobs=None,
+                         solver='analytic',
+                         poisson_ratio=POISSON_RATIO,
+                         fe_resolution=FE_RESOLUTION,
+                         skip_keys=frozenset()):
+    """
+    Deform base beams one at a time, without writing anything to disk.
+
+    Args:
+    - beams (iterable): (record, beam) pairs, e.g. from base_beam_generator.iter_beam_meshes or rows of
+                        the beams table of the manifest with their meshes. A record provides Name,
+                        Height and Width, and the Key of the base beam, which deformed meshes are keyed
+                        by (without a Key, by the content of the mesh). beam is a Trimesh or a function
+                        without arguments that generates or loads it, called only if a deformed mesh of
+                        the beam is not skipped. The beams are not modified.
+    - jobs (DataFrame or list): Optional jobs table of plan_jobs to run (or its rows as dicts), e.g. one
+                                partition of a sharded run. Beams without jobs are skipped. None runs
+                                every job of the beams, numbered in order.
+    - skip_keys (set): Keys of deformed meshes that are already on disk, e.g. from exported_keys. They
+                       are not computed and are yielded without their mesh.
+    - The remaining arguments are those of generate_deformed_meshes.
+
+    Yields:
+    - tuple: (sample, mesh), where sample is a dict with the Name of the deformed mesh, its Job number,
+             the base Beam name, the BeamType, the load Location and Force, E, I, the Solver and the
+             Key of its inputs, and mesh is the normalized deformed Trimesh, or None for a skipped mesh.
+    """
+    import trimesh
+
+    assert solver in SOLVERS, f"Invalid solver. Choose one of {SOLVERS}."
+    # The finite element model has inputs of its own; keys of closed-form meshes are unchanged. Its
+    # loads are split between the planes of nodes around the location, unlike those of earlier versions
+    solver_params = {} if solver == 'analytic' else dict(solver=solver, nu=poisson_ratio,
+                                                          resolution=list(fe_resolution), load="split")
+
+    beam_jobs = {} if jobs is None else dict(tuple(to_frame("jobs", jobs).groupby("Beam", sort=False)))
+    next_job = 0
+
+    for example, beam in beams:
+        if jobs is None:
+            planned = plan_jobs([example], beam_type, num_meshes, youngs_modulus, max_displacement,
+                                min_displacement, locations, next_job)
+            next_job += len(planned)
+        else:
+            planned = beam_jobs.get(example["Name"])
+        if planned is None or planned.empty:
+            continue
+        # Deformed meshes are keyed by the inputs of their base beam, so regenerating the base beams
+        # with other parameters invalidates them, and a resumed run knows the keys before it
+        # generates or loads the base beam
+        base_key = example.get("Key")
+        if not isinstance(base_key, str):
+            # Beams of legacy metadata without keys are keyed by their content
+            beam = _load(beam)
+            base_key = mesh_digest(beam)
+        fe = None
+
+        # The jobs of a load location follow each other, with their forces in order
+        for loc, loc_jobs in planned.groupby("Location", sort=False):
+            loc, forces = float(loc), loc_jobs["Force"].to_numpy(dtype=np.float64)
+            moment_inertia = float(loc_jobs["I"].iloc[0])
+
+            samples = []
+            for job, force in zip(loc_jobs["Job"].to_numpy(), forces):
+                samples.append({
+                    # The base beam name keeps the meshes of beams loaded with the same force apart
+                    "Name": f"{beam_type}_{example['Name']}_{loc}_{force}",
+                    "Job": int(job),
+                    "Beam": example["Name"],
+                    "BeamType": beam_type,
+                    "Location": loc,
+                    "Force": force,
+                    "E": youngs_modulus,
+                    "I": moment_inertia,
+                    "Solver": solver,
+                    # The base beam name is part of the key as it names the mesh file
+                    "Key": artifact_key(stage="deform", base=base_key, beam=example["Name"], beam_type=beam_type,
+                                        E=youngs_modulus, I=moment_inertia, location=loc, force=force,
+                                        **solver_params)
+                })
+            todo = np.array([sample["Key"] not in skip_keys for sample in samples], dtype=bool)
+
+            if todo.any():
+                beam = _load(beam)
+                if solver == 'fe' and fe is None:
+                    # Assembled and factorized once per base beam, for all of its load locations and forces
+                    with instrumentation.stage("deform.factorize"):
+                        fe = get_solver(beam, beam_type, youngs_modulus, poisson_ratio, fe_resolution, base_key)
+
+                # Deform the base vertices for all forces at this location in one batch. Every force is
+                # computed independently, so a job gives the same vertices in any batch.
+                with instrumentation.stage("deform.solve"):
+                    if solver == 'fe':
+                        # Cantilevers are loaded at their free end, as in batch_cantilever
+                        deformed_vertices = fe.deform(forces[todo], None if beam_type == 'cantilever' else loc)
+                    elif beam_type == 'simple_support':
+                        deformed_vertices = batch_simple_support_beam(beam.vertices, forces[todo], loc,
+                                                                      youngs_modulus, moment_inertia)
+                    else:  # For 'cantilever'
+                        deformed_vertices = batch_cantilever(beam.vertices, forces[todo], youngs_modulus,
+                                                             moment_inertia, 1)  # Assuming length = 1
+                deformed_vertices = iter(deformed_vertices)
+
+            for sample, compute in zip(samples, todo):
+                if not compute:
+                    yield sample, None
+                    continue
+                with instrumentation.stage("deform.mesh"):
+                    deformed_beam = normalize_mesh(trimesh.Trimesh(vertices=next(deformed_vertices),
+                                                                   faces=beam.faces, metadata=beam.metadata.copy(),
+                                                                   process=False))
+                instrumentation.count("deform.meshes")
+                yield sample, deformed_beam
+
+
+def export_deformed_meshes(deformed, output_dir="./deformed_beam", mesh_format='obj', resume=False,
+                           manifest_dir="./manifest", partition=None):
+    """
+    Save deformed meshes as they pass through, and write the deformations table of the manifest
+    and deformed_info.json once all of them have been consumed.
+
+    Args:
+    - deformed (iterable): (sample, mesh) pairs as yielded by iter_deformed_meshes. A mesh skipped with
+                           the skip_keys of exported_keys (None) is recorded with its existing file.
+    - output_dir (str): The directory where the deformed meshes and deformed_info.json are saved.
+    - mesh_format (str): A mesh file format of mesh_io.MESH_FORMATS, 'store' (see generate_deformed_meshes),
+                         or None to only record deformed_info.json without saving the meshes.
+    - resume (bool): Skip the export of mesh files that the journal of output_dir lists with the same
+                     inputs and that still exist. A store is always written anew.
+    - manifest_dir (str): Directory of the dataset manifest.
+    - partition (str): Name of the partition of a sharded run. The partition keeps its own journal and
+                       deformed_info.json in output_dir, and its own store in output_dir/<partition>.
+
+    Yields:
+    - tuple: The same (sample, mesh) pairs.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    deformed_info = {}
+    rows = []
+    # A store is one set of files, so the partitions of a sharded run write a store each
+    store_dir = output_dir if partition is None else os.path.join(output_dir, partition)
+    store = DeformedMeshStore(store_dir, mode="w") if mesh_format == 'store' else None
+    journal = RunJournal(output_dir, resume, partition) if mesh_format in MESH_FORMATS else None
+    num_skipped = 0
+
+    for sample, mesh in deformed:
+        with instrumentation.stage("deform.export"):
+            if store is not None:
+                # Only the vertices change between forces, so the faces are stored once per base beam
+                if sample["Beam"] not in store.beams:
+                    store.add_faces(sample["Beam"], mesh.faces)
+                deformed_beam_info = {
+                    "Store": store_dir,
+                    "Sample": store.append(sample["Beam"], sample["Location"], sample["Force"], mesh.vertices,
+                                           name=sample["Name"]),
+                }
+            elif mesh_format in MESH_FORMATS:
+                deformed_mesh_path = mesh_path(output_dir, sample['Name'], mesh_format)
+                if mesh is None or journal.is_done(sample["Key"], [deformed_mesh_path]):
+                    num_skipped += 1
+                else:
+                    export_mesh(mesh, deformed_mesh_path, mesh_format)
+                    journal.record(sample["Key"], [deformed_mesh_path], name=sample["Name"])
+                deformed_beam_info = {"Path": deformed_mesh_path}
+            else:
+                deformed_beam_info = {"Path": None}
+        deformed_beam_info["E"] = sample["E"]
+        deformed_beam_info["I"] = sample["I"]
+
+        location_info = deformed_info.setdefault(sample["Beam"], {}).setdefault(sample["Location"], {})
+        location_info[abs(sample["Force"])] = deformed_beam_info
+        # The sample passed on also references the saved mesh
+        sample.update(deformed_beam_info)
+        rows.append(sample)
+        yield sample, mesh
+
+    if store is not None:
+        store.close()
+    if journal is not None:
+        journal.close()
+    if num_skipped:
+        print(f"Skipped {num_skipped} deformed meshes already in {output_dir}")
+
+    with instrumentation.stage("manifest"):
+        write_table(manifest_dir, "deformations", rows)
+
+        json_path = os.path.join(output_dir, partition_file("deformed_info.json", partition))
+        with open(json_path, "w") as json_file:
+            json.dump(deformed_info, json_file)
 
 
 def generate_deformed_meshes(beam_type='cantilever',
-                             mesh_meta_path="./base_beams/mesh_meta.xlsx",
+                             mesh_meta_path=None,
                              output_dir="./deformed_beam",
                              num_meshes=5,
                              youngs_modulus=69000000000,
                              max_displacement=-0.03,
                              min_displacement=0.03,
-                             locations=[0.9, 0.1]):
+                             locations=[0.9, 0.1],
+                             mesh_format='obj',
+                             base_meshes=None,
+                             cache_size=32,
+                             resume=False,
+                             manifest_dir="./manifest",
+                             jobs=None,
+                             partition=None,
+                             solver='analytic',
+                             poisson_ratio=POISSON_RATIO,
+                             fe_resolution=FE_RESOLUTION):
     """
        Generate deformed meshes of beams based on provided parameters. This function can be
        utilized to deform both simple support beams and cantilevers. The deformation is calculated
@@ -23,8 +347,10 @@ def generate_deformed_meshes(beam_type='cantilever',
        - beam_type (str): Specifies the type of the beam. It can be either 'simple_support' or 'cantilever'.
                          Determines which deformation model will be used.
 
-       - mesh_meta_path (str): Path to the Excel file containing metadata about the base meshes.
-                               This metadata includes properties like width, height, and file path.
+       - mesh_meta_path (str): Optional file with metadata about the base meshes (a beams table in
+                               .parquet or .csv, or a mesh_meta.xlsx of earlier versions). This metadata
+                               includes properties like width, height, and file path. None reads the
+                               beams table of the manifest.
 
        - output_dir (str): The directory where the deformed mesh files will be saved.
 
@@ -42,62 +368,83 @@ def generate_deformed_meshes(beam_type='cantilever',
        - locations (list): A list of load locations on the beam, represented as fractions of the beam length.
                            Determines where the force is applied on the beam.
 
+       - mesh_format (str): 'obj' writes one OBJ file per deformed beam, and 'ply', 'glb' or 'npz' one
+                            binary file with float32 vertices (see base_beam_generator.generate_beam_meshes).
+                            'store' writes a binary DeformedMeshStore in output_dir that saves the faces
+                            once per base beam and a float32 vertex array per deformed beam.
+
+       - base_meshes (dict): Optional base beams keyed by name, as returned by generate_beam_meshes.
+                             They are used directly instead of loading the mesh files from disk.
+
+       - cache_size (int): Maximum number of base meshes kept in the in-memory LRU cache.
+
+       - resume (bool): Keep the mesh files of a previous run in output_dir whose base beam, load and
+                        material are unchanged instead of computing and exporting them again. Base
+                        beams whose deformed meshes are all kept are not loaded.
+
+       - manifest_dir (str): Directory of the dataset manifest. The beams table is read from it and the
+                             deformations table is written to it.
+
+       - jobs (DataFrame or list): Optional jobs table of plan_jobs to run, e.g. one partition of a sharded
+                                   run. Only the base beams of these jobs are loaded. None deforms every
+                                   beam of the beams table.
+
+       - partition (str): Name of the partition of a sharded run, see export_deformed_meshes.
+
+       - solver (str): 'analytic' applies the closed-form Euler-Bernoulli deflection of a uniform beam
+                       with moment of inertia I. 'fe' solves a linear-elastic finite element model of
+                       the volume of each base beam (see fe_solver.FESolver), for tapered, hollow or
+                       imported geometries. Its stiffness matrix is factorized once per base beam and
+                       all forces at a load location are solved as one batch.
+
+       - poisson_ratio (float): Poisson's ratio of the material, for solver='fe'.
+
+       - fe_resolution (tuple): Number of hexahedral elements along the length, height and width of
+                                each base beam, for solver='fe'.
+
        Returns:
        - str: Path to the JSON file containing metadata about the deformed beams, including the path
               to the mesh file, the modulus of elasticity used, and the moment of inertia.
        """
 
     assert beam_type in ['simple_support', 'cantilever'], "Invalid beam_type. Choose 'simple_support' or 'cantilever'."
+    assert mesh_format in MESH_FORMATS + ['store'], f"Invalid mesh_format. Choose one of {MESH_FORMATS + ['store']}."
 
-    mesh_meta = pd.read_excel(mesh_meta_path)
-    os.makedirs(output_dir, exist_ok=True)
-    deformed_info = {}
+    mesh_meta = read_beam_meta(mesh_meta_path or manifest_dir)
 
-    for _, example in mesh_meta.iterrows():
-        moment_inertia = example.Height * (example.Width ** 3) / 12
-        location_info = {}
+    # Each base beam is read from disk (or taken from base_meshes) once and never modified;
+    # deformations are computed on copies of its vertices.
+    cache = BaseMeshCache(cache_size)
+    for name, mesh in (base_meshes or {}).items():
+        cache.put(name, mesh)
 
-        for loc in locations:
-            if beam_type == 'simple_support':
-                max_force = simple_support_beam_force_estimation(1, max_displacement, youngs_modulus, moment_inertia,
-                                                                 loc)
-                min_force = simple_support_beam_force_estimation(1, min_displacement, youngs_modulus, moment_inertia,
-                                                                 loc)
-            else:  # For 'cantilever'
-                max_force = cantilever_power_estimation(1, max_displacement, youngs_modulus, moment_inertia)
-                min_force = cantilever_power_estimation(1, min_displacement, youngs_modulus, moment_inertia)
+    # The columns are read as arrays at once instead of building a Series per row
+    columns = [mesh_meta[column].to_numpy() for column in ["Name", "Path", "Height", "Width", "Key"]]
 
-            forces = np.linspace(min_force, max_force, num_meshes)
-            power_info = {}
+    needed = None if jobs is None else set(to_frame("jobs", jobs)["Beam"])
 
-            for force in forces:
-                beam = trimesh.load_mesh(example.Path)
+    def load(key):
+        with instrumentation.stage("deform.load"):
+            return cache.get(key)
 
-                if beam_type == 'simple_support':
-                    deformed_beam = simple_support_beam(beam, force, loc, youngs_modulus, moment_inertia)
-                else:  # For 'cantilever'
-                    deformed_beam = cantilever(beam, force, youngs_modulus, moment_inertia, 1)  # Assuming length = 1
-                N_deformed_beam = normalize_mesh(deformed_beam)
+    def base_beams():
+        for name, path, height, width, key in zip(*columns):
+            if needed is not None and name not in needed:
+                continue
+            # Loaded only if one of its deformed meshes is not on disk yet
+            beam = functools.partial(load, name if name in cache else path)
+            yield {"Name": name, "Height": height, "Width": width, "Key": key}, beam
 
-                deformed_mesh_path = f"{output_dir}/{beam_type}_beam{loc}_{force}.obj"
-                N_deformed_beam.export(deformed_mesh_path, file_type="obj")
-
-                deformed_beam_info = {
-                    "Path": deformed_mesh_path,
-                    "E": youngs_modulus,
-                    "I": moment_inertia
-                }
-                power_info[abs(force)] = deformed_beam_info
-
-            location_info[loc] = power_info
-
-        deformed_info[example.Name] = location_info
-
-    json_path = os.path.join(output_dir, "deformed_info.json")
-    with open(json_path, "w") as json_file:
-        json.dump(deformed_info, json_file)
+    deformed = iter_deformed_meshes(base_beams(), beam_type, num_meshes, youngs_modulus, max_displacement,
+                                    min_displacement, locations, jobs, solver, poisson_ratio, fe_resolution,
+                                    exported_keys(output_dir, mesh_format, resume, partition))
+    for _ in export_deformed_meshes(deformed, output_dir, mesh_format, resume, manifest_dir, partition):
+        pass
 
+    json_path = os.path.join(output_dir, partition_file("deformed_info.json", partition))
     print("Deformed beam information saved as JSON file:", json_path)
     return json_path
 
-generate_deformed_meshes()
\ No newline at end of file
+
+if __name__ == "__main__":
+    generate_deformed_meshes()
@@ -0,0 +1,154 @@
+import json
+import os
+
+import numpy as np
+
+
+class DeformedMeshStore:
+    """
+    Binary store for deformed beams that share the topology of their base beam.
+
+    The faces of every base beam are saved once, and each deformed sample only adds its
+    float32 vertex array to a single flat file. An index maps (beam name, location, force)
+    to the row offset of the sample, so samples can be read back as zero-copy views of an
+    np.memmap without parsing any OBJ text.
+
+    Layout of a store directory:
+    - faces/<beam_name>.npy: int32 (F, 3) faces of a base beam.
+    - vertices.f32: float32 vertices of all samples, concatenated row by row.
+    - index.json: beam entries and the list of samples with their offsets.
+    """
+
+    VERTICES_FILE = "vertices.f32"
+    INDEX_FILE = "index.json"
+    FACES_DIR = "faces"
+
+    def __init__(self, path, mode="r"):
+        """
+        Open a store for reading ('r') or create a new one for writing ('w').
+
+        Args:
+        - path (str): Directory of the store.
+        - mode (str): 'r' to read an existing store, 'w' to write a new one.
+        """
+        assert mode in ["r", "w"], "Invalid mode. Choose 'r' or 'w'."
+        self.path = path
+        self.mode = mode
+        self._vertices = None
+
+        if mode == "w":
+            os.makedirs(os.path.join(path, self.FACES_DIR), exist_ok=True)
+            self.beams = {}
+            self.samples = []
+            self._num_rows = 0
+            self._vertex_file = open(os.path.join(path, self.VERTICES_FILE), "wb")
+        else:
+            with open(os.path.join(path, self.INDEX_FILE)) as index_file:
+                index = json.load(index_file)
+            self.beams = index["beams"]
+            self.samples = index["samples"]
+            self._num_rows = index["num_rows"]
+            self._vertex_file = None
+
+        self._lookup = {(s["beam"], s["location"], s["force"]): i for i, s in enumerate(self.samples)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.samples)
+
+    @staticmethod
+    def is_store(path):
+        """Return True if the directory contains a deformed mesh store."""
+        return os.path.isfile(os.path.join(path, DeformedMeshStore.INDEX_FILE)) and \
+            os.path.isfile(os.path.join(path, DeformedMeshStore.VERTICES_FILE))
+
+    def add_faces(self, beam_name, faces):
+        """
+        Save the faces of a base beam. Every sample of that beam shares them.
+
+        Args:
+        - beam_name (str): Name of the base beam, e.g. 'beam_0000'.
+        - faces (numpy.array): (F, 3) triangle indices.
+        """
+        faces_path = os.path.join(self.FACES_DIR, f"{beam_name}.npy")
+        np.save(os.path.join(self.path, faces_path), np.asarray(faces, dtype=np.int32))
+        self.beams[beam_name] = {"faces": faces_path, "num_vertices": None}
+
+    def append(self, beam_name, location, force, vertices, name=None):
+        """
+        Append the vertices of one deformed sample.
+
+        Args:
+        - beam_name (str): Name of the base beam whose faces the sample uses.
+        - location (float): Load location of the sample.
+        - force (float): Load of the sample.
+        - vertices (numpy.array): (V, 3) deformed vertices, stored as float32.
+        - name (str): Optional sample name, used for example as the name of its image directory.
+
+        Returns:
+        - int: Index of the new sample.
+        """
+        assert beam_name in self.beams, f"Faces of {beam_name} must be added before its samples."
+        vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+        beam = self.beams[beam_name]
+        if beam["num_vertices"] is None:
+            beam["num_vertices"] = len(vertices)
+        assert beam["num_vertices"] == len(vertices), "Samples of a beam must share its topology."
+
+        self._vertex_file.write(vertices.tobytes())
+        sample = {
+            "name": name,
+            "beam": beam_name,
+            "location": float(location),
+            "force": float(force),
+            "offset": self._num_rows,
+            "num_vertices": len(vertices)
+        }
+        self._num_rows += len(vertices)
+        self.samples.append(sample)
+        self._lookup[(beam_name, sample["location"], sample["force"])] = len(self.samples) - 1
+        return len(self.samples) - 1
+
+    def close(self):
+        """Flush the vertex file and write the index. Does nothing for a store opened for reading."""
+        if self._vertex_file is None:
+            return
+        self._vertex_file.close()
+        self._vertex_file = None
+        index = {"beams": self.beams, "samples": self.samples, "num_rows": self._num_rows}
+        with open(os.path.join(self.path, self.INDEX_FILE), "w") as index_file:
+            json.dump(index, index_file)
+
+    def find(self, beam_name, location, force):
+        """Return the index of the sample for a (beam name, location, force) triple."""
+        return self._lookup[(beam_name, float(location), float(force))]
+
+    def faces(self, beam_name):
+        """Return the (F, 3) faces of a base beam as a read-only memory map."""
+        return np.load(os.path.join(self.path, self.beams[beam_name]["faces"]), mmap_mode="r")
+
+    def vertices(self, sample):
+        """Return the (V, 3) float32 vertices of a sample as a zero-copy view of the memory map."""
+        if self._vertices is None:
+            assert self.mode == "r", "Vertices can only be read from a store opened with mode 'r'."
+            if self._num_rows == 0:
+                # An empty file cannot be memory-mapped, e.g. the store of a partition without meshes
+                self._vertices = np.zeros((0, 3), dtype=np.float32)
+            else:
+                self._vertices = np.memmap(os.path.join(self.path, self.VERTICES_FILE), dtype=np.float32,
+                                           mode="r", shape=(self._num_rows, 3))
+        s = self.samples[sample]
+        return self._vertices[s["offset"]:s["offset"] + s["num_vertices"]]
+
+    def to_trimesh(self, sample):
+        """Build a Trimesh of a sample from the shared faces and its vertices."""
+        import trimesh
+
+        s = self.samples[sample]
+        return trimesh.Trimesh(vertices=np.array(self.vertices(sample)), faces=np.array(self.faces(s["beam"])),
+                               process=False)
@@ -0,0 +1,302 @@
+import itertools
+
+import numpy as np
+
+from utils import BaseMeshCache
+
+
+SOLVERS = ['analytic', 'fe']
+
+# Default number of hexahedral elements along the length, height and width of a beam
+FE_RESOLUTION = (64, 8, 8)
+
+# Poisson's ratio of aluminium, the material of the default Young's modulus
+POISSON_RATIO = 0.33
+
+# Corners of a hexahedral element as (i, j, k) offsets on the node grid, in the order of its 24 dofs
+CORNERS = np.array(list(itertools.product((0, 1), repeat=3)))
+
+# Factorized solvers of the most recently used base beams
+_solvers = BaseMeshCache(8)
+
+
+def elasticity_matrix(youngs_modulus, poisson_ratio):
+    """
+    Isotropic linear-elastic material matrix for strains (xx, yy, zz, xy, yz, zx), with engineering shear strains.
+    """
+    lam = youngs_modulus * poisson_ratio / ((1 + poisson_ratio) * (1 - 2 * poisson_ratio))
+    mu = youngs_modulus / (2 * (1 + poisson_ratio))
+    D = np.zeros((6, 6))
+    D[:3, :3] = lam
+    D[:3, :3] += 2 * mu * np.eye(3)
+    D[3:, 3:] = mu * np.eye(3)
+    return D
+
+
+def _strain_matrix(gradients):
+    """Strain-displacement matrix (6, 3 * n) of n shape functions with (n, 3) gradients."""
+    B = np.zeros((6, 3 * len(gradients)))
+    dx, dy, dz = gradients.T
+    B[0, 0::3], B[1, 1::3], B[2, 2::3] = dx, dy, dz
+    B[3, 0::3], B[3, 1::3] = dy, dx
+    B[4, 1::3], B[4, 2::3] = dz, dy
+    B[5, 0::3], B[5, 2::3] = dz, dx
+    return B
+
+
+def hex_stiffness(size, youngs_modulus=1.0, poisson_ratio=POISSON_RATIO):
+    """
+    Stiffness matrix of a box-shaped 8-node hexahedral element with incompatible modes.
+
+    The trilinear element locks in bending: it cannot represent the curvature of a bent beam with a few
+    elements through the thickness. Nine incompatible bubble modes (1 - xi^2, ... for each displacement)
+    add that curvature and are condensed out, so the element keeps its 24 corner dofs. On a regular
+    grid every element has the same matrix, which is computed once.
+
+    Args:
+    - size (tuple): Edge lengths of the element along x, y and z.
+    - youngs_modulus (float): Young's modulus of the material.
+    - poisson_ratio (float): Poisson's ratio of the material.
+
+    Returns:
+    - numpy.array: (24, 24) stiffness matrix, dofs ordered (x, y, z) per corner of CORNERS.
+    """
+    D = elasticity_matrix(youngs_modulus, poisson_ratio)
+    # Derivatives of the natural coordinates in [-1, 1] with respect to x, y and z
+    scale = 2 / np.asarray(size, dtype=np.float64)
+    signs = 2 * CORNERS - 1
+    K = np.zeros((33, 33))
+    # 2x2x2 Gauss quadrature integrates the products of these polynomials exactly
+    for point in itertools.product((-1 / np.sqrt(3), 1 / np.sqrt(3)), repeat=3):
+        point = np.array(point)
+        # Gradients of the trilinear shape functions (1 + xi xi_i)(1 + eta eta_i)(1 + zeta zeta_i) / 8
+        factors = 1 + signs * point
+        gradients = np.empty((8, 3))
+        for axis in range(3):
+            others = [a for a in range(3) if a != axis]
+            gradients[:, axis] = signs[:, axis] * factors[:, others].prod(axis=1) / 8 * scale[axis]
+        # Gradients of the bubble modes 1 - xi^2, 1 - eta^2 and 1 - zeta^2
+        bubbles = np.diag(-2 * point * scale)
+        B = np.hstack([_strain_matrix(gradients), _strain_matrix(bubbles)])
+        K += B.T @ D @ B * np.prod(1 / scale)
+    # Static condensation of the 9 internal dofs
+    return K[:24, :24] - K[:24, 24:] @ np.linalg.solve(K[24:, 24:], K[24:, :24])
+
+
+def _inside(mesh, points, direction_offset=(np.sqrt(2) * 1e-7, np.sqrt(3) * 1e-7)):
+    """
+    Test which points lie inside a closed mesh by the parity of the crossings of rays along +x.
+
+    Points on rays of the same (y, z) share their crossings, as for the centers of a column of grid
+    cells. The rays are shifted by a tiny offset so they do not pass exactly through the edges of
+    axis-aligned meshes.
+    """
+    triangles = mesh.triangles[:, :, 1:] - np.asarray(direction_offset) * mesh.scale
+    xs = mesh.triangles[:, :, 0]
+    (y0, z0), (y1, z1), (y2, z2) = triangles[:, 0].T, triangles[:, 1].T, triangles[:, 2].T
+    area = (y1 - y0) * (z2 - z0) - (y2 - y0) * (z1 - z0)
+    # Triangles parallel to the rays are never crossed
+    keep = np.abs(area) > 1e-300
+    y0, z0, y1, z1, y2, z2, area, xs = y0[keep], z0[keep], y1[keep], z1[keep], y2[keep], z2[keep], area[keep], xs[keep]
+
+    inside = np.zeros(len(points), dtype=bool)
+    rays, ray_index = np.unique(points[:, 1:], axis=0, return_inverse=True)
+    ray_index = ray_index.ravel()
+    for r, (y, z) in enumerate(rays):
+        # Barycentric coordinates of the ray in the (y, z) projection of every triangle
+        w1 = ((y - y0) * (z2 - z0) - (y2 - y0) * (z - z0)) / area
+        w2 = ((y1 - y0) * (z - z0) - (y - y0) * (z1 - z0)) / area
+        hit = (w1 >= 0) & (w2 >= 0) & (w1 + w2 <= 1)
+        crossings = (1 - w1[hit] - w2[hit]) * xs[hit, 0] + w1[hit] * xs[hit, 1] + w2[hit] * xs[hit, 2]
+        on_ray = np.flatnonzero(ray_index == r)
+        beyond = (crossings[None, :] > points[on_ray, :1]).sum(axis=1)
+        inside[on_ray] = beyond % 2 == 1
+    return inside
+
+
+class FESolver:
+    """
+    Linear-elastic finite element model of a beam mesh, factorized once for all of its loads.
+
+    The volume of the mesh is discretized on a regular grid of hexahedral elements over its bounding
+    box; an element belongs to the beam if its center is inside the mesh, so tapered, hollow and
+    imported geometries get their own stiffness. The beam lies along x, like the beams of
+    beam_generator. The stiffness matrix is assembled and LU-factorized once; every load is then a
+    right-hand side of the factorization, and the displacements of the grid nodes are interpolated
+    trilinearly to the vertices of the mesh.
+
+    A cantilever is clamped at its x-min end and loaded at its free end, as in batch_cantilever. A
+    simply supported beam rests on a pinned line and a roller line along the bottom edges of its two
+    ends, and is loaded at a fraction of its length, as in batch_simple_support_beam. A load between
+    two planes of nodes is split between them in proportion to its distance, so it acts at the
+    requested location and not at the nearest plane. The load is spread evenly over the nodes of the
+    cross-section and points along +y, so positive forces bend the beam the same way as the
+    closed-form models.
+
+    Unlike the closed-form models, which use the moment of inertia they are given, the stiffness
+    follows the geometry, so the deflections of a beam can differ from those of the closed-form
+    models with the same force.
+    """
+
+    def __init__(self, mesh, beam_type='cantilever', youngs_modulus=69000000000, poisson_ratio=POISSON_RATIO,
+                 resolution=FE_RESOLUTION):
+        """
+        Args:
+        - mesh (Trimesh): Closed mesh of the undeformed beam. Not modified.
+        - beam_type (str): 'cantilever' or 'simple_support', which sets the supports.
+        - youngs_modulus (float): Young's modulus of the material.
+        - poisson_ratio (float): Poisson's ratio of the material.
+        - resolution (tuple): Number of elements along x, y and z.
+        """
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.linalg import splu
+        from scipy.spatial import cKDTree
+
+        assert beam_type in ['simple_support', 'cantilever'], "Invalid beam_type. Choose 'simple_support' or 'cantilever'."
+        self.beam_type = beam_type
+        self.vertices = np.asarray(mesh.vertices, dtype=np.float64)
+        counts = np.asarray(resolution, dtype=np.int64)
+        origin, extent = mesh.bounds[0], mesh.bounds[1] - mesh.bounds[0]
+        self.length = extent[0]
+        size = extent / counts
+
+        # Elements whose center is inside the mesh
+        cells = np.indices(counts).reshape(3, -1).T
+        centers = origin + (cells + 0.5) * size
+        inside = _inside(mesh, centers)
+        cells, centers = cells[inside], centers[inside]
+        assert len(cells), f"No element of the {tuple(counts)} grid is inside the mesh."
+
+        # Number the nodes of these elements only
+        grid_nodes = cells[:, None, :] + CORNERS[None]
+        node_ids = np.ravel_multi_index(grid_nodes.reshape(-1, 3).T, counts + 1)
+        used, elements = np.unique(node_ids, return_inverse=True)
+        elements = elements.reshape(-1, 8)
+        self.nodes = np.stack(np.unravel_index(used, counts + 1), axis=1)
+        self.num_dofs = 3 * len(used)
+
+        # Assemble the stiffness matrix from the single element matrix
+        Ke = hex_stiffness(size, youngs_modulus, poisson_ratio)
+        edofs = (3 * elements[:, :, None] + np.arange(3)).reshape(-1, 24)
+        rows = np.repeat(edofs, 24, axis=1).ravel()
+        columns = np.tile(edofs, (1, 24)).ravel()
+        K = coo_matrix((np.tile(Ke.ravel(), len(edofs)), (rows, columns)), shape=(self.num_dofs,) * 2).tocsc()
+
+        # Supports
+        fixed = np.zeros((len(used), 3), dtype=bool)
+        i = self.nodes[:, 0]
+        if beam_type == 'cantilever':
+            fixed[i == 0] = True
+        else:
+            left, right = self._bottom_line(i == 0), self._bottom_line(i == counts[0])
+            fixed[left] = True  # Pin
+            fixed[right, 1:] = True  # Roller along x
+        self.free = np.flatnonzero(~fixed.ravel())
+        self.lu = splu(K[self.free][:, self.free].tocsc(), permc_spec="MMD_AT_PLUS_A")
+
+        # Interpolation of the node displacements to the vertices, from the element around each vertex.
+        # Vertices whose element is outside the mesh extrapolate from the nearest element inside.
+        local = (self.vertices - origin) / size
+        cell = np.clip(np.floor(local), 0, counts - 1).astype(np.int64)
+        cell_index = {tuple(c): e for e, c in enumerate(cells)}
+        element = np.array([cell_index.get(tuple(c), -1) for c in cell])
+        outside = element < 0
+        if outside.any():
+            _, nearest = cKDTree(centers).query(self.vertices[outside])
+            element[outside] = nearest
+            cell[outside] = cells[nearest]
+        local -= cell
+        weights = np.prod(np.where(CORNERS[None], local[:, None, :], 1 - local[:, None, :]), axis=2)
+        self.interpolation = coo_matrix((weights.ravel(), (np.repeat(np.arange(len(cell)), 8),
+                                                           elements[element].ravel())),
+                                        shape=(len(cell), len(used))).tocsr()
+        self.counts = counts
+
+    def _bottom_line(self, plane):
+        """Nodes of a plane of the node grid with the lowest y of the plane."""
+        j = self.nodes[:, 1]
+        return plane & (j == j[plane].min())
+
+    def load_vectors(self, forces, location=None):
+        """
+        Load vectors of the free dofs of point loads at one location.
+
+        Args:
+        - forces (array-like): Forces along +y.
+        - location (float): Position of the load as a fraction of the length, for a simply supported
+                            beam. A cantilever is only loaded at its free end, like batch_cantilever,
+                            and takes no location.
+
+        Returns:
+        - numpy.array: (num_free_dofs, len(forces)) load vectors.
+        """
+        forces = np.atleast_1d(np.asarray(forces, dtype=np.float64))
+        if self.beam_type == 'cantilever':
+            assert location is None, "A cantilever is loaded at its free end; pass no location."
+            position = self.counts[0]
+        else:
+            assert location is not None, "A simply supported beam needs the location of its load."
+            position = np.clip(location, 0, 1) * self.counts[0]
+        # Share of the load of the planes of nodes before and after the location
+        i = min(int(np.floor(position)), self.counts[0] - 1)
+        unit = np.zeros(self.num_dofs)
+        for plane_index, share in [(i, i + 1 - position), (i + 1, position - i)]:
+            plane = np.flatnonzero(self.nodes[:, 0] == plane_index)
+            if share > 0:
+                assert len(plane), f"No node of the mesh at the load location {location}."
+                unit[3 * plane + 1] += share / len(plane)
+        return unit[self.free, None] * forces[None, :]
+
+    def solve(self, loads):
+        """
+        Solve for the displacements of the free dofs under a batch of load vectors at once.
+
+        Args:
+        - loads (numpy.array): (num_free_dofs, n_loads) load vectors, e.g. from load_vectors.
+
+        Returns:
+        - numpy.array: (num_free_dofs, n_loads) displacements.
+        """
+        return self.lu.solve(np.asarray(loads, dtype=np.float64))
+
+    def deform(self, forces, location=None):
+        """
+        Compute the deformed vertex sets of the mesh for a batch of point loads at one location,
+        like batch_cantilever and batch_simple_support_beam.
+
+        Args:
+        - forces (float or array-like): One point load or a vector of n_loads point loads.
+        - location (float): Position of the loads as a fraction of the length, for a simply supported
+                            beam only, see load_vectors.
+
+        Returns:
+        - numpy.array: (n_loads, V, 3) deformed vertices, one set per load.
+        """
+        free_displacements = self.solve(self.load_vectors(forces, location))
+        displacements = np.zeros((self.num_dofs, free_displacements.shape[1]))
+        displacements[self.free] = free_displacements
+        # (nodes, 3, n_loads) -> (n_loads, V, 3)
+        nodes = displacements.reshape(-1, 3 * free_displacements.shape[1])
+        vertex_displacements = (self.interpolation @ nodes).reshape(len(self.vertices), 3, -1)
+        return self.vertices[None] + vertex_displacements.transpose(2, 0, 1)
+
+
+def get_solver(mesh, beam_type='cantilever', youngs_modulus=69000000000, poisson_ratio=POISSON_RATIO,
+               resolution=FE_RESOLUTION, key=None):
+    """
+    Return the FESolver of a mesh from the cache of recently used solvers, building and factorizing it on a miss.
+
+    Args:
+    - mesh (Trimesh): Closed mesh of the undeformed beam.
+    - key (str): Key identifying the mesh, e.g. the key of its base beam or run_journal.mesh_digest.
+                 Computed with mesh_digest if None.
+    - The remaining arguments are those of FESolver.
+
+    Returns:
+    - FESolver: The factorized solver.
+    """
+    if key is None:
+        from run_journal import mesh_digest
+        key = mesh_digest(mesh)
+    return _solvers.get((key, beam_type, youngs_modulus, poisson_ratio, tuple(resolution)),
+                        loader=lambda _: FESolver(mesh, beam_type, youngs_modulus, poisson_ratio, resolution))
@@ -0,0 +1,114 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncImageWriter:
+    """
+    Encode and write images on a pool of writer threads behind a bounded queue.
+
+    The render loop only hands arrays over and continues with the next view while PNG
+    encoding and disk writes run in the background. OpenCV releases the GIL while encoding,
+    so the writer threads overlap with rendering. When max_pending writes are queued the
+    next call blocks until one finishes, which keeps memory bounded on large runs.
+    """
+
+    def __init__(self, threads=2, max_pending=8, png_compression=3):
+        """
+        Args:
+        - threads (int): Number of writer threads.
+        - max_pending (int): Maximum number of images queued or being written at once.
+        - png_compression (int): zlib level of the PNG encoder, from 0 (fastest, largest files)
+                                 to 9 (slowest, smallest files).
+        """
+        import cv2
+
+        assert 0 <= png_compression <= 9, "png_compression must be between 0 and 9."
+        self.png_params = [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, fn, *args):
+        """
+        Run fn(*args) on a writer thread, blocking while the queue is full.
+
+        The arguments must not be modified by the caller after they are handed over.
+
+        Returns:
+        - Future: Completes when fn has returned.
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def write_png(self, path, image, rgb=False):
+        """
+        Queue an image to be written as PNG.
+
+        Args:
+        - path (str): Output path of the image.
+        - image (numpy.array): (H, W) or (H, W, C) uint8 or uint16 image.
+        - rgb (bool): True if the channels are in RGB order, as returned by pyrender.
+
+        Returns:
+        - Future: Completes when the image is on disk.
+        """
+        return self.submit(self.save_png, path, image, rgb)
+
+    def save_png(self, path, image, rgb=False):
+        """Write an image as PNG with the compression level of the writer, e.g. on a writer thread."""
+        import cv2
+
+        if not cv2.imwrite(path, self._to_bgr(image, rgb), self.png_params):
+            raise IOError(f"Could not write image {path}")
+
+    def encode_png(self, image, rgb=False):
+        """
+        Encode an image as PNG with the compression level of the writer, e.g. on a writer thread.
+
+        Args:
+        - image (numpy.array): (H, W) or (H, W, C) uint8 or uint16 image.
+        - rgb (bool): True if the channels are in RGB order, as returned by pyrender.
+
+        Returns:
+        - bytes: The encoded PNG.
+        """
+        import cv2
+
+        ok, encoded = cv2.imencode(".png", self._to_bgr(image, rgb), self.png_params)
+        if not ok:
+            raise IOError("Could not encode image")
+        return encoded.tobytes()
+
+    @staticmethod
+    def _to_bgr(image, rgb):
+        import cv2
+
+        if rgb and image.ndim == 3:
+            # OpenCV expects BGR channel order
+            image = cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA if image.shape[2] == 4 else cv2.COLOR_RGB2BGR)
+        return image
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception() is not None:
+            with self._lock:
+                self._errors.append(future.exception())
+
+    def close(self):
+        """Wait for all queued images to be written and re-raise the first write error, if any."""
+        self._executor.shutdown(wait=True)
+        if self._errors:
+            raise self._errors[0]
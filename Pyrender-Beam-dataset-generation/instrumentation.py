@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Totals of every stage keyed by name, and counters keyed by name. Stages are timed in every thread;
+# each thread keeps its own stack of open stages, so a stage only subtracts the time of stages it
+# opened itself from its self time.
+_stages = {}
+_counters = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block of a pipeline stage, e.g. with stage("render.draw"): ...
+
+    Every entry adds one call and its wall time to the totals of the stage. The self time excludes the
+    time spent in stages opened inside the block by the same thread, so the self times of nested
+    stages add up to the time of the outermost one. The overhead is about a microsecond per block.
+
+    Args:
+    - name (str): Name of the stage. Dots separate sub-stages, e.g. 'deform.solve' and 'deform.export'.
+    """
+    active = getattr(_local, "active", None)
+    if active is None:
+        active = _local.active = []
+    # Time spent in nested stages is added to the last element
+    frame = [0.0]
+    active.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        active.pop()
+        if active:
+            active[-1][0] += elapsed
+        with _lock:
+            totals = _stages.setdefault(name, {"calls": 0, "seconds": 0.0, "self_seconds": 0.0})
+            totals["calls"] += 1
+            totals["seconds"] += elapsed
+            totals["self_seconds"] += elapsed - frame[0]
+
+
+def count(name, value=1):
+    """Add value to a counter, e.g. count("render.images")."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def peak_rss_mb(children=False):
+    """
+    Peak resident set size in MiB of this process, or of its largest finished child process (e.g. a
+    render worker) with children=True. None where the resource module is not available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+
+
+def snapshot():
+    """Return a copy of the stage totals and counters, as accepted by merge."""
+    with _lock:
+        return {"stages": {name: dict(totals) for name, totals in _stages.items()}, "counters": dict(_counters)}
+
+
+def reset():
+    """Clear all stage totals and counters."""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def take():
+    """Return the stage totals and counters and clear them, e.g. to send them from a worker process."""
+    with _lock:
+        stats = {"stages": dict(_stages), "counters": dict(_counters)}
+        _stages.clear()
+        _counters.clear()
+    return stats
+
+
+def merge(stats):
+    """Add the stage totals and counters of another process, from take or snapshot."""
+    with _lock:
+        for name, other in stats["stages"].items():
+            totals = _stages.setdefault(name, {"calls": 0, "seconds": 0.0, "self_seconds": 0.0})
+            for field in totals:
+                totals[field] += other[field]
+        for name, value in stats["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def report(**info):
+    """
+    Build a report of the stage totals, the counters and the peak memory use.
+
+    Stages that run on several threads or in render worker processes at once add up their time, so
+    their seconds can exceed the wall time of the stage around them.
+
+    Args:
+    - info: Extra fields of the report, e.g. the command that was run.
+
+    Returns:
+    - dict: The fields of info, the stages with their calls, seconds, self seconds and mean
+            milliseconds per call, the counters, and the peak RSS of the process and of its workers.
+    """
+    stats = snapshot()
+    for totals in stats["stages"].values():
+        totals["ms_per_call"] = 1000 * totals["seconds"] / totals["calls"]
+    return dict(info, **stats, peak_rss_mb=peak_rss_mb(), children_peak_rss_mb=peak_rss_mb(children=True))
+
+
+def write_report(path, **info):
+    """
+    Write report(**info) to a JSON file.
+
+    Returns:
+    - dict: The report.
+    """
+    stats = report(**info)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as report_file:
+        json.dump(stats, report_file, indent=4)
+    return stats
+
+
+def print_report(stats):
+    """Print the stages of a report as a table, slowest self time first."""
+    print(f"{'stage':<20}{'calls':>10}{'seconds':>12}{'self':>12}{'ms/call':>12}")
+    for name, totals in sorted(stats["stages"].items(), key=lambda item: -item[1]["self_seconds"]):
+        print(f"{name:<20}{totals['calls']:>10}{totals['seconds']:>12.3f}{totals['self_seconds']:>12.3f}"
+              f"{totals['ms_per_call']:>12.3f}")
+    for name, value in sorted(stats["counters"].items()):
+        print(f"{name}: {value}")
+    print(f"peak RSS: {stats['peak_rss_mb']:.1f} MiB (workers {stats['children_peak_rss_mb']:.1f} MiB)"
+          if stats["peak_rss_mb"] is not None else "peak RSS: not available")
+
+
+@contextmanager
+def profile(path=None):
+    """
+    Profile a block with cProfile and dump the statistics to path, readable with pstats or snakeviz.
+    Does nothing if path is None. Only the calling process is profiled, not render workers.
+    """
+    if path is None:
+        yield
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(path)
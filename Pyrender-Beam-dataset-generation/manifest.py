@@ -0,0 +1,235 @@
+import os
+
+
+# Typed columns of the tables of a dataset manifest. Strings are pandas nullable strings and
+# integers nullable Int64, so a missing Path or Sample is a typed NA rather than a float NaN.
+TABLES = {
+    # One row per base beam.
+    "beams": {
+        "Name": "string",
+        "Path": "string",
+        "Length": "float64",
+        "Height": "float64",
+        "Width": "float64",
+        "Key": "string",
+    },
+    # One row per deformed mesh. Path is set for OBJ files, Store and Sample for a DeformedMeshStore.
+    # Job is the number of the mesh in the job list of the run, which orders the merged manifest of a sharded run.
+    "deformations": {
+        "Name": "string",
+        "Job": "Int64",
+        "Beam": "string",
+        "BeamType": "string",
+        "Location": "float64",
+        "Force": "float64",
+        "E": "float64",
+        "I": "float64",
+        "Solver": "string",
+        "Path": "string",
+        "Store": "string",
+        "Sample": "Int64",
+        "Key": "string",
+    },
+    # One row per deformed mesh to generate, the job list of a (sharded) run from deformed_beam_generator.plan_jobs.
+    "jobs": {
+        "Job": "int64",
+        "Beam": "string",
+        "BeamType": "string",
+        "Location": "float64",
+        "Force": "float64",
+        "E": "float64",
+        "I": "float64",
+    },
+    # One row per rendered view. Depth is a PNG, or a depth.npy shard read at DepthIndex. Key is the
+    # key of the view in the render index. Views written to tar shards have no Image and Depth files
+    # but the Shard of their sample. Mask, Normals and VertexIds are set for the extra passes of the
+    # outputs argument of generate_cantilever_images; VertexIds is an array read at the View.
+    "views": {
+        "Mesh": "string",
+        "View": "int64",
+        "Image": "string",
+        "Depth": "string",
+        "DepthIndex": "Int64",
+        "Shard": "string",
+        "Key": "string",
+        "Mask": "string",
+        "Normals": "string",
+        "VertexIds": "string",
+        "Roll": "float64",
+        "Pitch": "float64",
+        "Yaw": "float64",
+    },
+}
+
+FORMATS = ['parquet', 'csv']
+
+
+def default_format():
+    """Return 'parquet' if pyarrow is installed, otherwise 'csv'."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return 'csv'
+    return 'parquet'
+
+
+def table_path(manifest_dir, table):
+    """
+    Find the file of a manifest table.
+
+    Args:
+    - manifest_dir (str): Directory of the manifest.
+    - table (str): Name of the table, a key of TABLES.
+
+    Returns:
+    - str: Path of the Parquet or CSV file of the table, or None if the table was not written.
+    """
+    for file_format in FORMATS:
+        path = os.path.join(manifest_dir, f"{table}.{file_format}")
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def to_frame(table, rows):
+    """
+    Build a typed DataFrame of a manifest table.
+
+    Args:
+    - table (str): Name of the table, a key of TABLES.
+    - rows (list or DataFrame): Rows as dicts, or a DataFrame. Extra fields are dropped and missing
+                                columns are filled with NA.
+
+    Returns:
+    - DataFrame: The rows with the columns and dtypes of the table.
+    """
+    import pandas as pd
+
+    columns = TABLES[table]
+    frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame.from_records(list(rows), columns=list(columns))
+    frame = frame.reindex(columns=list(columns))
+    return frame.astype(columns)
+
+
+def write_table(manifest_dir, table, rows, file_format=None):
+    """
+    Write a table of the manifest, replacing the previous version atomically.
+
+    Args:
+    - manifest_dir (str): Directory of the manifest.
+    - table (str): Name of the table, a key of TABLES.
+    - rows (list or DataFrame): Rows of the table, see to_frame.
+    - file_format (str): 'parquet' or 'csv'. None picks Parquet when pyarrow is installed.
+
+    Returns:
+    - str: Path of the written file.
+    """
+    file_format = file_format or default_format()
+    assert file_format in FORMATS, f"Invalid file_format. Choose one of {FORMATS}."
+
+    frame = to_frame(table, rows)
+    os.makedirs(manifest_dir, exist_ok=True)
+    path = os.path.join(manifest_dir, f"{table}.{file_format}")
+    # A reader never sees a half-written table
+    tmp_path = path + ".tmp"
+    if file_format == 'parquet':
+        frame.to_parquet(tmp_path, index=False)
+    else:
+        frame.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    # Remove a stale copy of the table in the other format
+    for other in FORMATS:
+        other_path = os.path.join(manifest_dir, f"{table}.{other}")
+        if other != file_format and os.path.isfile(other_path):
+            os.remove(other_path)
+    return path
+
+
+def read_table(manifest_dir, table, columns=None):
+    """
+    Read a table of the manifest with its typed columns.
+
+    Args:
+    - manifest_dir (str): Directory of the manifest.
+    - table (str): Name of the table, a key of TABLES.
+    - columns (list): Optional subset of columns to read. Parquet only reads these from disk.
+
+    Returns:
+    - DataFrame: The table.
+    """
+    import pandas as pd
+
+    path = table_path(manifest_dir, table)
+    if path is None:
+        raise FileNotFoundError(f"No {table} table in manifest {manifest_dir}")
+
+    dtypes = TABLES[table] if columns is None else {column: TABLES[table][column] for column in columns}
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns).astype(dtypes)
+    return pd.read_csv(path, usecols=columns, dtype=dtypes)[list(dtypes)]
+
+
+def read_beam_meta(path):
+    """
+    Read base beam metadata from a manifest directory or a metadata file (.parquet, .csv or the
+    legacy mesh_meta.xlsx).
+
+    Args:
+    - path (str): Manifest directory or metadata file.
+
+    Returns:
+    - DataFrame: Typed beams table.
+    """
+    import pandas as pd
+
+    if os.path.isdir(path):
+        return read_table(path, "beams")
+    if path.endswith(".parquet"):
+        return to_frame("beams", pd.read_parquet(path))
+    if path.endswith(".csv"):
+        return to_frame("beams", pd.read_csv(path))
+    return to_frame("beams", pd.read_excel(path))
+
+
+def read_labels(manifest_dir):
+    """
+    Read the labels of the deformed meshes: beam, beam type, load location and force, E, I and
+    the mesh reference (Path, or Store and Sample).
+
+    Args:
+    - manifest_dir (str): Directory of the manifest.
+
+    Returns:
+    - dict: Labels of every deformed mesh keyed by its name, without missing values. Empty if the
+            manifest has no deformations table.
+    """
+    import pandas as pd
+
+    if table_path(manifest_dir, "deformations") is None:
+        return {}
+    deformations = read_table(manifest_dir, "deformations")
+    records = deformations.drop(columns=["Name", "Key"]).to_dict("records")
+    return {name: {column: value for column, value in record.items() if not pd.isna(value)}
+            for name, record in zip(deformations["Name"], records)}
+
+
+def export_excel(manifest_dir, path, tables=None):
+    """
+    Write tables of the manifest to an Excel workbook, one sheet per table, as a report.
+
+    Args:
+    - manifest_dir (str): Directory of the manifest.
+    - path (str): Path of the .xlsx file.
+    - tables (list): Tables to export. None exports every table of the manifest.
+
+    Returns:
+    - str: Path of the written workbook.
+    """
+    import pandas as pd
+
+    tables = [table for table in (tables or TABLES) if table_path(manifest_dir, table) is not None]
+    with pd.ExcelWriter(path) as writer:
+        for table in tables:
+            read_table(manifest_dir, table).to_excel(writer, sheet_name=table, index=False)
+    return path
@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+
+
+# File formats of mesh files, and their extensions. 'obj' is text; the others store float32 vertices
+# in binary: binary PLY, glTF binary, and a NumPy archive of the vertex and face arrays.
+MESH_FORMATS = ['obj', 'ply', 'glb', 'npz']
+MESH_EXTENSIONS = {'obj': '.obj', 'ply': '.ply', 'glb': '.glb', 'npz': '.npz'}
+
+# Leading bytes of the binary formats
+MAGIC = {b'ply\n': 'ply', b'ply\r': 'ply', b'glTF': 'glb', b'PK\x03\x04': 'npz'}
+
+
+def mesh_path(directory, name, mesh_format='obj'):
+    """Path of the mesh file of a mesh name in a directory, e.g. deformed_beam/<name>.ply."""
+    return f"{directory}/{name}{MESH_EXTENSIONS[mesh_format]}"
+
+
+def detect_format(path):
+    """
+    Detect the format of a mesh file from its first bytes, or from its extension for text formats.
+
+    Returns:
+    - str: A format of MESH_FORMATS, or None if the file is not a mesh file of these formats.
+    """
+    with open(path, "rb") as mesh_file:
+        head = mesh_file.read(4)
+    if head in MAGIC:
+        return MAGIC[head]
+    extension = os.path.splitext(path)[1].lower()
+    return next((mesh_format for mesh_format, ext in MESH_EXTENSIONS.items() if ext == extension), None)
+
+
+def export_mesh(mesh, path, mesh_format='obj'):
+    """
+    Write a mesh to a file.
+
+    Args:
+    - mesh (Trimesh): The mesh.
+    - path (str): Path of the file, e.g. from mesh_path.
+    - mesh_format (str): A format of MESH_FORMATS.
+    """
+    assert mesh_format in MESH_FORMATS, f"Invalid mesh_format. Choose one of {MESH_FORMATS}."
+    if mesh_format == 'npz':
+        # Uncompressed, so the arrays are written and read without any encoding
+        with open(path, "wb") as mesh_file:
+            np.savez(mesh_file, vertices=np.asarray(mesh.vertices, dtype=np.float32),
+                     faces=np.asarray(mesh.faces, dtype=np.int32))
+    else:
+        mesh.export(path, file_type=mesh_format)
+
+
+def load_mesh_file(path):
+    """
+    Load a mesh file of any format of MESH_FORMATS, detected with detect_format.
+
+    OBJ files are loaded with trimesh.load_mesh as before. The binary formats are loaded without
+    processing, so the vertices and faces keep the order they were exported in.
+
+    Args:
+    - path (str): Path of the mesh file.
+
+    Returns:
+    - Trimesh: The loaded mesh.
+    """
+    import trimesh
+
+    mesh_format = detect_format(path)
+    if mesh_format == 'npz':
+        with np.load(path) as arrays:
+            return trimesh.Trimesh(vertices=arrays["vertices"].astype(np.float64), faces=arrays["faces"],
+                                   process=False)
+    if mesh_format == 'glb':
+        # A glTF file holds a scene; a single mesh is returned as is
+        return trimesh.load(path, file_type='glb', force='mesh', process=False)
+    if mesh_format == 'ply':
+        return trimesh.load_mesh(path, file_type='ply', process=False)
+    return trimesh.load_mesh(path)
+
+
+def list_mesh_files(directory):
+    """
+    List the mesh files of a directory as (name, path) pairs, in the order of os.listdir.
+
+    A name saved in several formats, e.g. by runs with different formats, is listed once, with its
+    most recently written file, so a rerun in another format replaces the files of the earlier run.
+    Files written at the same time are taken in the order of MESH_FORMATS.
+    """
+    files = {}
+    for fname in os.listdir(directory):
+        name, extension = os.path.splitext(fname)
+        mesh_format = next((mesh_format for mesh_format, ext in MESH_EXTENSIONS.items() if ext == extension), None)
+        if mesh_format is not None:
+            files.setdefault(name, {})[mesh_format] = os.path.join(directory, fname)
+
+    def newest(paths):
+        # Only names saved in several formats need the modification times
+        if len(paths) == 1:
+            return next(iter(paths.values()))
+        mesh_format = max(paths, key=lambda mesh_format: (os.path.getmtime(paths[mesh_format]),
+                                                          -MESH_FORMATS.index(mesh_format)))
+        return paths[mesh_format]
+
+    return [(name, newest(paths)) for name, paths in files.items()]
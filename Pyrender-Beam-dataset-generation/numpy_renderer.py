@@ -0,0 +1,321 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+# Where each pixel is sampled, in pixels from its top-left corner. pyrender draws into a 4x multisampled
+# framebuffer and blits its depth buffer, which keeps the first sample of the standard pattern, at
+# (0.375, 0.125) from the bottom-left corner, rather than the pixel center.
+SAMPLE_OFFSET = (0.375, 0.875)
+
+
+def rasterize(vertices, faces, camera_pose, yfov, img_size, znear=0.05, cull_back_faces=True,
+              max_candidates=1 << 22):
+    """
+    Rasterize a triangle mesh into a z-buffer with vectorized NumPy operations.
+
+    The camera follows the pyrender/OpenGL convention: it looks along the -z axis of its pose and
+    +y points up. Depth is the distance along the viewing axis, as returned by pyrender, and
+    0 marks background pixels. Triangles crossing the near plane are skipped.
+
+    Args:
+    - vertices (numpy.array): (V, 3) vertices in world coordinates.
+    - faces (numpy.array): (F, 3) triangle indices, counter-clockwise seen from outside.
+    - camera_pose (numpy.array): 4x4 camera-to-world pose.
+    - yfov (float): Vertical field of view of the camera.
+    - img_size (tuple): (width, height) of the image.
+    - znear (float): Near clipping distance.
+    - cull_back_faces (bool): Skip triangles facing away from the camera.
+    - max_candidates (int): Maximum number of candidate pixels tested at once, which bounds memory.
+
+    Returns:
+    - tuple: (depth, face_ids), (height, width) float32 depths and int64 indices of the visible
+             faces, -1 for background pixels.
+    """
+    width, height = img_size
+    focal = height / 2 / np.tan(yfov / 2)
+
+    # World to camera coordinates, then perspective projection to pixel coordinates
+    rotation = camera_pose[:3, :3]
+    points = (np.asarray(vertices, dtype=np.float64) - camera_pose[:3, 3]) @ rotation
+    z = -points[:, 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u = width / 2 + focal * points[:, 0] / z
+        v = height / 2 - focal * points[:, 1] / z
+
+    faces = np.asarray(faces)
+    tri_z = z[faces]
+    tri_u = u[faces]
+    tri_v = v[faces]
+
+    # Twice the signed area in pixel space; front faces are clockwise because the v axis points down
+    area = (tri_u[:, 1] - tri_u[:, 0]) * (tri_v[:, 2] - tri_v[:, 0]) - \
+           (tri_u[:, 2] - tri_u[:, 0]) * (tri_v[:, 1] - tri_v[:, 0])
+    keep = np.all(tri_z > znear, axis=1) & (area != 0)
+    if cull_back_faces:
+        keep &= area < 0
+
+    # Pixel bounding boxes; pixel (i, j) is covered when its sample point (i, j) + SAMPLE_OFFSET lies in
+    # the triangle
+    sample_u, sample_v = SAMPLE_OFFSET
+    x_min = np.clip(np.ceil(tri_u.min(axis=1) - sample_u), 0, width).astype(np.int64)
+    x_max = np.clip(np.floor(tri_u.max(axis=1) - sample_u), -1, width - 1).astype(np.int64)
+    y_min = np.clip(np.ceil(tri_v.min(axis=1) - sample_v), 0, height).astype(np.int64)
+    y_max = np.clip(np.floor(tri_v.max(axis=1) - sample_v), -1, height - 1).astype(np.int64)
+    keep &= (x_max >= x_min) & (y_max >= y_min)
+
+    tri_ids = np.flatnonzero(keep)
+    box_w = (x_max - x_min + 1)[tri_ids]
+    counts = box_w * (y_max - y_min + 1)[tri_ids]
+
+    depth = np.full(width * height, np.inf)
+    face_ids = np.full(width * height, -1, dtype=np.int64)
+
+    # Process the triangles in batches so the candidate pixels fit in max_candidates
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(tri_ids):
+        stop = max(start + 1, np.searchsorted(ends, (ends[start - 1] if start else 0) + max_candidates, "right"))
+        batch = np.arange(start, stop)
+        start = stop
+
+        # One candidate per pixel of each bounding box
+        batch_counts = counts[batch]
+        local_tri = np.repeat(batch, batch_counts)
+        offsets = np.arange(batch_counts.sum()) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+        tri = tri_ids[local_tri]
+        px = x_min[tri] + offsets % box_w[local_tri]
+        py = y_min[tri] + offsets // box_w[local_tri]
+
+        # Barycentric coordinates of the pixel sample points
+        x0, x1, x2 = tri_u[tri].T
+        y0, y1, y2 = tri_v[tri].T
+        cx = px + sample_u
+        cy = py + sample_v
+        denominator = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+        l0 = ((y1 - y2) * (cx - x2) + (x2 - x1) * (cy - y2)) / denominator
+        l1 = ((y2 - y0) * (cx - x2) + (x0 - x2) * (cy - y2)) / denominator
+        l2 = 1 - l0 - l1
+        inside = (l0 >= 0) & (l1 >= 0) & (l2 >= 0)
+
+        # Perspective-correct depth: 1/z is linear in screen space
+        z0, z1, z2 = tri_z[tri[inside]].T
+        candidate_depth = 1 / (l0[inside] / z0 + l1[inside] / z1 + l2[inside] / z2)
+        pixel = py[inside] * width + px[inside]
+        tri = tri[inside]
+
+        # Nearest candidate per pixel, then merge with the z-buffer
+        order = np.lexsort((candidate_depth, pixel))
+        pixel = pixel[order]
+        first = np.ones(len(pixel), dtype=bool)
+        first[1:] = pixel[1:] != pixel[:-1]
+        pixel = pixel[first]
+        candidate_depth = candidate_depth[order][first]
+        closer = candidate_depth < depth[pixel]
+        depth[pixel[closer]] = candidate_depth[closer]
+        face_ids[pixel[closer]] = tri[order][first][closer]
+
+    depth[face_ids < 0] = 0
+    return depth.reshape(height, width).astype(np.float32), face_ids.reshape(height, width)
+
+
+class NumpyScene:
+    """
+    Scene for the NumPy backend with the same interface as BeamScene in randering_img_depth:
+    one mesh, a perspective camera and a directional light shining along the view direction.
+    """
+
+    def __init__(self, yfov, light_intensity, light_color, znear=0.05):
+        """
+        Args:
+        - yfov (float): Field of view for the camera.
+        - light_intensity (float): Intensity of the directional light.
+        - light_color (numpy.array): RGB color for the light source.
+        - znear (float): Near clipping distance, the default of pyrender.PerspectiveCamera.
+        """
+        self.camera = SimpleNamespace(yfov=yfov, znear=znear, zfar=None)
+        self.light_intensity = light_intensity
+        self.light_color = np.asarray(light_color, dtype=np.float64)
+        self.mesh = None
+        self.camera_pose = np.eye(4)
+
+    def set_mesh(self, mesh):
+        """
+        Show a new mesh in the scene.
+
+        Args:
+        - mesh (Trimesh): The mesh to render.
+
+        Returns:
+        - Trimesh: The same mesh, whose bounds frame the camera.
+        """
+        self.mesh = mesh
+        return mesh
+
+    def set_pose(self, camera_pose):
+        """Move the camera and the light to a new pose."""
+        self.camera_pose = camera_pose
+
+
+class NumpyRenderer:
+    """
+    CPU renderer of NumpyScene objects producing color and depth like pyrender.OffscreenRenderer,
+    for machines without a working EGL or OSMesa context. Colors use flat Lambert shading of
+    each face under the directional light.
+    """
+
+    def __init__(self, viewport_width, viewport_height, base_color=(0.8, 0.8, 0.8), ambient=0.1):
+        """
+        Args:
+        - viewport_width (int): Width of the rendered images.
+        - viewport_height (int): Height of the rendered images.
+        - base_color (tuple): RGB albedo of the mesh.
+        - ambient (float): Ambient light added to the Lambert term.
+        """
+        self.viewport_width = viewport_width
+        self.viewport_height = viewport_height
+        self.base_color = np.asarray(base_color, dtype=np.float64)
+        self.ambient = ambient
+        self.face_ids = None
+
+    def render(self, scene):
+        """
+        Render a NumpyScene.
+
+        Args:
+        - scene (NumpyScene): Scene holding the mesh and the posed camera.
+
+        Returns:
+        - tuple: (color, depth), (H, W, 3) uint8 colors and (H, W) float32 depths. The face visible
+                 in every pixel (-1 for background) is kept in self.face_ids.
+        """
+        mesh = scene.mesh
+        depth, face_ids = rasterize(mesh.vertices, mesh.faces, scene.camera_pose, scene.camera.yfov,
+                                    (self.viewport_width, self.viewport_height), scene.camera.znear)
+
+        # Lambert term per face; the light shines along the viewing direction (-z of the camera)
+        towards_light = scene.camera_pose[:3, 2]
+        lambert = np.clip(mesh.face_normals @ towards_light, 0, None)
+        face_colors = self.base_color * (self.ambient + lambert[:, None] * scene.light_intensity * scene.light_color)
+        face_colors = np.clip(face_colors * 255, 0, 255).astype(np.uint8)
+
+        color = np.zeros(depth.shape + (3,), dtype=np.uint8)
+        visible = face_ids >= 0
+        color[visible] = face_colors[face_ids[visible]]
+        self.face_ids = face_ids
+        return color, depth
+
+    def delete(self):
+        """Nothing to free; present for compatibility with pyrender.OffscreenRenderer."""
+
+
+# Agreement with pyrender that compare_with_pyrender checks. With the same sample points, the silhouettes
+# differ in a few edge pixels (IoU of 0.998 for the example beam at 256 x 256) and the depths only by
+# float32 rounding (99th percentile of 3 um).
+PARITY_TOLERANCE = {"min_iou": 0.99, "median_depth_error": 1e-5, "p99_depth_error": 1e-4}
+
+
+def _example_views(mesh, yfov, num_views, seed=0):
+    """Camera poses around a mesh, framed the same way as in generate_cantilever_images."""
+    from pose_sampler import camera_poses, sample_angles
+
+    angles = sample_angles(num_views, rng=np.random.default_rng(seed))
+    center = mesh.bounds.mean(axis=0)
+    distance = np.linalg.norm(mesh.bounds[1] - mesh.bounds[0]) / np.tan(yfov / 2)
+    return list(camera_poses(angles, center, distance))
+
+
+def compare_with_pyrender(mesh, img_size=(256, 256), yfov=np.pi / 2, num_views=8):
+    """
+    Render the same views with pyrender and with the NumPy backend and compare them.
+
+    The backends rasterize the same triangles at the same sample points (see SAMPLE_OFFSET), so they only
+    differ in the few pixels sampled on a triangle edge and by the rounding of the depth buffer. See
+    PARITY_TOLERANCE for the agreement on the example beam of the parity check.
+
+    Args:
+    - mesh (Trimesh): Mesh to render.
+    - img_size (tuple): (width, height) of the images.
+    - yfov (float): Field of view for the camera.
+    - num_views (int): Number of random views.
+
+    Returns:
+    - dict: Worst silhouette IoU over the views, and the median and 99th percentile of the absolute
+            depth error over pixels covered in both renders.
+    """
+    import pyrender
+    from randering_img_depth import BeamScene
+
+    gl_scene = BeamScene(yfov, 1.5, np.ones(3))
+    gl_scene.set_mesh(mesh)
+    gl_renderer = pyrender.OffscreenRenderer(*img_size)
+    np_scene = NumpyScene(yfov, 1.5, np.ones(3))
+    np_scene.set_mesh(mesh)
+    np_renderer = NumpyRenderer(*img_size)
+
+    ious, errors = [], []
+    for pose in _example_views(mesh, yfov, num_views):
+        gl_scene.set_pose(pose)
+        np_scene.set_pose(pose)
+        _, gl_depth = gl_renderer.render(gl_scene.scene)
+        _, np_depth = np_renderer.render(np_scene)
+        gl_mask, np_mask = gl_depth > 0, np_depth > 0
+        ious.append((gl_mask & np_mask).sum() / max((gl_mask | np_mask).sum(), 1))
+        errors.append(np.abs(gl_depth - np_depth)[gl_mask & np_mask])
+    gl_renderer.delete()
+
+    errors = np.concatenate(errors)
+    return {"min_iou": float(np.min(ious)),
+            "median_depth_error": float(np.median(errors)),
+            "p99_depth_error": float(np.percentile(errors, 99))}
+
+
+def benchmark(mesh, img_sizes=((256, 256), (512, 512), (1024, 1024), (1792, 1792)), yfov=np.pi / 2,
+              num_views=10):
+    """
+    Measure the throughput of the NumPy backend at several image sizes.
+
+    Args:
+    - mesh (Trimesh): Mesh to render.
+    - img_sizes (tuple): (width, height) image sizes to measure.
+    - yfov (float): Field of view for the camera.
+    - num_views (int): Number of views rendered per image size.
+
+    Returns:
+    - list: One dict per image size with the image size and images per second.
+    """
+    scene = NumpyScene(yfov, 1.5, np.ones(3))
+    scene.set_mesh(mesh)
+    poses = _example_views(mesh, yfov, num_views)
+    results = []
+    for img_size in img_sizes:
+        renderer = NumpyRenderer(*img_size)
+        start = time.perf_counter()
+        for pose in poses:
+            scene.set_pose(pose)
+            renderer.render(scene)
+        elapsed = time.perf_counter() - start
+        results.append({"img_size": list(img_size), "images_per_second": num_views / elapsed})
+        print(f"{img_size[0]}x{img_size[1]}: {num_views / elapsed:.2f} images/s")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    from utils import beam_generator, normalize_mesh
+
+    parser = argparse.ArgumentParser(description="Parity check and benchmark of the NumPy render backend.")
+    parser.add_argument("--split", type=int, default=4, help="Subdivisions of the example beam.")
+    parser.add_argument("--parity", action="store_true",
+                        help="Compare depth maps with pyrender and fail outside PARITY_TOLERANCE.")
+    args = parser.parse_args()
+
+    example = normalize_mesh(beam_generator((1, 0.03, 0.05), args.split))
+    if args.parity:
+        parity = compare_with_pyrender(example)
+        print(parity)
+        failed = [name for name, limit in PARITY_TOLERANCE.items()
+                  if (parity[name] < limit if name == "min_iou" else parity[name] > limit)]
+        if failed:
+            raise SystemExit(f"Parity with pyrender outside {PARITY_TOLERANCE}: {failed}")
+    benchmark(example)
@@ -0,0 +1,131 @@
+import json
+import os
+import re
+
+
+# Partitions of a sharded run are named part-<index>-of-<count>, with a 0-based index
+PARTITION_PATTERN = re.compile(r"^part-(\d{5})-of-(\d{5})$")
+
+
+def partition_name(index, count):
+    """Name of partition index (0-based) of count, e.g. 'part-00002-of-00008'."""
+    return f"part-{index:05d}-of-{count:05d}"
+
+
+def parse_partition(text):
+    """
+    Parse a partition given as 'i/N' on the command line: partition i (0-based) of N.
+
+    Returns:
+    - tuple: (index, count).
+    """
+    index, count = (int(value) for value in text.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Partition {text} must be i/N with 0 <= i < N")
+    return index, count
+
+
+def partition_file(file_name, partition=None):
+    """
+    Name of a bookkeeping file of a partition, e.g. journal.jsonl -> journal-part-00002-of-00008.jsonl,
+    so partitions writing to the same directory never write to the same file. Unchanged if partition is None.
+    """
+    if partition is None:
+        return file_name
+    stem, extension = os.path.splitext(file_name)
+    return f"{stem}-{partition}{extension}"
+
+
+def partition_jobs(jobs, index, count):
+    """
+    Select the jobs of one partition: a contiguous slice of about len(jobs) / count jobs, so the
+    partitions are disjoint, cover every job, and share few base beams.
+
+    Args:
+    - jobs (DataFrame or list): The complete, deterministic jobs table, e.g. from deformed_beam_generator.plan_jobs.
+    - index (int): Partition, from 0 to count - 1.
+    - count (int): Number of partitions.
+
+    Returns:
+    - DataFrame or list: The jobs of the partition.
+    """
+    return jobs[index * len(jobs) // count:(index + 1) * len(jobs) // count]
+
+
+def partition_dirs(manifest_dir):
+    """List the manifests of the partitions written to subdirectories of manifest_dir, in partition order."""
+    if not os.path.isdir(manifest_dir):
+        return []
+    return [os.path.join(manifest_dir, name) for name in sorted(os.listdir(manifest_dir))
+            if PARTITION_PATTERN.match(name) and os.path.isdir(os.path.join(manifest_dir, name))]
+
+
+def merge_partitions(manifest_dir="./manifest", image_dir=None, deformed_dir=None):
+    """
+    Merge the results of the partitions of a sharded run, once all of them have finished.
+
+    Every partition writes its manifest to manifest_dir/<partition>. The tables of all partitions are
+    concatenated, rows repeated by several partitions (base beams shared by their jobs) are dropped,
+    and the rows are sorted in job order, so the merged manifest is the same however the work was
+    partitioned. It is written to manifest_dir.
+
+    Args:
+    - manifest_dir (str): Directory of the manifest, with one subdirectory per partition.
+    - image_dir (str): Optional directory of the rendered images, whose render index files are merged
+                       into merged.index.jsonl.
+    - deformed_dir (str): Optional directory of the deformed meshes, whose deformed_info-<partition>.json
+                          files are merged into deformed_info.json.
+
+    Returns:
+    - dict: Number of partitions, the number of rows of every merged table, and the numbers of the
+            jobs that no partition completed.
+    """
+    import pandas as pd
+    from manifest import read_table, table_path, write_table
+    from render_index import merge_index
+
+    parts = partition_dirs(manifest_dir)
+    assert parts, f"No partitions in {manifest_dir}"
+
+    # Columns identifying a row, and the order of the merged rows
+    keys = {"jobs": ["Job"], "beams": ["Name"], "deformations": ["Name"], "views": ["Mesh", "View"]}
+    tables = {}
+    for table, key in keys.items():
+        frames = [read_table(part, table) for part in parts if table_path(part, table) is not None]
+        if frames:
+            tables[table] = pd.concat(frames, ignore_index=True).drop_duplicates(key)
+
+    if "views" in tables and "deformations" in tables:
+        # Views follow the job order of their meshes
+        jobs = dict(zip(tables["deformations"]["Name"], tables["deformations"]["Job"]))
+        tables["views"]["Job"] = tables["views"]["Mesh"].map(jobs).astype("Int64")
+    orders = {"jobs": ["Job"], "beams": ["Name"], "deformations": ["Job", "Name"], "views": ["Job", "Mesh", "View"]}
+    for table, frame in tables.items():
+        order = [column for column in orders[table] if column in frame]
+        frame = frame.sort_values(order, kind="stable", na_position="last").reset_index(drop=True)
+        write_table(manifest_dir, table, frame)
+
+    missing = []
+    if "jobs" in tables:
+        done = set(tables["deformations"]["Job"].dropna()) if "deformations" in tables else set()
+        missing = sorted(int(job) for job in set(tables["jobs"]["Job"]) - done)
+        if missing:
+            print(f"{len(missing)} of {len(tables['jobs'])} jobs have no deformed mesh, e.g. job {missing[0]}")
+
+    if image_dir is not None and os.path.isdir(image_dir):
+        merge_index(image_dir)
+
+    if deformed_dir is not None and os.path.isdir(deformed_dir):
+        deformed_info = {}
+        for part in parts:
+            info_path = os.path.join(deformed_dir, partition_file("deformed_info.json", os.path.basename(part)))
+            if os.path.isfile(info_path):
+                with open(info_path) as info_file:
+                    for beam, locations in json.load(info_file).items():
+                        for location, forces in locations.items():
+                            deformed_info.setdefault(beam, {}).setdefault(location, {}).update(forces)
+        with open(os.path.join(deformed_dir, "deformed_info.json"), "w") as json_file:
+            json.dump(deformed_info, json_file)
+
+    print(f"Merged the manifests of {len(parts)} partitions into {manifest_dir}")
+    return dict({table: len(frame) for table, frame in tables.items()}, partitions=len(parts), missing=missing)
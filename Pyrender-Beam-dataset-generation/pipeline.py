@@ -2,42 +2,366 @@ from utils import *
 from base_beam_generator import *
 from deformed_beam_generator import *
 from randering_img_depth import *
+from partition import merge_partitions, parse_partition, partition_jobs, partition_name
+import instrumentation
+import sys
 
-# Step 1: Generate base beam meshes.
-generate_beam_meshes(
-    output_dir="./base_beams",
-    split=4,
-    num_heights=2,
-    num_widths=2,
-    start_height=0.02,
-    end_height=0.05,
-    min_width_ratio=1,
-    max_width_ratio=2
-)
-
-# Step 2: Deform the generated beam meshes.
-generate_deformed_meshes(
-    beam_type='cantilever',
-    mesh_meta_path="./base_beams/mesh_meta.xlsx",
-    output_dir="./deformed_beam",
-    num_meshes=5,
-    youngs_modulus=69000000000,
-    max_displacement=-0.03,
-    min_displacement=0.03,
-    locations=[0.9, 0.1]
-)
-
-# Step 3: Render the deformed beam meshes.
-generate_cantilever_images(
-    input_dir="./deformed_beam",
-    output_dir="./rendered_images",
-    num_images=1,
-    img_size=(1792, 1792),
-    yfov=np.pi / 3.0,
-    roll=0,
-    yaw=(-2 * np.pi, 2* np.pi),
-    pitch=(-np.pi / 2, np.pi / 2),
-    light_color=np.array([1.0, 0.90, 0.7])
-)
-
-generate_image_mesh_dictionary()
+
+def run_streaming_pipeline(output_dir="./rendered_images",
+                           beam_kwargs=None,
+                           deform_kwargs=None,
+                           render_kwargs=None,
+                           base_dir=None,
+                           deformed_dir=None,
+                           mesh_format='obj',
+                           base_format='obj',
+                           resume=False,
+                           manifest_dir="./manifest",
+                           jobs=None,
+                           partition=None):
+    """
+    Run the three stages as a streaming pipeline in memory. Base beams, deformed meshes and render
+    jobs flow from stage to stage through generators, so the first beams are rendered while the
+    last ones are still being deformed, and no intermediate files need to be read back.
+
+    Args:
+    - output_dir (str): Directory of the rendered images. deformed_info.json is written there too
+                        unless deformed_dir is given.
+    - beam_kwargs (dict): Arguments of iter_beam_meshes (split, num_heights, ...).
+    - deform_kwargs (dict): Arguments of iter_deformed_meshes (beam_type, num_meshes, ...).
+    - render_kwargs (dict): Arguments of generate_cantilever_images (num_images, img_size, workers, ...).
+    - base_dir (str): If given, the base beams are also saved there.
+    - deformed_dir (str): If given, the deformed meshes and deformed_info.json are also saved there.
+    - mesh_format (str): Format of the deformed meshes saved in deformed_dir: 'obj', 'ply', 'glb', 'npz' or 'store'.
+    - base_format (str): Format of the base beams saved in base_dir: 'obj', 'ply', 'glb' or 'npz'.
+    - resume (bool): Skip the files that a previous run already wrote with the same inputs.
+    - manifest_dir (str): Directory of the dataset manifest, which lists the beams, deformations and views.
+    - jobs (DataFrame or list): Optional jobs table of plan_jobs to run, e.g. one partition of a sharded
+                                run. Only their base beams are generated.
+    - partition (str): Name of the partition of a sharded run, which keeps its own bookkeeping files
+                       in the shared output directories.
+
+    Returns:
+    - dict: Render statistics returned by generate_cantilever_images.
+    """
+    names = None if jobs is None else set(to_frame("jobs", jobs)["Beam"])
+    beams = iter_beam_meshes(**(beam_kwargs or {}), names=names)
+    if base_dir is not None:
+        beams = export_beam_meshes(beams, base_dir, resume, manifest_dir, partition=partition, mesh_format=base_format)
+
+    # Deformed meshes already saved in deformed_dir are not computed again on resume
+    skip_keys = exported_keys(deformed_dir, mesh_format, resume, partition) if deformed_dir else frozenset()
+    deformed = iter_deformed_meshes(beams, **(deform_kwargs or {}), jobs=jobs, skip_keys=skip_keys)
+    # The labels in deformed_info.json are always recorded; the meshes only when they are persisted
+    deformed = export_deformed_meshes(deformed, deformed_dir or output_dir, mesh_format if deformed_dir else None,
+                                      resume, manifest_dir, partition)
+
+    # The labels of a deformed mesh travel with it, to be saved with its views when rendering to shards.
+    # Its key identifies it in the render keys, so a mesh skipped on resume is only read back from
+    # deformed_dir if its views are not on disk.
+    meshes = ((sample["Name"], sample["Path"] if mesh is None else mesh,
+               {k: v for k, v in sample.items() if k not in ["Name", "Key"]}, sample["Key"])
+              for sample, mesh in deformed)
+    return generate_cantilever_images(output_dir=output_dir,
+                                      meshes=meshes,
+                                      resume=resume, manifest_dir=manifest_dir, partition=partition,
+                                      **(render_kwargs or {}))
+
+def _angle(values):
+    """A single angle is fixed, two angles are a (min, max) range to sample from."""
+    return values[0] if len(values) == 1 else tuple(values)
+
+
+def _add_base_args(parser):
+    group = parser.add_argument_group("base beams")
+    group.add_argument("--base-dir", default="./base_beams", help="Directory of the base beams.")
+    group.add_argument("--split", type=int, default=4, help="Uniform subdivision passes of the base beams.")
+    group.add_argument("--resolution", type=int, nargs=3, default=None, metavar=("NX", "NY", "NZ"),
+                       help="Structured grid segments along length, height and width (overrides --split).")
+    group.add_argument("--num-heights", type=int, default=2)
+    group.add_argument("--num-widths", type=int, default=2)
+    group.add_argument("--start-height", type=float, default=0.02)
+    group.add_argument("--end-height", type=float, default=0.05)
+    group.add_argument("--min-width-ratio", type=float, default=1)
+    group.add_argument("--max-width-ratio", type=float, default=2)
+    group.add_argument("--excel-report", action="store_true", help="Also save <base-dir>/mesh_meta.xlsx.")
+    group.add_argument("--base-format", choices=MESH_FORMATS, default="obj",
+                       help="File format of the base beams; ply, glb and npz are binary with float32 vertices.")
+
+
+def _add_deform_args(parser):
+    group = parser.add_argument_group("deformation")
+    group.add_argument("--beam-type", choices=["cantilever", "simple_support"], default="cantilever")
+    group.add_argument("--mesh-meta-path", default=None,
+                       help="Metadata file of the base beams (default: the beams table of the manifest).")
+    group.add_argument("--deformed-dir", default="./deformed_beam", help="Directory of the deformed meshes.")
+    group.add_argument("--num-meshes", type=int, default=5, help="Number of forces per load location.")
+    group.add_argument("--youngs-modulus", type=float, default=69000000000)
+    group.add_argument("--max-displacement", type=float, default=-0.03)
+    group.add_argument("--min-displacement", type=float, default=0.03)
+    group.add_argument("--locations", type=float, nargs="+", default=[0.9, 0.1])
+    group.add_argument("--mesh-format", choices=MESH_FORMATS + ["store"], default="obj",
+                       help="File format of the deformed meshes, or a binary store of all of them.")
+    group.add_argument("--solver", choices=SOLVERS, default="analytic",
+                       help="Closed-form beam deflection, or a finite element model of the beam volume.")
+    group.add_argument("--poisson-ratio", type=float, default=POISSON_RATIO, help="Poisson's ratio of the fe solver.")
+    group.add_argument("--fe-resolution", type=int, nargs=3, default=list(FE_RESOLUTION), metavar=("NX", "NY", "NZ"),
+                       help="Elements along the length, height and width of a beam for the fe solver.")
+
+
+def _add_render_args(parser):
+    group = parser.add_argument_group("rendering")
+    group.add_argument("--image-dir", default="./rendered_images", help="Directory of the rendered images.")
+    group.add_argument("--num-images", type=int, default=1, help="Number of views per mesh.")
+    group.add_argument("--img-size", type=int, nargs=2, default=[1792, 1792], metavar=("WIDTH", "HEIGHT"))
+    group.add_argument("--yfov", type=float, default=np.pi / 3.0)
+    group.add_argument("--roll", type=float, nargs="+", default=[0])
+    group.add_argument("--yaw", type=float, nargs="+", default=[-2 * np.pi, 2 * np.pi])
+    group.add_argument("--pitch", type=float, nargs="+", default=[-np.pi / 2, np.pi / 2])
+    group.add_argument("--light-intensity", type=float, default=1.5)
+    group.add_argument("--light-color", type=float, nargs=3, default=[1.0, 0.90, 0.7])
+    group.add_argument("--workers", type=int, default=1, help="Number of render processes.")
+    group.add_argument("--seed", type=int, default=0)
+    group.add_argument("--view-distribution", choices=VIEW_DISTRIBUTIONS, default="uniform",
+                       help="How the camera directions of the views of a mesh are sampled.")
+    group.add_argument("--platform", choices=["egl", "osmesa"], default=None)
+    group.add_argument("--backend", choices=BACKENDS, default="pyrender")
+    group.add_argument("--depth-format", choices=DEPTH_FORMATS, default="png8")
+    group.add_argument("--outputs", nargs="+", choices=OUTPUTS, default=["color", "depth"],
+                       help="Passes saved for every view; mask, normals and vertex_ids come from the same render.")
+    group.add_argument("--png-compression", type=int, default=3)
+    group.add_argument("--shard-size", type=float, default=None, metavar="MB",
+                       help="Write the views into tar shards of about this size instead of one directory per mesh.")
+
+
+def _base_kwargs(args):
+    return dict(split=args.split, num_heights=args.num_heights, num_widths=args.num_widths,
+                start_height=args.start_height, end_height=args.end_height, min_width_ratio=args.min_width_ratio,
+                max_width_ratio=args.max_width_ratio, resolution=args.resolution)
+
+
+def _deform_kwargs(args):
+    return dict(beam_type=args.beam_type, num_meshes=args.num_meshes, youngs_modulus=args.youngs_modulus,
+                max_displacement=args.max_displacement, min_displacement=args.min_displacement,
+                locations=args.locations)
+
+
+def _solver_kwargs(args):
+    return dict(solver=args.solver, poisson_ratio=args.poisson_ratio, fe_resolution=tuple(args.fe_resolution))
+
+
+def _render_kwargs(args):
+    return dict(num_images=args.num_images, img_size=tuple(args.img_size), yfov=args.yfov, roll=_angle(args.roll),
+                yaw=_angle(args.yaw), pitch=_angle(args.pitch), light_intensity=args.light_intensity,
+                light_color=np.array(args.light_color), workers=args.workers, seed=args.seed,
+                view_distribution=args.view_distribution, outputs=tuple(args.outputs), platform=args.platform,
+                backend=args.backend, depth_format=args.depth_format, png_compression=args.png_compression,
+                shard_size=args.shard_size and int(args.shard_size * (1 << 20)))
+
+
+def _plan(args):
+    """The complete jobs table of the base beam and deformation arguments."""
+    beams = beam_grid(args.num_heights, args.num_widths, args.start_height, args.end_height, args.min_width_ratio,
+                      args.max_width_ratio)
+    return plan_jobs(beams, **_deform_kwargs(args))
+
+
+def _select_partition(args):
+    """
+    For --shard i/N, select the jobs of the partition and move its manifest to a subdirectory of the
+    manifest directory, where merge finds it. Every node computes the same job list from the same
+    arguments, so the partitions need no coordination.
+    """
+    if args.shard is None:
+        return
+    index, count = args.shard
+    args.partition = partition_name(index, count)
+    args.jobs = partition_jobs(_plan(args), index, count)
+    args.manifest_dir = os.path.join(args.manifest_dir, args.partition)
+    write_table(args.manifest_dir, "jobs", args.jobs)
+    print(f"Partition {index}/{count}: {len(args.jobs)} jobs")
+
+
+def _run_base(args):
+    names = None if args.jobs is None else set(args.jobs["Beam"])
+    with instrumentation.stage("base"):
+        return generate_beam_meshes(output_dir=args.base_dir, resume=args.resume, manifest_dir=args.manifest_dir,
+                                    excel_report=args.excel_report, names=names, partition=args.partition,
+                                    mesh_format=args.base_format,
+                                    **_base_kwargs(args))
+
+
+def _run_deform(args, base_meshes=None):
+    with instrumentation.stage("deform"):
+        return generate_deformed_meshes(mesh_meta_path=args.mesh_meta_path, output_dir=args.deformed_dir,
+                                        mesh_format=args.mesh_format, base_meshes=base_meshes, resume=args.resume,
+                                        manifest_dir=args.manifest_dir, jobs=args.jobs, partition=args.partition,
+                                        **_deform_kwargs(args), **_solver_kwargs(args))
+
+
+def _run_render(args):
+    # A partition renders the meshes it deformed, which share the directory with those of other partitions
+    meshes = None if args.partition is None else manifest_meshes(args.manifest_dir)
+    with instrumentation.stage("render"):
+        return generate_cantilever_images(input_dir=args.deformed_dir, output_dir=args.image_dir,
+                                          resume=args.resume, manifest_dir=args.manifest_dir, meshes=meshes,
+                                          partition=args.partition, **_render_kwargs(args))
+
+
+def _run_index(args):
+    with instrumentation.stage("index"):
+        return generate_image_mesh_dictionary(base_path=".", mesh_subdir=args.deformed_dir,
+                                              image_subdir=args.image_dir, output_filename=args.output_filename,
+                                              scan_mesh_dir=args.scan_mesh_dir)
+
+
+def _run_all(args):
+    _select_partition(args)
+    # Step 1: Generate base beam meshes.
+    base_meshes = _run_base(args)
+    # Step 2: Deform the generated beam meshes.
+    _run_deform(args, base_meshes)
+    # Step 3: Render the deformed beam meshes.
+    _run_render(args)
+    # The dictionary of a sharded run is written by merge, once all partitions have finished
+    if args.partition is None:
+        _run_index(args)
+
+
+def _run_plan(args):
+    jobs = _plan(args)
+    write_table(args.manifest_dir, "jobs", jobs)
+    print(f"{len(jobs)} jobs written to the jobs table of {args.manifest_dir}")
+    for index in range(args.partitions):
+        part_jobs = partition_jobs(jobs, index, args.partitions)
+        print(f"--shard {index}/{args.partitions}: {len(part_jobs)} jobs, "
+              f"{part_jobs['Beam'].nunique()} base beams")
+    return jobs
+
+
+def _run_merge(args):
+    merged = merge_partitions(args.manifest_dir, args.image_dir, args.deformed_dir)
+    # The dictionary of a sharded run lists the views of all partitions, from the merged render index
+    if os.path.isdir(args.image_dir):
+        _run_index(args)
+    return merged
+
+
+def _run_stream(args):
+    _select_partition(args)
+    with instrumentation.stage("stream"):
+        return run_streaming_pipeline(output_dir=args.image_dir,
+                                      beam_kwargs=_base_kwargs(args),
+                                      deform_kwargs=dict(_deform_kwargs(args), **_solver_kwargs(args)),
+                                      render_kwargs=_render_kwargs(args),
+                                      base_dir=args.base_dir if args.persist_base else None,
+                                      deformed_dir=args.deformed_dir if args.persist_deformed else None,
+                                      mesh_format=args.mesh_format,
+                                      base_format=args.base_format,
+                                      resume=args.resume,
+                                      manifest_dir=args.manifest_dir,
+                                      jobs=args.jobs,
+                                      partition=args.partition)
+
+
+def main(argv=None):
+    """
+    Command line entry point with one subcommand per stage:
+
+        python pipeline.py base     # generate the base beams
+        python pipeline.py deform   # deform the base beams
+        python pipeline.py render   # render the deformed beams
+        python pipeline.py index    # write mesh_img_dictionary.json
+        python pipeline.py all      # run the stages above one after another (default)
+        python pipeline.py stream   # run the streaming in-memory pipeline
+        python pipeline.py plan     # write the job list of a sharded run
+        python pipeline.py merge    # merge the manifests of the partitions of a sharded run
+
+    all and stream accept --shard i/N to run partition i (0-based) of N of the job list, e.g. on one
+    node of a cluster sharing a filesystem; merge combines the partitions once all have finished.
+
+    Run a subcommand with --help to list its options. --stats FILE writes the time spent in every
+    stage and the peak memory use to a JSON file, and --profile FILE dumps cProfile statistics.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Synthetic beam mesh, image and depth dataset generation.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    base = subparsers.add_parser("base", help="Generate the base beam meshes.")
+    _add_base_args(base)
+    base.set_defaults(run=_run_base)
+
+    deform = subparsers.add_parser("deform", help="Deform the base beam meshes.")
+    _add_deform_args(deform)
+    deform.set_defaults(run=_run_deform)
+
+    render = subparsers.add_parser("render", help="Render images and depth maps of the deformed meshes.")
+    render.add_argument("--deformed-dir", default="./deformed_beam", help="Directory of the deformed meshes.")
+    _add_render_args(render)
+    render.set_defaults(run=_run_render)
+
+    index = subparsers.add_parser("index", help="Write the mesh to image dictionary.")
+    index.add_argument("--deformed-dir", default="./deformed_beam")
+    index.add_argument("--image-dir", default="./rendered_images")
+    index.add_argument("--output-filename", default="mesh_img_dictionary.json")
+    index.add_argument("--scan-mesh-dir", action="store_true",
+                       help="Also list meshes without views in the render index from their image directories.")
+    index.set_defaults(run=_run_index)
+
+    for name, run, help_text in [("all", _run_all, "Run all stages one after another."),
+                                 ("stream", _run_stream, "Run all stages as an in-memory streaming pipeline.")]:
+        command = subparsers.add_parser(name, help=help_text)
+        _add_base_args(command)
+        _add_deform_args(command)
+        _add_render_args(command)
+        if name == "all":
+            command.add_argument("--output-filename", default="mesh_img_dictionary.json")
+        else:
+            command.add_argument("--persist-base", action="store_true", help="Also save the base beams.")
+            command.add_argument("--persist-deformed", action="store_true", help="Also save the deformed meshes.")
+        command.add_argument("--shard", type=parse_partition, default=None, metavar="i/N",
+                             help="Only run partition i (0-based) of N of the jobs. The outputs of all partitions "
+                                  "are the same as those of a single run once merged.")
+        command.set_defaults(run=run)
+
+    plan = subparsers.add_parser("plan", help="Write the job list of the base beam and deformation arguments.")
+    _add_base_args(plan)
+    _add_deform_args(plan)
+    plan.add_argument("--partitions", type=int, default=1, help="Print the jobs of each of this many partitions.")
+    plan.set_defaults(run=_run_plan)
+
+    merge = subparsers.add_parser("merge", help="Merge the manifests of the partitions of a sharded run.")
+    merge.add_argument("--deformed-dir", default="./deformed_beam")
+    merge.add_argument("--image-dir", default="./rendered_images")
+    merge.add_argument("--output-filename", default="mesh_img_dictionary.json")
+    merge.set_defaults(run=_run_merge)
+
+    for command in subparsers.choices.values():
+        command.set_defaults(shard=None, partition=None, jobs=None, scan_mesh_dir=False)
+        command.add_argument("--stats", default=None, metavar="FILE",
+                             help="Write the time, calls and counters of every stage and the peak RSS to a JSON file.")
+        command.add_argument("--profile", default=None, metavar="FILE",
+                             help="Profile the run with cProfile and dump the statistics to FILE.")
+
+    for command in [base, deform, render, subparsers.choices["all"], subparsers.choices["stream"], plan, merge]:
+        if command not in [plan, merge]:
+            command.add_argument("--resume", action="store_true",
+                                 help="Skip outputs that a previous run already wrote with the same parameters.")
+        command.add_argument("--manifest-dir", default="./manifest",
+                             help="Directory of the dataset manifest (beams, deformations and views tables).")
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0].startswith("-") and argv[0] not in ["-h", "--help"]:
+        argv.insert(0, "all")
+    args = parser.parse_args(argv)
+    with instrumentation.profile(args.profile):
+        result = args.run(args)
+    if args.stats:
+        instrumentation.print_report(instrumentation.write_report(args.stats, command=args.command, argv=argv))
+    return result
+
+
+# Render workers are spawned processes that re-import this module, so the pipeline only runs as a script.
+if __name__ == "__main__":
+    main()
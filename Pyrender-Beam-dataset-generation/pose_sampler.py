@@ -0,0 +1,162 @@
+import hashlib
+
+import numpy as np
+
+
+VIEW_DISTRIBUTIONS = ['uniform', 'sphere', 'fibonacci', 'stratified']
+
+# Fraction of a turn between consecutive points of a Fibonacci lattice
+GOLDEN_FRACTION = (np.sqrt(5) - 1) / 2
+
+
+def mesh_seed(seed, name):
+    """
+    Derive a deterministic 64-bit seed for a mesh from the run seed and the mesh name, so the
+    sampled camera poses do not depend on how meshes are split across workers.
+
+    Args:
+    - seed (int): Seed of the run.
+    - name (str): Name of the mesh.
+
+    Returns:
+    - int: Seed for the random stream of the mesh.
+    """
+    digest = hashlib.sha256(f"{seed}:{name}".encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def mesh_rng(seed, name):
+    """Return the np.random.Generator of a mesh, seeded with mesh_seed(seed, name)."""
+    return np.random.default_rng(mesh_seed(seed, name))
+
+
+def _range(angle):
+    """A (min, max) pair is a range, a single number a fixed angle."""
+    if np.ndim(angle) == 0:
+        return float(angle), float(angle)
+    low, high = angle
+    return float(low), float(high)
+
+
+def _area_quantiles(u, low, high, resolution=1025):
+    """
+    Polar angles in [low, high] at quantiles u of the distribution whose density is |sin(angle)|,
+    which spreads the viewing directions uniformly over the area of the sphere.
+    """
+    if low == high:
+        return np.full(len(u), low)
+    grid = np.linspace(low, high, resolution)
+    density = np.abs(np.sin(grid))
+    cdf = np.concatenate([[0], np.cumsum((density[1:] + density[:-1]) / 2)])
+    if cdf[-1] == 0:
+        return low + u * (high - low)
+    return np.interp(u, cdf / cdf[-1], grid)
+
+
+def sample_angles(num_images, roll=0, pitch=(-np.pi / 2, np.pi / 2), yaw=(-2 * np.pi, 2 * np.pi),
+                  distribution='uniform', rng=None):
+    """
+    Sample the camera angles of all views of a mesh at once.
+
+    The viewing direction is (sin(pitch) cos(yaw), sin(pitch) sin(yaw), cos(pitch)), so pitch is the
+    polar angle from the z axis and yaw the azimuth, as in generate_cantilever_images.
+
+    Args:
+    - num_images (int): Number of views.
+    - roll, pitch, yaw (float or tuple): Fixed angle, or (min, max) range of the angle.
+    - distribution (str): How the viewing directions are spread over the ranges:
+                          'uniform' draws every angle uniformly in its range.
+                          'sphere' draws directions uniformly over the area of the sphere, instead
+                          of crowding them at the poles.
+                          'fibonacci' places the directions on a Fibonacci lattice, the most even
+                          deterministic covering of the sphere, rotated by a random azimuth.
+                          'stratified' splits the pitch and yaw ranges into num_images strata each
+                          and draws one jittered sample per stratum (Latin hypercube).
+                          Roll is drawn uniformly in its range for every distribution.
+    - rng (numpy.random.Generator): Random stream, e.g. mesh_rng(seed, name).
+
+    Returns:
+    - numpy.array: (num_images, 3) roll, pitch and yaw angles.
+    """
+    assert distribution in VIEW_DISTRIBUTIONS, f"Invalid distribution. Choose one of {VIEW_DISTRIBUTIONS}."
+    rng = np.random.default_rng() if rng is None else rng
+    roll_range, pitch_range, yaw_range = _range(roll), _range(pitch), _range(yaw)
+
+    # Quantiles of the pitch and yaw of every view in their ranges
+    if distribution in ['uniform', 'sphere']:
+        u_pitch, u_yaw = rng.random(num_images), rng.random(num_images)
+    elif distribution == 'stratified':
+        u_pitch = (rng.permutation(num_images) + rng.random(num_images)) / num_images
+        u_yaw = (rng.permutation(num_images) + rng.random(num_images)) / num_images
+    else:  # 'fibonacci'
+        index = np.arange(num_images)
+        u_pitch = (index + 0.5) / num_images
+        u_yaw = (index * GOLDEN_FRACTION + rng.random()) % 1
+
+    if distribution in ['sphere', 'fibonacci']:
+        pitches = _area_quantiles(u_pitch, *pitch_range)
+    else:
+        pitches = pitch_range[0] + u_pitch * (pitch_range[1] - pitch_range[0])
+    yaws = yaw_range[0] + u_yaw * (yaw_range[1] - yaw_range[0])
+    rolls = roll_range[0] + rng.random(num_images) * (roll_range[1] - roll_range[0])
+    return np.stack([rolls, pitches, yaws], axis=1)
+
+
+def rotation_matrices(angles):
+    """
+    Vectorized rotation_matrix: R = Rz(yaw) Ry(pitch) Rx(roll) for every row of angles.
+
+    Args:
+    - angles (numpy.array): (N, 3) roll, pitch and yaw angles.
+
+    Returns:
+    - numpy.array: (N, 3, 3) rotation matrices.
+    """
+    cos, sin = np.cos(angles), np.sin(angles)
+    (cr, cp, cy), (sr, sp, sy) = cos.T, sin.T
+    zeros, ones = np.zeros(len(angles)), np.ones(len(angles))
+    R_x = np.stack([ones, zeros, zeros, zeros, cr, -sr, zeros, sr, cr], axis=1).reshape(-1, 3, 3)
+    R_y = np.stack([cp, zeros, sp, zeros, ones, zeros, -sp, zeros, cp], axis=1).reshape(-1, 3, 3)
+    R_z = np.stack([cy, -sy, zeros, sy, cy, zeros, zeros, zeros, ones], axis=1).reshape(-1, 3, 3)
+    return R_z @ R_y @ R_x
+
+
+def camera_poses(angles, center, distance):
+    """
+    Camera-to-world poses looking at a mesh from the given angles.
+
+    Args:
+    - angles (numpy.array): (N, 3) roll, pitch and yaw angles from sample_angles.
+    - center (numpy.array): Center of the mesh.
+    - distance (float): Distance from the center to the cameras.
+
+    Returns:
+    - numpy.array: (N, 4, 4) camera poses.
+    """
+    _, pitch, yaw = np.asarray(angles, dtype=np.float64).T
+    directions = np.stack([np.sin(pitch) * np.cos(yaw), np.sin(pitch) * np.sin(yaw), np.cos(pitch)], axis=1)
+    poses = np.tile(np.eye(4), (len(angles), 1, 1))
+    poses[:, :3, :3] = rotation_matrices(np.asarray(angles, dtype=np.float64))
+    poses[:, :3, 3] = center + distance * directions
+    return poses
+
+
+def sample_dataset_angles(names, num_images, seed=0, roll=0, pitch=(-np.pi / 2, np.pi / 2),
+                          yaw=(-2 * np.pi, 2 * np.pi), distribution='uniform'):
+    """
+    Sample the camera angles of all views of a list of meshes, each from its own seeded stream,
+    so any slice of the meshes gets the same angles as the whole list.
+
+    Args:
+    - names (list): Names of the meshes.
+    - num_images (int): Number of views per mesh.
+    - seed (int): Seed of the run.
+    - The remaining arguments are those of sample_angles.
+
+    Returns:
+    - numpy.array: (len(names), num_images, 3) roll, pitch and yaw angles.
+    """
+    angles = np.empty((len(names), num_images, 3))
+    for i, name in enumerate(names):
+        angles[i] = sample_angles(num_images, roll, pitch, yaw, distribution, mesh_rng(seed, name))
+    return angles
@@ -1,10 +1,21 @@
 import numpy as np
-import trimesh
-import pyrender
-import imageio
 import os
-import random
-import cv2  # For depth map normalization
+import multiprocessing
+import multiprocessing.util
+import time
+import json
+from collections import deque
+from itertools import islice
+from deformed_store import DeformedMeshStore
+from mesh_io import list_mesh_files, load_mesh_file
+from image_writer import AsyncImageWriter
+from numpy_renderer import SAMPLE_OFFSET, NumpyRenderer, NumpyScene
+from run_journal import RunJournal, artifact_key, mesh_digest
+from manifest import read_labels, write_table
+from shards import ShardWriter, encode_json, encode_npy, sample_key
+from render_index import INDEX_SUFFIX, IndexWriter, merge_index, remove_index
+from pose_sampler import VIEW_DISTRIBUTIONS, camera_poses, mesh_rng, sample_angles
+import instrumentation
 
 
 def rotation_matrix(roll, pitch, yaw):
@@ -35,6 +46,670 @@ def rotation_matrix(roll, pitch, yaw):
     return np.dot(R_z, np.dot(R_y, R_x))
 
 
+def list_meshes(input_dir):
+    """
+    List the meshes to render in a directory, as (name, source) pairs.
+
+    A directory holding a DeformedMeshStore yields one entry per stored sample, otherwise
+    every mesh file of a format of mesh_io.MESH_FORMATS in the directory is listed.
+
+    Args:
+    - input_dir (str): Directory containing mesh files or a deformed mesh store.
+
+    Returns:
+    - list: (name, source) pairs, where source is accepted by load_mesh.
+    """
+    if DeformedMeshStore.is_store(input_dir):
+        store = DeformedMeshStore(input_dir)
+        return [(sample["name"] or f"sample_{i:06d}", (input_dir, i)) for i, sample in enumerate(store.samples)]
+
+    return list_mesh_files(input_dir)
+
+
+def manifest_meshes(manifest_dir):
+    """
+    List the deformed meshes of the deformations table of a manifest, e.g. those of one partition.
+
+    Args:
+    - manifest_dir (str): Directory of the manifest.
+
+    Returns:
+    - list: (name, source, labels) triples in table order, where source is accepted by load_mesh.
+    """
+    return [(name, (labels["Store"], int(labels["Sample"])) if "Store" in labels else labels["Path"], labels)
+            for name, labels in read_labels(manifest_dir).items()]
+
+
+def load_mesh(source, stores=None):
+    """
+    Load a mesh listed by list_meshes.
+
+    Args:
+    - source (str, tuple or Trimesh): Path of a mesh file of any format (see mesh_io.load_mesh_file),
+                                      (store directory, sample index), or a mesh already in memory,
+                                      which is returned as is.
+    - stores (dict): Optional cache of opened stores keyed by directory.
+
+    Returns:
+    - Trimesh: The loaded mesh.
+    """
+    import trimesh
+
+    if isinstance(source, trimesh.Trimesh):
+        return source
+    if isinstance(source, tuple):
+        store_dir, sample = source
+        stores = {} if stores is None else stores
+        if store_dir not in stores:
+            stores[store_dir] = DeformedMeshStore(store_dir)
+        return stores[store_dir].to_trimesh(sample)
+    return load_mesh_file(source)
+
+
+DEPTH_FORMATS = ['png8', 'png16', 'npy']
+BACKENDS = ['pyrender', 'numpy']
+# Passes of a view: color and depth are always rendered, the others are derived from the same render
+OUTPUTS = ['color', 'depth', 'mask', 'normals', 'vertex_ids']
+
+
+def camera_intrinsics(yfov, img_size):
+    """
+    Pinhole intrinsics of a pyrender.PerspectiveCamera with the aspect ratio of the viewport.
+
+    Args:
+    - yfov (float): Vertical field of view of the camera.
+    - img_size (tuple): (width, height) of the rendered images.
+
+    Returns:
+    - numpy.array: 3x3 intrinsic matrix [[fx, 0, cx], [0, fy, cy], [0, 0, 1]] in pixels.
+    """
+    width, height = img_size
+    focal = height / 2 / np.tan(yfov / 2)
+    return np.array([[focal, 0, width / 2],
+                     [0, focal, height / 2],
+                     [0, 0, 1]])
+
+
+def write_camera_info(mesh_subdir, camera, img_size, depth_format, depth_scale, depth_offset, depth_dtype,
+                      outputs=('color', 'depth')):
+    """
+    Save the camera model, the depth encoding and the passes of a mesh's views next to its images as camera.json.
+
+    Metric depth is recovered from a stored depth value d as d * depth_scale + depth_offset for
+    'png16' and as d for 'npy'. A stored 0 is background for both.
+    """
+    info = {
+        "img_size": list(img_size),
+        "yfov": camera.yfov,
+        "znear": camera.znear,
+        "zfar": camera.zfar,
+        "intrinsics": camera_intrinsics(camera.yfov, img_size).tolist(),
+        "depth_format": depth_format,
+        "depth_scale": depth_scale if depth_format == 'png16' else None,
+        "depth_offset": depth_offset if depth_format == 'png16' else None,
+        "depth_dtype": {'png8': 'uint8', 'png16': 'uint16', 'npy': depth_dtype}[depth_format],
+        "outputs": list(outputs)
+    }
+    with open(os.path.join(mesh_subdir, "camera.json"), "w") as json_file:
+        json.dump(info, json_file, indent=4)
+
+
+class BeamScene:
+    """
+    Persistent pyrender scene holding one mesh, a perspective camera and a directional light.
+
+    The camera and light nodes are added once and only re-posed for every view, and switching
+    to another mesh replaces the mesh of the existing mesh node, so rendering many meshes and
+    views does not rebuild the scene graph.
+    """
+
+    def __init__(self, yfov, light_intensity, light_color):
+        """
+        Args:
+        - yfov (float): Field of view for the camera.
+        - light_intensity (float): Intensity of the directional light.
+        - light_color (numpy.array): RGB color for the light source.
+        """
+        import pyrender
+
+        self.scene = pyrender.Scene()
+        self.camera = pyrender.PerspectiveCamera(yfov=yfov)
+        self.camera_node = self.scene.add(self.camera)
+        self.light_node = self.scene.add(pyrender.DirectionalLight(color=light_color, intensity=light_intensity))
+        self.mesh_node = None
+        # Hidden copy of the mesh colored by face index, created by the first render_face_ids of every mesh
+        self.id_node = None
+        self.source = None
+        self.id_mesh = None
+
+    def set_mesh(self, mesh):
+        """
+        Show a new mesh in the scene. The renderer uploads it and frees the previous one on the next render.
+
+        Args:
+        - mesh (Trimesh): The mesh to render.
+
+        Returns:
+        - pyrender.Mesh: The mesh converted for rendering.
+        """
+        import pyrender
+
+        render_mesh = pyrender.Mesh.from_trimesh(mesh)
+        if self.mesh_node is None:
+            self.mesh_node = self.scene.add(render_mesh)
+        else:
+            self.mesh_node.mesh = render_mesh
+            # Re-posing the node makes the scene recompute its cached bounds
+            self.scene.set_pose(self.mesh_node, np.eye(4))
+        self.source = mesh
+        self.id_mesh = None
+        return render_mesh
+
+    def render_face_ids(self, renderer):
+        """
+        Render the index of the face seen in every pixel, at the sample point of the depth map.
+
+        pyrender draws into a 4x multisampled framebuffer and averages the samples of every pixel into
+        the color image, so the pixels on face edges of a plain color render mix several faces. The faces
+        are drawn flat, in colors encoding their indices, into the first sample of every pixel only, which
+        is the sample the depth map keeps (see numpy_renderer.SAMPLE_OFFSET). The other samples keep the
+        black background, so every channel averages to a quarter of the color drawn and carries 6 bits of
+        the index.
+
+        Args:
+        - renderer (pyrender.OffscreenRenderer): Renderer that has just rendered the same view, so that
+                                                 its OpenGL context is current.
+
+        Returns:
+        - numpy.array: (H, W) int64 face indices, -1 for background pixels.
+        """
+        import pyrender
+        import trimesh
+        from OpenGL import GL
+
+        if self.id_mesh is None:
+            num_faces = len(self.source.faces)
+            if num_faces >= 1 << 18:
+                raise ValueError(f"Face ids of meshes with {num_faces} faces do not fit in 18 bits")
+            # Index + 1, so that 0 is the background, in multiples of 4 per channel
+            codes = np.arange(1, num_faces + 1)
+            colors = np.full((num_faces, 4), 255, dtype=np.uint8)
+            colors[:, :3] = np.stack([(codes >> shift) & 63 for shift in (0, 6, 12)], axis=1) * 4
+            faces = trimesh.Trimesh(self.source.vertices, self.source.faces, face_colors=colors, process=False)
+            self.id_mesh = pyrender.Mesh.from_trimesh(faces, smooth=False)
+            self.id_mesh.is_visible = False
+            if self.id_node is None:
+                self.id_node = self.scene.add(self.id_mesh)
+            else:
+                self.id_node.mesh = self.id_mesh
+
+        bg_color = self.scene.bg_color
+        self.scene.bg_color = np.zeros(4)
+        self.mesh_node.mesh.is_visible, self.id_mesh.is_visible = False, True
+        GL.glEnable(GL.GL_SAMPLE_MASK)
+        GL.glSampleMaski(0, 1)
+        try:
+            color, _ = renderer.render(self.scene, flags=pyrender.RenderFlags.FLAT)
+        finally:
+            GL.glDisable(GL.GL_SAMPLE_MASK)
+            self.mesh_node.mesh.is_visible, self.id_mesh.is_visible = True, False
+            self.scene.bg_color = bg_color
+        return color.astype(np.int64) @ np.array([1, 1 << 6, 1 << 12]) - 1
+
+    def set_pose(self, camera_pose):
+        """Move the camera and the light, which shines along the view direction, to a new pose."""
+        self.scene.set_pose(self.camera_node, camera_pose)
+        self.scene.set_pose(self.light_node, camera_pose)
+
+
+def make_renderer(backend, img_size):
+    """
+    Create the renderer of a backend.
+
+    Args:
+    - backend (str): 'pyrender' for an OpenGL offscreen renderer, 'numpy' for the CPU rasterizer.
+    - img_size (tuple): Size of the rendered images.
+
+    Returns:
+    - pyrender.OffscreenRenderer or NumpyRenderer: The renderer.
+    """
+    if backend == 'numpy':
+        return NumpyRenderer(*img_size)
+
+    # pyrender is imported on first use because importing it loads OpenGL for PYOPENGL_PLATFORM
+    import pyrender
+    return pyrender.OffscreenRenderer(*img_size)
+
+
+def encode_depth(depth, depth_format, depth_scale=1e-4, depth_offset=0.0, depth_dtype='float32'):
+    """
+    Convert a rendered depth map to the array stored for a depth format.
+
+    Args:
+    - depth (numpy.array): (H, W) metric depth, 0 where no surface was hit.
+    - depth_format, depth_scale, depth_dtype: See generate_cantilever_images.
+    - depth_offset (float): Metric depth stored as 0 in 'png16' depth maps.
+
+    Returns:
+    - numpy.array: uint8 for 'png8', uint16 for 'png16' and depth_dtype for 'npy'.
+    """
+    import cv2
+
+    if depth_format == 'png8':
+        # Normalize the depth map for visualization
+        return cv2.normalize(depth, None, 255, 0, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    if depth_format == 'png16':
+        # Fixed metric scale, so depths stay comparable across images; background stays 0
+        depth_map = np.where(depth > 0, np.round((depth - depth_offset) / depth_scale), 0)
+        return np.clip(depth_map, 0, 65535).astype(np.uint16)
+    return depth.astype(depth_dtype)
+
+
+def backproject(depth, camera_pose, yfov, mask=None):
+    """
+    World coordinates of the surface point seen in every pixel of a depth map, for the pinhole camera
+    of camera_intrinsics at the given pose.
+
+    Args:
+    - mask (numpy.array): Optional (H, W) boolean mask of the pixels to back-project.
+
+    Returns:
+    - numpy.array: (H, W, 3) points, or (N, 3) points of the pixels of mask; background pixels (depth 0)
+                   map to the camera position.
+    """
+    height, width = depth.shape
+    focal = height / 2 / np.tan(yfov / 2)
+    if mask is None:
+        v, u = np.indices(depth.shape)
+        z = depth.astype(np.float64)
+    else:
+        v, u = np.nonzero(mask)
+        z = depth[mask].astype(np.float64)
+    # Depths are sampled at SAMPLE_OFFSET in every pixel; the camera looks along its -z axis with +y up,
+    # as in pyrender
+    sample_u, sample_v = SAMPLE_OFFSET
+    points = np.stack([(u + sample_u - width / 2) * z / focal, (height / 2 - v - sample_v) * z / focal, -z],
+                      axis=-1)
+    return points @ camera_pose[:3, :3].T + camera_pose[:3, 3]
+
+
+def render_passes(depth, mesh, camera_pose, yfov, outputs, face_ids=None):
+    """
+    Derive the extra passes of a view from its depth map and the face seen in every pixel.
+
+    Args:
+    - depth (numpy.array): (H, W) depth map of the view, 0 where no surface was hit.
+    - mesh (Trimesh): The rendered mesh.
+    - camera_pose (numpy.array): 4x4 camera-to-world pose of the view.
+    - yfov (float): Field of view of the camera.
+    - outputs (list): Passes to derive among 'mask', 'normals' and 'vertex_ids'.
+    - face_ids (numpy.array): (H, W) face seen in every pixel, -1 for background, as kept by the NumPy
+                              backend or rendered by BeamScene.render_face_ids. Only needed for
+                              'normals' and 'vertex_ids'.
+
+    Returns:
+    - dict: 'mask': uint8 (H, W) silhouette, 255 on the mesh.
+            'normals': uint8 (H, W, 3) RGB normals of the visible faces in camera coordinates
+            (+x right, +y up, +z towards the camera), encoded as (n + 1) / 2 * 255, 0 for background.
+            'vertex_ids': int32 (H, W) index of the mesh vertex nearest to the surface point of every
+            pixel, among the corners of its face, -1 for background.
+    """
+    passes = {}
+    visible = depth > 0
+    if 'mask' in outputs:
+        passes['mask'] = visible.astype(np.uint8) * 255
+    if 'normals' in outputs or 'vertex_ids' in outputs:
+        visible &= face_ids >= 0
+        points = backproject(depth, camera_pose, yfov, visible)
+        faces = face_ids[visible]
+        if 'normals' in outputs:
+            normals = np.zeros(depth.shape + (3,), dtype=np.uint8)
+            # World to camera coordinates
+            normals[visible] = np.round((mesh.face_normals[faces] @ camera_pose[:3, :3] + 1) * 127.5)
+            passes['normals'] = normals
+        if 'vertex_ids' in outputs:
+            corners = mesh.faces[faces]
+            nearest = np.argmin(np.linalg.norm(mesh.vertices[corners] - points[:, None, :], axis=2), axis=1)
+            vertex_ids = np.full(depth.shape, -1, dtype=np.int32)
+            vertex_ids[visible] = corners[np.arange(len(corners)), nearest]
+            passes['vertex_ids'] = vertex_ids
+    return passes
+
+
+def _write_shard_view(writer, shard_writer, color, depth_map, record, passes=None):
+    """
+    Encode a view on a writer thread and write it as one sample of a shard, whose labels and index
+    record are the fields of record. The extra passes of render_passes become members too. Returns
+    the shard path.
+    """
+    labels = {field: value for field, value in record.items() if field != "Key"}
+    with instrumentation.stage("render.write"):
+        members = {"png": writer.encode_png(color, rgb=True)}
+        if depth_map.dtype.kind == 'f':
+            members["depth.npy"] = encode_npy(depth_map)
+        else:
+            members["depth.png"] = writer.encode_png(depth_map)
+        for output, image in (passes or {}).items():
+            if output == 'vertex_ids':
+                members["vertex_ids.npy"] = encode_npy(image)
+            else:
+                members[f"{output}.png"] = writer.encode_png(image, rgb=True)
+        members["json"] = encode_json(labels)
+        return shard_writer.write(record["Key"], members, **labels)
+
+
+def _write_file_view(writer, index, image_path, color, depth_path, depth_map, record, pass_images=()):
+    """
+    Write the image and depth PNG of a view on a writer thread, and the (path, image) pairs of its extra
+    passes, then append its record to the render index.
+    """
+    with instrumentation.stage("render.write"):
+        writer.save_png(image_path, color, rgb=True)
+        if depth_path is not None:
+            writer.save_png(depth_path, depth_map)
+        for path, image in pass_images:
+            writer.save_png(path, image, rgb=True)
+        index.append(record)
+
+
+def _open_writers(output_dir, index_prefix, shard_size):
+    """
+    Open the writers that record rendered views: a shard writer, with its own index, when shard_size is
+    given, otherwise the render index of the image files.
+
+    Returns:
+    - tuple: (shard_writer, index), one of which is None.
+    """
+    if shard_size:
+        return ShardWriter(output_dir, index_prefix, shard_size), None
+    return None, IndexWriter(os.path.join(output_dir, index_prefix + INDEX_SUFFIX))
+
+
+def _render_meshes(meshes, renderer, output_dir, num_images, yfov, roll, yaw, pitch, light_intensity,
+                   light_color, seed, writer_threads, writer_queue, png_compression, depth_format, depth_scale,
+                   depth_dtype, backend, view_distribution='uniform', outputs=('color', 'depth'), shard_size=None,
+                   index_prefix="render", skip_keys=frozenset(), on_rendered=None, writers=None):
+    """
+    Render color images and depth maps of a list of meshes with one renderer.
+
+    Args:
+    - meshes (list): (name, source) pairs as returned by list_meshes, or (name, source, labels) triples
+                     whose labels are saved in the render index and in shards, or (name, source, labels,
+                     key) where key identifies the mesh instead of the hash of its geometry, so that a
+                     skipped mesh is not loaded.
+    - renderer (pyrender.OffscreenRenderer or NumpyRenderer): Renderer created by make_renderer.
+    - index_prefix (str): Prefix of the render index (and the shards) of this call, distinct for every process.
+    - writers (tuple): Optional (shard_writer, index) pair from _open_writers, kept open after the call so
+                       that several calls share shards; otherwise the call opens its own with index_prefix.
+    - skip_keys (set): Keys of meshes whose views are already on disk; these meshes are skipped.
+    - on_rendered (callable): Called as on_rendered(name, key, paths, views) once all files of a mesh are
+                              written, where views holds a row of the views table of the manifest per view.
+    - The remaining arguments are those of generate_cantilever_images.
+
+    Returns:
+    - tuple: Number of rendered views and the keys of the skipped meshes.
+    """
+    stores = {}
+    num_rendered = 0
+    skipped = []
+    # Meshes whose images are still queued in the writer, as (name, key, paths, views, futures)
+    unwritten = deque()
+
+    # PNG encoding and disk writes run on writer threads while the next view renders
+    writer = AsyncImageWriter(writer_threads, writer_queue, png_compression)
+    # Views are recorded in the render index as they are written, by the shard writer or by the writer threads
+    shard_writer, index = writers or _open_writers(output_dir, index_prefix, shard_size)
+
+    # One scene is reused for all meshes; only its mesh and the camera and light poses change
+    beam_scene = (NumpyScene if backend == 'numpy' else BeamScene)(yfov, light_intensity, light_color)
+    img_size = (renderer.viewport_width, renderer.viewport_height)
+    depth_offset = 0.0
+    # Passes derived from the color and depth render of every view
+    extras = [output for output in OUTPUTS if output in outputs and output not in ['color', 'depth']]
+    # Outputs only enter the keys of meshes rendered with extra passes, so other keys are unchanged
+    output_params = dict(outputs=extras) if extras else {}
+
+    # Iterate over each mesh
+    for name, source, *extra in meshes:
+        labels = extra[0] if extra else {}
+        # A key given with the mesh, e.g. the key of a deformed mesh, identifies it before it is loaded
+        mesh_key = extra[1] if len(extra) > 1 else None
+        with instrumentation.stage("render.load"):
+            if mesh_key is None:
+                source = load_mesh(source, stores)
+                mesh_key = mesh_digest(source)
+            # The views of a mesh depend on its geometry, its name (through the seed) and the render parameters
+            key = artifact_key(stage="render", mesh=mesh_key, name=name, num_images=num_images,
+                               img_size=img_size, yfov=yfov, roll=roll, yaw=yaw, pitch=pitch,
+                               light_intensity=light_intensity, light_color=light_color, seed=seed,
+                               sampler="pose_sampler", view_distribution=view_distribution,
+                               depth_format=depth_format, depth_scale=depth_scale, depth_dtype=depth_dtype,
+                               backend=backend, sharded=shard_writer is not None, **output_params)
+        if key in skip_keys:
+            skipped.append(key)
+            continue
+        with instrumentation.stage("render.load"):
+            source = load_mesh(source, stores)
+
+        paths = []
+        views = []
+        futures = []
+
+        if shard_writer is None:
+            # Create a directory specific to the current mesh to store its images
+            mesh_subdir = os.path.join(output_dir, name)
+            os.makedirs(mesh_subdir, exist_ok=True)
+
+            # Store the camera model and depth encoding next to the images
+            write_camera_info(mesh_subdir, beam_scene.camera, img_size, depth_format, depth_scale, depth_offset,
+                              depth_dtype, ['color', 'depth'] + extras)
+            paths.append(os.path.join(mesh_subdir, "camera.json"))
+            if depth_format == 'npy':
+                # Raw depths of all views of the mesh go into one shard that can be memory-mapped
+                paths.append(os.path.join(mesh_subdir, "depth.npy"))
+                depth_shard = np.lib.format.open_memmap(paths[-1], mode="w+", dtype=depth_dtype,
+                                                        shape=(num_images, img_size[1], img_size[0]))
+
+        # Place the mesh in the scene
+        mesh = beam_scene.set_mesh(source)
+
+        # Compute the center of the mesh
+        bounds = mesh.bounds
+        center = bounds.mean(axis=0)
+
+        # Compute the diagonal of the bounding box
+        diagonal = np.linalg.norm(bounds[1] - bounds[0])
+        half_diagonal = diagonal
+
+        # Calculate the distance based on the diagonal and the FOV.
+        # The formula is derived from the tangent half-angle formula: tan(fov/2) = (half_diagonal / distance)
+        distance = half_diagonal / np.tan(yfov/2)
+
+        # Sample the camera angles and poses of all views at once, from the seeded stream of the mesh
+        angles = sample_angles(num_images, roll, pitch, yaw, view_distribution, mesh_rng(seed, name))
+        poses = camera_poses(angles, center, distance)
+        if shard_writer is None:
+            # Camera-to-world poses of all views, saved next to the images
+            paths.append(os.path.join(mesh_subdir, "poses.npy"))
+            np.save(paths[-1], poses)
+            if 'vertex_ids' in extras:
+                # Vertex-ID maps of all views of the mesh, like the raw depths
+                vertex_ids_path = os.path.join(mesh_subdir, "vertex_ids.npy")
+                paths.append(vertex_ids_path)
+                vertex_ids_shard = np.lib.format.open_memmap(vertex_ids_path, mode="w+", dtype=np.int32,
+                                                             shape=(num_images, img_size[1], img_size[0]))
+
+        # Render images from different viewpoints
+        for k in range(num_images):
+            current_roll, current_pitch, current_yaw = angles[k]
+            camera_pose = poses[k]
+
+            # Move the camera and the light to the new viewpoint
+            beam_scene.set_pose(camera_pose)
+
+            # Render the scene capturing both color and depth information
+            with instrumentation.stage("render.draw"):
+                color, depth = renderer.render(beam_scene if backend == 'numpy' else beam_scene.scene)
+            instrumentation.count("render.images")
+
+            # Encode the depth map
+            with instrumentation.stage("render.encode"):
+                color = (color * 255).astype(np.uint8)
+                depth_map = encode_depth(depth, depth_format, depth_scale, depth_offset, depth_dtype)
+
+            # Mask, normals and vertex ids of the same view, from its depth map and the faces of its pixels:
+            # the z-buffer of the NumPy backend keeps them, pyrender renders them in a second pass
+            passes = {}
+            if extras:
+                with instrumentation.stage("render.passes"):
+                    face_ids = None
+                    if backend == 'numpy':
+                        face_ids = renderer.face_ids
+                    elif 'normals' in extras or 'vertex_ids' in extras:
+                        face_ids = beam_scene.render_face_ids(renderer)
+                    passes = render_passes(depth, source, camera_pose, yfov, extras, face_ids)
+
+            view = {"View": k, "Image": None, "Depth": None, "DepthIndex": None, "Shard": None,
+                    "Key": sample_key(name, k), "Roll": current_roll, "Pitch": current_pitch, "Yaw": current_yaw}
+            views.append(view)
+            # Record of the view in the render index, with the labels of the mesh and the camera pose
+            record = dict(labels, Mesh=name, View=k, Key=view["Key"], CameraPose=camera_pose, Roll=current_roll,
+                          Pitch=current_pitch, Yaw=current_yaw)
+
+            if shard_writer is not None:
+                # Image, depth map and labels of the view become one sample of a shard
+                futures.append(writer.submit(_write_shard_view, writer, shard_writer, color, depth_map, record,
+                                             passes))
+            else:
+                # Paths in the index are relative to output_dir
+                img_path = os.path.join(mesh_subdir, "image_{:04}.png".format(k))
+                paths.append(img_path)
+                view["Image"], record["Image"] = img_path, os.path.join(name, "image_{:04}.png".format(k))
+
+                if depth_format == 'npy':
+                    depth_shard[k] = depth_map
+                    depth_path = None
+                    view["Depth"], view["DepthIndex"] = paths[1], k
+                    record["Depth"], record["DepthIndex"] = os.path.join(name, "depth.npy"), k
+                else:
+                    depth_path = os.path.join(mesh_subdir, "depth_{:04}.png".format(k))
+                    paths.append(depth_path)
+                    view["Depth"], record["Depth"] = depth_path, os.path.join(name, "depth_{:04}.png".format(k))
+
+                pass_images = []
+                for output in ['mask', 'normals']:
+                    if output in passes:
+                        pass_path = os.path.join(mesh_subdir, "{}_{:04}.png".format(output, k))
+                        paths.append(pass_path)
+                        pass_images.append((pass_path, passes[output]))
+                        column = output.capitalize()
+                        view[column], record[column] = pass_path, os.path.join(name, os.path.basename(pass_path))
+                if 'vertex_ids' in passes:
+                    vertex_ids_shard[k] = passes['vertex_ids']
+                    view["VertexIds"], record["VertexIds"] = vertex_ids_path, os.path.join(name, "vertex_ids.npy")
+
+                # Save the color image, the depth map and the extra passes, then index the view
+                futures.append(writer.submit(_write_file_view, writer, index, img_path, color, depth_path, depth_map,
+                                             record, pass_images))
+            num_rendered += 1
+
+        if shard_writer is None and depth_format == 'npy':
+            depth_shard.flush()
+            del depth_shard
+        if shard_writer is None and 'vertex_ids' in extras:
+            vertex_ids_shard.flush()
+            del vertex_ids_shard
+
+        # A mesh is journaled only once all of its files are on disk
+        unwritten.append((name, key, paths, views, futures))
+        while unwritten and all(f.done() and f.exception() is None for f in unwritten[0][4]):
+            _report_rendered(on_rendered, shard_writer, *unwritten.popleft())
+
+    writer.close()
+    for entry in unwritten:
+        _report_rendered(on_rendered, shard_writer, *entry)
+    if writers is None:
+        (index or shard_writer).close()
+    return num_rendered, skipped
+
+
+def _report_rendered(on_rendered, shard_writer, name, key, paths, views, futures):
+    """Pass a mesh whose files are written to on_rendered, with the shards holding its views."""
+    if shard_writer is not None:
+        # Every view is one future, which returns the shard it was written to
+        for view, future in zip(views, futures):
+            view["Shard"] = future.result()
+        paths = list(dict.fromkeys(view["Shard"] for view in views))
+    if on_rendered is not None:
+        on_rendered(name, key, paths, views)
+
+
+# Renderer owned by a worker process of the render pool, the keys of the meshes it skips and the
+# (shard_writer, index) pair its views are written to.
+_worker_renderer = None
+_worker_skip_keys = frozenset()
+_worker_writers = None
+
+
+def _init_render_worker(backend, img_size, skip_keys, output_dir, index_prefix, shard_size):
+    """
+    Create the renderer (and offscreen context) and the writers of a render worker once, when the process starts.
+
+    Each worker writes its own index and series of shards, named after its process id, for all the chunks
+    it renders, so that shards fill up to shard_size. They are closed when the process exits, which
+    requires the pool to be closed and joined rather than terminated.
+    """
+    global _worker_renderer, _worker_skip_keys, _worker_writers
+    _worker_renderer = make_renderer(backend, img_size)
+    _worker_skip_keys = skip_keys
+    _worker_writers = _open_writers(output_dir, f"{index_prefix}-{os.getpid()}", shard_size)
+    multiprocessing.util.Finalize(None, _close_worker_writers, exitpriority=10)
+
+
+def _close_worker_writers():
+    """Close the current shard and the index of a render worker."""
+    shard_writer, index = _worker_writers
+    (index or shard_writer).close()
+
+
+def _render_chunk(args):
+    """
+    Render a chunk of meshes in a worker process with its own offscreen context.
+
+    Returns the number of rendered views, the keys of the skipped meshes, the (name, key, paths, views)
+    entries of the rendered meshes, which the main process journals, and the stage timings of the chunk.
+    """
+    meshes, kwargs = args
+    rendered = []
+    num_rendered, skipped = _render_meshes(meshes, _worker_renderer, skip_keys=_worker_skip_keys,
+                                           on_rendered=lambda *entry: rendered.append(entry),
+                                           writers=_worker_writers, **kwargs)
+    return num_rendered, skipped, rendered, instrumentation.take()
+
+
+class _CountingIterator:
+    """Iterate over an iterable while counting its items."""
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.iterable:
+            self.count += 1
+            yield item
+
+
+def _chunks(iterable, size):
+    """Split an iterable into lists of at most size items, consuming it lazily."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def generate_cantilever_images(input_dir="./deformed_beam",
                                output_dir="./imgs",
                                num_images = 1,
@@ -44,12 +719,29 @@ def generate_cantilever_images(input_dir="./deformed_beam",
                                yaw=(-2* np.pi, 2* np.pi),
                                pitch=(-np.pi / 2, np.pi / 2),
                                light_intensity = 1.5,
-                               light_color=np.array([1.0, 0.90, 0.7])):
+                               light_color=np.array([1.0, 0.90, 0.7]),
+                               workers=1,
+                               seed=0,
+                               view_distribution='uniform',
+                               outputs=('color', 'depth'),
+                               platform=None,
+                               writer_threads=2,
+                               writer_queue=8,
+                               png_compression=3,
+                               depth_format='png8',
+                               depth_scale=1e-4,
+                               depth_dtype='float32',
+                               backend='pyrender',
+                               meshes=None,
+                               resume=False,
+                               manifest_dir="./manifest",
+                               shard_size=None,
+                               partition=None):
     """
     Generates rendered images and depth maps from beam meshes in a directory.
 
     Args:
-    - input_dir (str): Directory containing the mesh files (.obj).
+    - input_dir (str): Directory containing the mesh files (.obj, .ply, .glb or .npz) or a deformed mesh store.
     - output_dir (str): Directory to save the rendered images and depth maps.
     - num_images (int): Number of images to generate for each mesh.
     - img_size (tuple): Size of the rendered images.
@@ -57,85 +749,182 @@ def generate_cantilever_images(input_dir="./deformed_beam",
     - roll (float or tuple): Roll angle(s) for the camera.
     - yaw (float or tuple): Yaw angle(s) for the camera.
     - pitch (float or tuple): Pitch angle(s) for the camera.
+    - view_distribution (str): How the view directions are sampled: 'uniform' angles, uniform on the
+                               'sphere', a 'fibonacci' lattice or 'stratified' angles; see
+                               pose_sampler.sample_angles. The camera-to-world poses of the views of a
+                               mesh are saved to poses.npy next to its images, and with every view in
+                               the render index.
     - light_color (numpy.array): RGB color for the light source.
-    """
+    - outputs (list): Passes saved for every view, among OUTPUTS. Color and depth are always saved.
+                      'mask' saves the silhouette of the mesh, read from the depth buffer, as mask_<k>.png.
+                      'normals' saves the normals of the visible faces in camera coordinates as RGB
+                      normals_<k>.png, and 'vertex_ids' the index of the mesh vertex seen in every pixel
+                      (-1 for background) to an int32 vertex_ids.npy of shape (num_images, height, width).
+                      The passes come from the depth map of the view and the face seen in every pixel
+                      (see render_passes): the NumPy backend keeps it in its z-buffer, and pyrender
+                      draws it in a flat face-index pass (see BeamScene.render_face_ids).
+    - workers (int): Number of render processes. Each worker owns its own offscreen context and
+                     renders a share of the meshes. 1 renders in the calling process.
+    - seed (int): Seed of the camera angles. Every mesh derives its own stream from it and from its
+                  name, so the output does not depend on the number of workers.
+    - platform (str): Offscreen platform of the worker processes, 'egl' or 'osmesa' (CPU only).
+                      None keeps PYOPENGL_PLATFORM as it is. With workers=1 it is applied when
+                      pyrender has not been imported yet.
+    - writer_threads (int): Number of threads encoding and writing PNGs per render process.
+    - writer_queue (int): Maximum number of images waiting to be written per render process.
+                          Rendering blocks when the queue is full, which bounds memory use.
+    - png_compression (int): PNG compression level from 0 (fastest) to 9 (smallest files).
+    - depth_format (str): 'png8' writes 8-bit depth PNGs normalized per image (for visualization).
+                          'png16' writes 16-bit PNGs of metric depth with a fixed depth_scale.
+                          'npy' writes the raw float depths of all views of a mesh to one depth.npy
+                          of shape (num_images, height, width), readable with np.load(mmap_mode='r').
+                          The camera near/far planes, intrinsics and the depth encoding are saved in
+                          camera.json next to the images.
+    - depth_scale (float): Meters per unit of the 16-bit depth PNGs (1e-4 covers depths up to 6.5 m).
+    - depth_dtype (str): 'float32' or 'float16', the dtype of the 'npy' depth shards.
+    - backend (str): 'pyrender' renders with OpenGL. 'numpy' uses the CPU z-buffer rasterizer of
+                     numpy_renderer, which needs no EGL/OSMesa context. Its depth maps match
+                     pyrender up to a few silhouette edge pixels and float32 rounding (see
+                     numpy_renderer.PARITY_TOLERANCE); colors use flat Lambert shading.
+    - meshes (iterable): Optional (name, mesh) pairs rendered instead of the contents of input_dir,
+                         e.g. deformed Trimesh objects streamed from the deformation stage. They are
+                         consumed lazily, so rendering starts before the last mesh is produced. See
+                         _render_meshes for the labels and keys that can be given with each mesh.
+    - resume (bool): Skip meshes whose views a previous run already wrote to output_dir. Each mesh is
+                     keyed by a hash of its geometry (or the key given with it), its name, the camera
+                     and light parameters, the seed and the output formats, and is recorded in
+                     output_dir/journal.jsonl once all of its files are written, so an interrupted run
+                     continues where it stopped and a parameter change re-renders every mesh it affects.
+    - manifest_dir (str): Directory of the dataset manifest, where the views table lists the image,
+                          depth map and camera angles of every view of this run.
+    - shard_size (int): If given, write the views into tar shards of at most about this many bytes
+                        instead of a directory per mesh. Each view is one WebDataset sample with its
+                        image (.png), depth map (.depth.png, or .depth.npy for depth_format 'npy'), extra
+                        passes (.mask.png, .normals.png, .vertex_ids.npy) and labels (.json: mesh
+                        reference, beam, E, I, load, location and camera pose).
+    - partition (str): Name of the partition of a sharded run. Several partitions can render into the
+                       same output_dir: each one keeps its own journal, index files and shards,
+                       prefixed with its name, and only merges and removes those.
 
-    # Ensure the output directory exists
-    os.makedirs(output_dir, exist_ok=True)
+    Every view is also appended to a render index in output_dir as soon as its files are written:
+    one JSON record with the labels of its mesh, the camera pose and angles, and the paths of its
+    image and depth map relative to output_dir, or its shard and member offsets. Every render
+    process appends to its own <prefix>.index.jsonl, and the files are merged into
+    merged.index.jsonl at the end of the run; render_index.read_index reads them either way. The
+    labels of meshes listed from input_dir come from the deformations table of the manifest. A run
+    without resume removes the index and shards of earlier runs.
 
-    # Initialize the renderer with the desired image size
-    renderer = pyrender.OffscreenRenderer(*img_size)
+    Returns:
+    - dict: Number of rendered images and of skipped meshes, elapsed seconds and throughput in images
+            per second.
+    """
 
-    # Extract paths of all .obj files in the input directory
-    paths = [os.path.join(input_dir, fname) for fname in os.listdir(input_dir) if fname.endswith('.obj')]
+    assert depth_format in DEPTH_FORMATS, f"Invalid depth_format. Choose one of {DEPTH_FORMATS}."
+    assert depth_dtype in ['float32', 'float16'], "Invalid depth_dtype. Choose 'float32' or 'float16'."
+    assert backend in BACKENDS, f"Invalid backend. Choose one of {BACKENDS}."
+    assert view_distribution in VIEW_DISTRIBUTIONS, f"Invalid view_distribution. Choose one of {VIEW_DISTRIBUTIONS}."
+    assert all(output in OUTPUTS for output in outputs), f"Invalid outputs. Choose from {OUTPUTS}."
 
-    # Iterate over each mesh
-    for path in paths:
-        # Create a directory specific to the current mesh to store its images
-        mesh_subdir = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0])
-        os.makedirs(mesh_subdir, exist_ok=True)
+    # Ensure the output directory exists
+    os.makedirs(output_dir, exist_ok=True)
 
-        # Load the mesh and convert it to a format suitable for rendering
-        mesh = trimesh.load_mesh(path)
-        mesh = pyrender.Mesh.from_trimesh(mesh)
+    # List all meshes (mesh files or stored samples) in the input directory
+    if meshes is None:
+        labels = read_labels(manifest_dir)
+        meshes = [(name, source, labels.get(name, {})) for name, source in list_meshes(input_dir)]
+    render_kwargs = dict(output_dir=output_dir, num_images=num_images, yfov=yfov, roll=roll, yaw=yaw,
+                         pitch=pitch, light_intensity=light_intensity, light_color=light_color, seed=seed,
+                         writer_threads=writer_threads, writer_queue=writer_queue, png_compression=png_compression,
+                         depth_format=depth_format, depth_scale=depth_scale, depth_dtype=depth_dtype,
+                         backend=backend, view_distribution=view_distribution, outputs=outputs, shard_size=shard_size)
 
-        # Create a scene and add the mesh
-        scene = pyrender.Scene()
-        scene.add(mesh)
+    # pyrender reads PYOPENGL_PLATFORM when it is first imported, here or in the spawned workers
+    if platform is not None:
+        os.environ["PYOPENGL_PLATFORM"] = platform
 
-        # Configure light source
-        light = pyrender.DirectionalLight(color=light_color, intensity=light_intensity)
-        # Configure camera
-        camera = pyrender.PerspectiveCamera(yfov=yfov)
+    journal = RunJournal(output_dir, resume, partition)
+    skip_keys = frozenset(journal.done_keys())
+    # Index files and shards of a partition start with its name
+    run_prefix = f"{partition}-" if partition else ""
 
-        # Compute the center of the mesh
-        bounds = mesh.bounds
-        center = bounds.mean(axis=0)
+    if not resume:
+        # The index and shards of earlier runs would otherwise be merged with those of this one
+        remove_index(output_dir, run_prefix)
+        for fname in os.listdir(output_dir):
+            if fname.startswith(run_prefix + "shard-") and fname.endswith(".tar"):
+                os.remove(os.path.join(output_dir, fname))
+    # Index files and shards of every run get new names, so a resumed run never overwrites journaled ones
+    index_prefix = run_prefix + time.strftime(("shard" if shard_size else "render") + "-%Y%m%d%H%M%S")
+    if shard_size:
+        write_camera_info(output_dir, NumpyScene(yfov, light_intensity, light_color).camera, img_size, depth_format,
+                          depth_scale, 0.0, depth_dtype, [output for output in OUTPUTS if output in outputs or
+                                                          output in ['color', 'depth']])
 
-        # Compute the diagonal of the bounding box
-        diagonal = np.linalg.norm(bounds[1] - bounds[0])
-        half_diagonal = diagonal
+    views = []
 
-        # Calculate the distance based on the diagonal and the FOV.
-        # The formula is derived from the tangent half-angle formula: tan(fov/2) = (half_diagonal / distance)
-        distance = half_diagonal / np.tan(yfov/2)
+    def record(name, key, paths, mesh_views):
+        journal.record(key, paths, name=name, views=mesh_views)
+        views.extend(dict(view, Mesh=name) for view in mesh_views)
 
-        # Render images from different viewpoints
-        for k in range(num_images):
-            current_yaw = random.uniform(*yaw) if isinstance(yaw, tuple) else yaw
-            current_pitch = random.uniform(*pitch) if isinstance(pitch, tuple) else pitch
-            current_roll = random.uniform(*roll) if isinstance(roll, tuple) else roll
-
-            # Compute the camera position and orientation
-            eye = center + distance * np.array([np.sin(current_pitch) * np.cos(current_yaw),
-                                                np.sin(current_pitch) * np.sin(current_yaw),
-                                                np.cos(current_pitch)])
-            # Compute the camera orientation to always look at the center
-            R = rotation_matrix(current_roll, current_pitch, current_yaw)
-            camera_pose = np.eye(4)
-            camera_pose[:3, :3] = R
-            camera_pose[:3, 3] = eye
-
-            # Add camera and light to the scene
-            camera_node = scene.add(camera, pose=camera_pose)
-            light_node = scene.add(light, pose=camera_pose)
+    start = time.perf_counter()
+    if workers <= 1:
+        # Initialize the renderer with the desired image size
+        renderer = make_renderer(backend, img_size)
+        counted = _CountingIterator(meshes)
+        num_rendered, skipped = _render_meshes(counted, renderer, skip_keys=skip_keys, on_rendered=record,
+                                               index_prefix=index_prefix, **render_kwargs)
+        num_meshes = counted.count
+        renderer.delete()
+    else:
+        # Several small chunks per worker keep the pool busy when meshes take uneven time
+        chunk_size = max(1, -(-len(meshes) // (workers * 4))) if hasattr(meshes, "__len__") else 4
+        num_rendered = num_meshes = 0
+        skipped = []
+        pending = deque()
 
-            # Render the scene capturing both color and depth information
-            color, depth = renderer.render(scene)
+        def collect(result):
+            chunk_rendered, chunk_skipped, rendered, stats = result.get()
+            instrumentation.merge(stats)
+            for entry in rendered:
+                record(*entry)
+            skipped.extend(chunk_skipped)
+            return chunk_rendered
 
-            # Normalize the depth map for visualization
-            depth_map = cv2.normalize(depth, None, 255, 0, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        with multiprocessing.get_context("spawn").Pool(
+                workers, initializer=_init_render_worker,
+                initargs=(backend, img_size, skip_keys, output_dir, index_prefix, shard_size)) as pool:
+            for chunk in _chunks(meshes, chunk_size):
+                num_meshes += len(chunk)
+                pending.append(pool.apply_async(_render_chunk, ((chunk, render_kwargs),)))
+                # Bound the chunks in flight so a streamed input is not pulled into memory at once
+                if len(pending) >= 2 * workers:
+                    num_rendered += collect(pending.popleft())
+            while pending:
+                num_rendered += collect(pending.popleft())
+            # Let the workers exit on their own, which closes their shards and indexes
+            pool.close()
+            pool.join()
+    elapsed = time.perf_counter() - start
 
-            # Save the color image and depth map
-            img_path = os.path.join(mesh_subdir, "image_{:04}.png".format(k))
-            depth_path = os.path.join(mesh_subdir, "depth_{:04}.png".format(k))
-            imageio.imsave(img_path, (color * 255).astype(np.uint8))
-            imageio.imsave(depth_path, depth_map)
+    # Views of skipped meshes are listed from the journal of the run that rendered them
+    for key in skipped:
+        entry = journal.entries[key]
+        views.extend(dict(view, Mesh=entry["name"]) for view in entry.get("views", []))
+    journal.close()
+    with instrumentation.stage("manifest"):
+        write_table(manifest_dir, "views", views)
+        merge_index(output_dir, run_prefix)
+    num_skipped = len(skipped)
 
-            # Remove camera and light from the scene to reset for next render
-            scene.remove_node(camera_node)
-            scene.remove_node(light_node)
+    images_per_second = num_rendered / elapsed if elapsed > 0 else 0.0
+    print(f"Rendered {num_rendered} images of {num_meshes - num_skipped} meshes with {workers} {backend} worker(s) "
+          f"in {elapsed:.2f}s ({images_per_second:.2f} images/s)")
+    if num_skipped:
+        print(f"Skipped {num_skipped} meshes already rendered in {output_dir}")
+    return {"images": num_rendered, "skipped": num_skipped, "seconds": elapsed,
+            "images_per_second": images_per_second}
 
 
-# Example usage:
-generate_cantilever_images()
+if __name__ == "__main__":
+    # Example usage:
+    generate_cantilever_images()
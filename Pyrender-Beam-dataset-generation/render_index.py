@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+
+
+INDEX_SUFFIX = ".index.jsonl"
+MERGED_INDEX = "merged" + INDEX_SUFFIX
+
+
+class IndexWriter:
+    """
+    Append-only index of rendered views, one JSON record per line.
+
+    A record is appended and flushed as soon as the files of its view are written, so an
+    interrupted run leaves an index of exactly the views that are on disk, apart from a possibly
+    truncated last line, which readers ignore. Every render process writes its own index file;
+    read_index and merge_index combine them.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+        - path (str): Path of the index file, ending with INDEX_SUFFIX. Records are appended to an existing file.
+        """
+        self.path = path
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, record):
+        """Append a record. Safe to call from several threads."""
+        line = json.dumps(record, default=lambda value: value.tolist()) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def index_files(directory, prefix=""):
+    """List the index files of a directory whose names start with prefix, in name order, the merged index first."""
+    return sorted(os.path.join(directory, fname) for fname in os.listdir(directory)
+                  if fname.startswith(prefix) and fname.endswith(INDEX_SUFFIX))
+
+
+def read_index(directory, prefix=""):
+    """
+    Read all index files of a directory, e.g. one per render worker.
+
+    Files are read in name order, so a record of a view from a later run replaces the record of
+    the same view from an earlier run. The cost is linear in the number of records.
+
+    Args:
+    - directory (str): Directory of the index files.
+    - prefix (str): Only read the index files whose names start with prefix, e.g. those of one partition.
+
+    Returns:
+    - dict: Records keyed by their Key, the sample key of the view.
+    """
+    records = {}
+    for path in index_files(directory, prefix):
+        with open(path) as index_file:
+            for line in index_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record["Key"]] = record
+    return records
+
+
+def merge_index(directory, prefix=""):
+    """
+    Merge the index files of a directory into MERGED_INDEX and remove the merged files.
+
+    The merged index is complete on disk before any other index file is removed, so an
+    interruption never loses records. Its records are sorted by key, so it does not depend on
+    which process rendered a view.
+
+    Args:
+    - directory (str): Directory of the index files.
+    - prefix (str): Only merge the index files whose names start with prefix, into <prefix>merged.index.jsonl,
+                    e.g. those of one partition of a sharded run while other partitions are still writing theirs.
+
+    Returns:
+    - str: Path of the merged index.
+    """
+    paths = index_files(directory, prefix)
+    records = read_index(directory, prefix)
+    merged_path = os.path.join(directory, prefix + MERGED_INDEX)
+    with open(merged_path + ".tmp", "w") as merged_file:
+        for key in sorted(records):
+            merged_file.write(json.dumps(records[key]) + "\n")
+    os.replace(merged_path + ".tmp", merged_path)
+
+    for path in paths:
+        if path != merged_path:
+            os.remove(path)
+    return merged_path
+
+
+def remove_index(directory, prefix=""):
+    """Remove all index files of a directory whose names start with prefix."""
+    for path in index_files(directory, prefix):
+        os.remove(path)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from partition import partition_file
+
+
+def _jsonable(value):
+    """Convert NumPy values so they can be hashed as JSON."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot hash a value of type {type(value).__name__}")
+
+
+def artifact_key(**params):
+    """
+    Content-addressed key of an artifact: a hash of all the inputs it is computed from.
+
+    The same inputs always give the same key, and any change of an input (a float, a camera
+    parameter, the seed, the content of an input mesh) gives a different key.
+
+    Args:
+    - params: The inputs of the artifact. Values must be JSON-serializable or NumPy values.
+
+    Returns:
+    - str: Hexadecimal SHA-256 digest of the canonical JSON of the inputs.
+    """
+    canonical = json.dumps(params, sort_keys=True, default=_jsonable, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def mesh_digest(mesh):
+    """
+    Hash of the geometry of a mesh, used as input of the keys of artifacts derived from it.
+
+    Args:
+    - mesh (Trimesh): The mesh.
+
+    Returns:
+    - str: Hexadecimal SHA-256 digest of its vertices and faces.
+    """
+    digest = hashlib.sha256(np.ascontiguousarray(mesh.vertices, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(mesh.faces, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+class RunJournal:
+    """
+    Append-only journal of the artifacts a stage has completed, stored as JSON lines.
+
+    An entry is appended only after all files of the artifact are written, so after a crash
+    the journal lists exactly the artifacts that are complete. A rerun with resume=True skips
+    artifacts whose key is journaled and whose files still exist, and recomputes everything
+    else. A truncated last line left by a crash is ignored and cut from the file, so that the
+    entries of the rerun start on a line of their own.
+    """
+
+    FILE_NAME = "journal.jsonl"
+
+    def __init__(self, directory, resume=True, partition=None):
+        """
+        Args:
+        - directory (str): Output directory of the stage; the journal is directory/journal.jsonl.
+        - resume (bool): Keep the entries of previous runs. False starts a new, empty journal.
+        - partition (str): Name of the partition of a sharded run. Every partition keeps its own journal,
+                           e.g. journal-part-00000-of-00004.jsonl, so partitions can share the directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, partition_file(self.FILE_NAME, partition))
+        self.entries = {}
+
+        if resume and os.path.exists(self.path):
+            with open(self.path, "rb+") as journal_file:
+                content = journal_file.read()
+                # Drop a partial last line; appending to it would corrupt the next entry
+                end = content.rfind(b"\n") + 1
+                if end < len(content):
+                    journal_file.truncate(end)
+            for line in content[:end].decode().splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[entry["key"]] = entry
+
+        self._file = open(self.path, "a" if resume else "w")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_done(self, key, paths=None):
+        """
+        Return True if the artifact is journaled and all of its files exist and are not empty.
+
+        Args:
+        - key (str): Key of the artifact.
+        - paths (list): Optional files the artifact must have been written to. An artifact with the
+                        same inputs journaled under other file names is not done.
+        """
+        entry = self.entries.get(key)
+        if entry is None or (paths is not None and list(paths) != entry["paths"]):
+            return False
+        return all(os.path.isfile(path) and os.path.getsize(path) > 0 for path in entry["paths"])
+
+    def done_keys(self, path_of=None):
+        """
+        Return the set of keys whose artifacts are complete.
+
+        Args:
+        - path_of (callable): Optional function of a journal entry that returns the files its artifact
+                              must have now, e.g. its mesh file in the current format. See is_done.
+        """
+        return {key for key, entry in self.entries.items()
+                if self.is_done(key, None if path_of is None else path_of(entry))}
+
+    def record(self, key, paths, **info):
+        """
+        Journal a completed artifact.
+
+        Args:
+        - key (str): Key of the artifact, from artifact_key.
+        - paths (list): Files of the artifact.
+        - info: Extra fields saved with the entry, e.g. the name of the artifact.
+        """
+        entry = dict(info, key=key, paths=list(paths))
+        self.entries[key] = entry
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,210 @@
+import io
+import json
+import os
+import tarfile
+import threading
+
+import numpy as np
+
+from render_index import INDEX_SUFFIX, IndexWriter
+
+
+def sample_key(mesh_name, view):
+    """
+    WebDataset key of a rendered view, e.g. 'cantilever_beam_0000_0p9_165p0/0003'.
+
+    Dots in a key would be read as the start of the member extension, so they are replaced by 'p'.
+    """
+    return f"{mesh_name.replace('.', 'p')}/{view:04d}"
+
+
+def encode_json(data):
+    """Encode labels as JSON bytes, converting NumPy values."""
+    return json.dumps(data, default=lambda value: value.tolist() if hasattr(value, "tolist") else str(value)).encode()
+
+
+def encode_npy(array):
+    """Encode an array in .npy format."""
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def _padded(size):
+    """Size of member data in a tar file, padded to whole 512-byte blocks."""
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+class ShardWriter:
+    """
+    Write samples into size-bounded tar shards, in the layout of WebDataset.
+
+    Every sample is a group of members sharing a key, e.g. key.png, key.depth.png and key.json,
+    so the shards can be streamed sequentially by a training data loader. Each writer also appends
+    a record per sample to the render index <prefix>.index.jsonl with the Shard and the byte
+    [offset, size] of every member (Members), which gives random access to a sample without reading
+    the tar headers. A record is only appended once the sample is flushed to its shard, and a shard
+    is readable even if the writer is interrupted before it is closed.
+
+    Writers of parallel processes must use distinct prefixes; render_index.read_index merges their indexes.
+    """
+
+    def __init__(self, output_dir, prefix="shard", max_bytes=1 << 30, max_samples=None):
+        """
+        Args:
+        - output_dir (str): Directory of the shards and the index.
+        - prefix (str): Shards are named <prefix>-000000.tar, <prefix>-000001.tar, ...
+        - max_bytes (int): A new shard is started before a sample would grow the current one beyond this size.
+        - max_samples (int): Optional maximum number of samples per shard.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_samples = max_samples
+        self.shards = []
+        self.shard_path = None
+        self._tar = None
+        self._bytes = 0
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._index = IndexWriter(os.path.join(output_dir, prefix + INDEX_SUFFIX))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _next_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+        self.shard_path = os.path.join(self.output_dir, f"{self.prefix}-{len(self.shards):06d}.tar")
+        self._tar = tarfile.open(self.shard_path, "w")
+        self.shards.append(self.shard_path)
+        self._bytes = self._samples = 0
+
+    def write(self, key, members, **info):
+        """
+        Write a sample. Safe to call from several threads.
+
+        Args:
+        - key (str): Key of the sample, without dots.
+        - members (dict): Encoded data of the sample keyed by extension, e.g. {'png': ..., 'json': ...}.
+        - info: Extra fields saved with the index record of the sample, e.g. the mesh name and view.
+
+        Returns:
+        - str: Path of the shard the sample was written to.
+        """
+        size = sum(tarfile.BLOCKSIZE + _padded(len(data)) for data in members.values())
+        with self._lock:
+            if self._tar is None or self._samples > 0 and (self._bytes + size > self.max_bytes or
+                                                           self._samples == self.max_samples):
+                self._next_shard()
+
+            offsets = {}
+            for extension, data in members.items():
+                tarinfo = tarfile.TarInfo(f"{key}.{extension}")
+                tarinfo.size = len(data)
+                self._tar.addfile(tarinfo, io.BytesIO(data))
+                # The data of the member ends at the current offset, padded to a whole block
+                offsets[extension] = [self._tar.offset - _padded(len(data)), len(data)]
+            self._tar.fileobj.flush()
+            self._bytes += size
+            self._samples += 1
+
+            self._index.append(dict(info, Key=key, Shard=os.path.basename(self.shard_path), Members=offsets))
+            return self.shard_path
+
+    def close(self):
+        """Close the current shard and the index."""
+        with self._lock:
+            if self._tar is not None:
+                self._tar.close()
+                self._tar = None
+            self._index.close()
+
+
+def read_member(shard_dir, record, extension):
+    """
+    Read one member of a sample by seeking into its shard.
+
+    Args:
+    - shard_dir (str): Directory of the shards.
+    - record (dict): Index record of the sample, from render_index.read_index.
+    - extension (str): Extension of the member, e.g. 'png', 'depth.png' or 'json'.
+
+    Returns:
+    - bytes: The raw member data.
+    """
+    offset, size = record["Members"][extension]
+    with open(os.path.join(shard_dir, record["Shard"]), "rb") as shard_file:
+        shard_file.seek(offset)
+        return shard_file.read(size)
+
+
+def map_member(shard_map, record, extension):
+    """
+    View one member of a sample in a memory-mapped shard, without copying its data.
+
+    Args:
+    - shard_map (numpy.memmap): uint8 memory map of the shard of the sample, e.g. np.memmap(path, np.uint8, "r").
+    - record (dict): Index record of the sample, from render_index.read_index.
+    - extension (str): Extension of the member, e.g. 'png' or 'depth.npy'.
+
+    Returns:
+    - numpy.array: A read-only view of the array of a .npy member, otherwise the raw member data as a
+                   uint8 array, which decode_member accepts.
+    """
+    offset, size = record["Members"][extension]
+    data = shard_map[offset:offset + size]
+    if not extension.endswith("npy"):
+        return data
+    # The header of a .npy file is its magic string, the length of the header and the header itself
+    major, _ = np.lib.format.read_magic(io.BytesIO(data[:8].tobytes()))
+    length_size = 2 if major == 1 else 4
+    header_size = 8 + length_size + int.from_bytes(data[8:8 + length_size].tobytes(), "little")
+    header = io.BytesIO(data[:header_size].tobytes())
+    np.lib.format.read_magic(header)
+    read_header = np.lib.format.read_array_header_1_0 if major == 1 else np.lib.format.read_array_header_2_0
+    shape, fortran_order, dtype = read_header(header)
+    array = np.frombuffer(data, dtype=dtype, count=int(np.prod(shape)), offset=header_size)
+    return array.reshape(shape, order="F" if fortran_order else "C")
+
+
+def decode_member(extension, data):
+    """Decode member data by its extension: images to arrays, .npy to arrays and .json to dicts."""
+    if extension.endswith("json"):
+        return json.loads(data)
+    if extension.endswith("npy"):
+        return np.load(io.BytesIO(data))
+    if extension.endswith("png"):
+        import cv2
+
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    return data
+
+
+def iter_shard(path):
+    """
+    Stream the samples of a shard sequentially.
+
+    Args:
+    - path (str): Path of a shard.
+
+    Yields:
+    - tuple: (key, members) where members maps each extension to its raw bytes.
+    """
+    key, members = None, {}
+    with tarfile.open(path, "r|") as tar:
+        for tarinfo in tar:
+            if not tarinfo.isfile():
+                continue
+            member_key, extension = tarinfo.name.split(".", 1)
+            if member_key != key and members:
+                yield key, members
+                members = {}
+            key = member_key
+            members[extension] = tar.extractfile(tarinfo).read()
+    if members:
+        yield key, members
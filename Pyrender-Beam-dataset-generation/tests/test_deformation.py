@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from utils import batch_cantilever, batch_simple_support_beam, beam_generator, cantilever, simple_support_beam
+
+E, I = 69000000000, 1.2e-8
+
+
+def scalar_cantilever(vertices, load, beam_length=1):
+    """The per-vertex loop of the original cantilever."""
+    vertices = vertices.copy()
+    for vertex in vertices:
+        x_distance = vertex[0]
+        vertex[1] += (load * x_distance ** 2 * (3 * beam_length - x_distance)) / (6 * E * I)
+    return vertices
+
+
+def scalar_simple_support_beam(vertices, load, distance_from_support):
+    """The per-vertex loop of the original simple_support_beam."""
+    L = 1
+    vertices = vertices.copy()
+    for vertex in vertices:
+        x_distance = vertex[0]
+        if x_distance < distance_from_support:
+            y_deflection = (load * (L - distance_from_support) * x_distance *
+                            (L ** 2 - x_distance ** 2 - (L - distance_from_support) ** 2)) / (6 * L * E * I)
+        else:
+            y_deflection = (load * distance_from_support * (L - x_distance) *
+                            (L ** 2 - (L - x_distance) ** 2 - distance_from_support ** 2)) / (6 * L * E * I)
+        vertex[1] += y_deflection
+    return vertices
+
+
+@pytest.fixture(scope="module")
+def vertices():
+    beam = beam_generator((1, 0.03, 0.05), 2)
+    # Vertices exactly at the load locations, where the branch of the piecewise deflection changes
+    edge = np.array([[0.0, 0.0, 0.0], [0.1, 0.01, 0.0], [0.5, -0.01, 0.02], [0.9, 0.0, 0.01], [1.0, 0.0, 0.0]])
+    return np.vstack([beam.vertices, edge])
+
+
+LOADS = [-6468.75, -165.6, 0.0, 165.6, 1324.8]
+
+
+def test_batch_cantilever_matches_scalar_loop(vertices):
+    deformed = batch_cantilever(vertices, LOADS, E, I, 1)
+    for load, batch in zip(LOADS, deformed):
+        np.testing.assert_array_equal(batch, scalar_cantilever(vertices, load))
+
+
+@pytest.mark.parametrize("location", [0.1, 0.5, 0.9])
+def test_batch_simple_support_beam_matches_scalar_loop(vertices, location):
+    deformed = batch_simple_support_beam(vertices, LOADS, location, E, I)
+    for load, batch in zip(LOADS, deformed):
+        np.testing.assert_array_equal(batch, scalar_simple_support_beam(vertices, load, location))
+
+
+def test_batch_simple_support_beam_with_a_location_per_load(vertices):
+    locations = [0.1, 0.5, 0.9, 0.5, 0.1]
+    deformed = batch_simple_support_beam(vertices, LOADS, locations, E, I)
+    for load, location, batch in zip(LOADS, locations, deformed):
+        np.testing.assert_array_equal(batch, scalar_simple_support_beam(vertices, load, location))
+
+
+def test_mesh_wrappers_match_scalar_loop(vertices):
+    import trimesh
+
+    mesh = trimesh.Trimesh(vertices=vertices.copy(), faces=[[0, 1, 2]], process=False)
+    np.testing.assert_array_equal(cantilever(mesh, 165.6, E, I, 1).vertices, scalar_cantilever(vertices, 165.6))
+    mesh = trimesh.Trimesh(vertices=vertices.copy(), faces=[[0, 1, 2]], process=False)
+    np.testing.assert_array_equal(simple_support_beam(mesh, -165.6, 0.5, E, I).vertices,
+                                  scalar_simple_support_beam(vertices, -165.6, 0.5))
@@ -0,0 +1,26 @@
+import numpy as np
+
+from deformed_store import DeformedMeshStore
+
+
+def test_store_round_trip(tmp_path):
+    faces = np.array([[0, 1, 2]])
+    vertices = np.random.default_rng(0).random((3, 3))
+    with DeformedMeshStore(tmp_path, mode="w") as store:
+        store.add_faces("beam_0000", faces)
+        store.append("beam_0000", 0.9, 10.0, vertices, name="sample")
+
+    store = DeformedMeshStore(tmp_path)
+    sample = store.find("beam_0000", 0.9, 10.0)
+    np.testing.assert_array_equal(store.vertices(sample), vertices.astype(np.float32))
+    np.testing.assert_array_equal(store.faces("beam_0000"), faces)
+
+
+def test_store_without_vertex_rows(tmp_path):
+    # A store whose samples hold no vertex rows has an empty vertex file, which cannot be memory-mapped
+    with DeformedMeshStore(tmp_path, mode="w") as store:
+        store.add_faces("beam_0000", np.zeros((0, 3), dtype=np.int64))
+        store.append("beam_0000", 0.9, 0.0, np.zeros((0, 3)))
+
+    store = DeformedMeshStore(tmp_path)
+    assert store.vertices(0).shape == (0, 3)
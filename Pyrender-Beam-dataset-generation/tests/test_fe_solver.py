@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from fe_solver import FESolver
+from utils import beam_generator
+
+RESOLUTION = (16, 2, 2)
+
+
+@pytest.fixture(scope="module")
+def solvers():
+    beam = beam_generator((1, 0.03, 0.05), 1)
+    return {beam_type: FESolver(beam, beam_type, 69e9, resolution=RESOLUTION)
+            for beam_type in ['cantilever', 'simple_support']}
+
+
+def test_load_between_planes_is_split_between_them(solvers):
+    solver = solvers['simple_support']
+    # 0.1 lies between the planes 1 and 2 of 16 elements, at 1.6 elements
+    between = solver.deform([100.0], 0.1)[0] - solver.vertices
+    before = solver.deform([100.0], 1 / 16)[0] - solver.vertices
+    after = solver.deform([100.0], 2 / 16)[0] - solver.vertices
+    np.testing.assert_allclose(between, 0.4 * before + 0.6 * after, rtol=1e-9, atol=1e-15)
+
+
+def test_load_sums_to_the_force(solvers):
+    solver = solvers['simple_support']
+    full = np.zeros(solver.num_dofs)
+    for location in [0.1, 0.5, 0.93]:
+        full[solver.free] = solver.load_vectors([100.0], location)[:, 0]
+        # None of these locations is on a support, whose dofs are fixed
+        assert full[1::3].sum() == pytest.approx(100.0)
+
+
+def test_cantilever_takes_no_location(solvers):
+    with pytest.raises(AssertionError):
+        solvers['cantilever'].load_vectors([100.0], 0.9)
+    with pytest.raises(AssertionError):
+        solvers['simple_support'].load_vectors([100.0])
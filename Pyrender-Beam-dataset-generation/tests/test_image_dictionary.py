@@ -0,0 +1,53 @@
+import json
+import os
+
+from render_index import INDEX_SUFFIX, IndexWriter
+from utils import generate_image_mesh_dictionary
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+
+def _views(image_dir, mesh):
+    """Files of a mesh rendered with the depth map and the extra passes of every view."""
+    for k in range(2):
+        for pattern in ["image_{:04}.png", "depth_{:04}.png", "mask_{:04}.png", "normals_{:04}.png"]:
+            _touch(os.path.join(image_dir, mesh, pattern.format(k)))
+
+
+def _dictionary(tmp_path, **kwargs):
+    output = str(tmp_path / "dictionary.json")
+    generate_image_mesh_dictionary(str(tmp_path), "meshes", "images", output, **kwargs)
+    with open(output) as dictionary_file:
+        return json.load(dictionary_file)
+
+
+def test_legacy_directories_list_the_color_views(tmp_path):
+    image_dir = str(tmp_path / "images")
+    _touch(str(tmp_path / "meshes" / "beam_a.obj"))
+    _views(image_dir, "beam_a")
+
+    assert _dictionary(tmp_path) == {"beam_a": [os.path.join(image_dir, "beam_a", "image_0000.png"),
+                                                os.path.join(image_dir, "beam_a", "image_0001.png")]}
+
+
+def test_index_is_used_without_listing_the_mesh_directory(tmp_path):
+    image_dir = str(tmp_path / "images")
+    _touch(str(tmp_path / "meshes" / "beam_a.obj"))
+    _touch(str(tmp_path / "meshes" / "beam_b.obj"))
+    _views(image_dir, "beam_a")
+    _views(image_dir, "beam_b")
+    with IndexWriter(os.path.join(image_dir, "render" + INDEX_SUFFIX)) as index:
+        for k in range(2):
+            index.append({"Key": f"a{k}", "Mesh": "beam_a", "View": k,
+                          "Image": os.path.join("beam_a", "image_{:04}.png".format(k))})
+
+    indexed = _dictionary(tmp_path)
+    assert list(indexed) == ["beam_a"]
+
+    # The unindexed mesh is listed on request, with the same views as the indexed one
+    scanned = _dictionary(tmp_path, scan_mesh_dir=True)
+    assert scanned["beam_a"] == indexed["beam_a"]
+    assert [os.path.basename(image) for image in scanned["beam_b"]] == ["image_0000.png", "image_0001.png"]
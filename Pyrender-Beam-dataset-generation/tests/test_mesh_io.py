@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+import pytest
+
+from mesh_io import MESH_FORMATS, export_mesh, list_mesh_files, load_mesh_file, mesh_path
+from utils import beam_generator
+
+
+@pytest.fixture(scope="module")
+def beam():
+    return beam_generator((1, 0.03, 0.05), 1)
+
+
+@pytest.mark.parametrize("mesh_format", MESH_FORMATS)
+def test_export_and_load(tmp_path, beam, mesh_format):
+    path = mesh_path(str(tmp_path), "beam", mesh_format)
+    export_mesh(beam, path, mesh_format)
+    loaded = load_mesh_file(path)
+    assert len(loaded.faces) == len(beam.faces)
+    np.testing.assert_allclose(loaded.bounds, beam.bounds, atol=1e-6)
+
+
+def test_newest_format_of_a_name_is_listed(tmp_path, beam):
+    directory = str(tmp_path)
+    for mesh_format in ['ply', 'obj']:
+        export_mesh(beam, mesh_path(directory, "beam", mesh_format), mesh_format)
+    export_mesh(beam, mesh_path(directory, "other", 'npz'), 'npz')
+
+    # A rerun with --mesh-format ply after an obj run
+    os.utime(mesh_path(directory, "beam", 'obj'), (1000, 1000))
+    assert dict(list_mesh_files(directory)) == {"beam": mesh_path(directory, "beam", 'ply'),
+                                                "other": mesh_path(directory, "other", 'npz')}
+
+    # Files written at the same time are taken in the order of MESH_FORMATS
+    os.utime(mesh_path(directory, "beam", 'ply'), (1000, 1000))
+    assert dict(list_mesh_files(directory))["beam"] == mesh_path(directory, "beam", 'obj')
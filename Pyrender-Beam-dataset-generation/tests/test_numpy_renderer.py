@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+from numpy_renderer import PARITY_TOLERANCE, NumpyRenderer, NumpyScene, _example_views, compare_with_pyrender
+from randering_img_depth import BeamScene, render_passes
+from utils import beam_generator, normalize_mesh
+
+
+@pytest.fixture(scope="module")
+def gl_context():
+    """Skip when pyrender cannot create an offscreen context, e.g. without EGL."""
+    # Headless by default; PYOPENGL_PLATFORM=osmesa selects the CPU implementation
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+    pyrender = pytest.importorskip("pyrender")
+    try:
+        pyrender.OffscreenRenderer(8, 8).delete()
+    except Exception as error:
+        pytest.skip(f"No offscreen OpenGL platform: {error}")
+
+
+@pytest.mark.parametrize("split", [3, 4])
+def test_depth_parity_with_pyrender(gl_context, split):
+    example = normalize_mesh(beam_generator((1, 0.03, 0.05), split))
+    parity = compare_with_pyrender(example, img_size=(256, 256), yfov=np.pi / 2, num_views=8)
+
+    assert parity["min_iou"] >= PARITY_TOLERANCE["min_iou"]
+    assert parity["median_depth_error"] <= PARITY_TOLERANCE["median_depth_error"]
+    assert parity["p99_depth_error"] <= PARITY_TOLERANCE["p99_depth_error"]
+
+
+@pytest.mark.parametrize("split", [0, 3])
+def test_face_id_pass_matches_numpy_backend(gl_context, split):
+    import pyrender
+
+    example = normalize_mesh(beam_generator((1, 0.03, 0.05), split))
+    gl_scene, numpy_scene = BeamScene(np.pi / 2, 1.5, np.ones(3)), NumpyScene(np.pi / 2, 1.5, np.ones(3))
+    gl_scene.set_mesh(example)
+    numpy_scene.set_mesh(example)
+    gl_renderer, numpy_renderer = pyrender.OffscreenRenderer(256, 256), NumpyRenderer(256, 256)
+    try:
+        for pose in _example_views(example, np.pi / 2, 4):
+            gl_scene.set_pose(pose)
+            numpy_scene.set_pose(pose)
+            _, depth = gl_renderer.render(gl_scene.scene)
+            face_ids = gl_scene.render_face_ids(gl_renderer)
+            _, numpy_depth = numpy_renderer.render(numpy_scene)
+
+            # Pixels may only disagree on faces sharing an edge that passes through their sample point
+            visible = (depth > 0) & (numpy_depth > 0)
+            assert np.array_equal(face_ids >= 0, depth > 0)
+            assert np.mean(face_ids[visible] == numpy_renderer.face_ids[visible]) >= 0.98
+            vertex_ids = render_passes(depth, example, pose, np.pi / 2, ['vertex_ids'], face_ids)['vertex_ids']
+            numpy_vertex_ids = render_passes(numpy_depth, example, pose, np.pi / 2, ['vertex_ids'],
+                                             numpy_renderer.face_ids)['vertex_ids']
+            assert np.mean(vertex_ids[visible] == numpy_vertex_ids[visible]) >= 0.99
+    finally:
+        gl_renderer.delete()
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from deformed_beam_generator import plan_jobs
+from utils import cantilever_power_estimation, simple_support_beam_force_estimation
+
+E = 69000000000
+BEAMS = [{"Name": "beam_0000", "Height": 0.02, "Width": 0.02},
+         {"Name": "beam_0001", "Height": 0.03, "Width": 0.05}]
+# Displacement targets 0.03, 0 and -0.03: the middle one gives a zero force
+GRID = dict(num_meshes=3, youngs_modulus=E, max_displacement=-0.03, min_displacement=0.03)
+
+
+def _keys(jobs):
+    return list(zip(jobs["Beam"], jobs["Location"], jobs["Force"]))
+
+
+def test_cantilever_keeps_the_first_location_only():
+    jobs = plan_jobs(BEAMS, 'cantilever', **GRID, locations=[0.9, 0.1])
+
+    assert len(jobs) == 6
+    assert list(jobs["Job"]) == list(range(6))
+    assert list(jobs["Beam"]) == ["beam_0000"] * 3 + ["beam_0001"] * 3
+    assert list(jobs["Location"]) == [0.9] * 6
+    expected = [cantilever_power_estimation(1, displacement, E, beam["Height"] * beam["Width"] ** 3 / 12)
+                for beam in BEAMS for displacement in [0.03, 0.0, -0.03]]
+    assert list(jobs["Force"]) == pytest.approx(expected)
+
+
+def test_simple_support_plans_one_zero_force_per_beam():
+    jobs = plan_jobs(BEAMS, 'simple_support', **GRID, locations=[0.9, 0.1, 0.9], first_job=10)
+
+    # The repeated location is dropped, and only the first location of a beam keeps the zero force
+    assert len(jobs) == 10
+    assert list(jobs["Job"]) == list(range(10, 20))
+    assert len(set(_keys(jobs))) == len(jobs)
+    for name, beam_jobs in jobs.groupby("Beam"):
+        assert list(beam_jobs["Location"]) == [0.9, 0.9, 0.9, 0.1, 0.1]
+        assert (beam_jobs["Force"] == 0).sum() == 1
+        assert beam_jobs["Force"].iloc[1] == 0
+        moment_inertia = beam_jobs["I"].iloc[0]
+        expected = simple_support_beam_force_estimation(1, 0.03, E, moment_inertia, 0.1)
+        assert beam_jobs["Force"].iloc[3] == pytest.approx(expected)
+
+
+def test_equal_forces_are_planned_once():
+    # A single displacement target repeated num_meshes times gives equal forces at every location
+    jobs = plan_jobs(BEAMS[:1], 'simple_support', num_meshes=4, youngs_modulus=E, max_displacement=0.01,
+                     min_displacement=0.01, locations=[0.5])
+    assert len(jobs) == 1
+
+    # A beam without stiffness needs no force: all of its targets give the undeformed beam
+    flat = [{"Name": "beam_flat", "Height": 0.02, "Width": 0.0}]
+    jobs = plan_jobs(flat, 'simple_support', **GRID, locations=[0.9, 0.1])
+    assert _keys(jobs) == [("beam_flat", 0.9, 0.0)]
+
+
+def test_no_beams_plans_no_jobs():
+    assert len(plan_jobs([], 'cantilever')) == 0
+    assert np.array_equal(plan_jobs(BEAMS, 'cantilever', **GRID)["Job"], np.arange(6))
@@ -0,0 +1,40 @@
+import json
+
+from run_journal import RunJournal
+
+
+def _write(path, text="mesh"):
+    with open(path, "w") as output:
+        output.write(text)
+    return str(path)
+
+
+def test_torn_last_line_is_dropped_on_resume(tmp_path):
+    paths = [_write(tmp_path / f"mesh_{i}.obj") for i in range(3)]
+    with RunJournal(tmp_path) as journal:
+        journal.record("a", [paths[0]], name="mesh_0")
+        journal.record("b", [paths[1]], name="mesh_1")
+
+    # A crash in the middle of writing the next entry leaves a partial line
+    journal_path = tmp_path / RunJournal.FILE_NAME
+    with open(journal_path, "a") as journal_file:
+        journal_file.write(json.dumps({"key": "c", "paths": [paths[2]]})[:20])
+
+    with RunJournal(tmp_path, resume=True) as journal:
+        assert journal.done_keys() == {"a", "b"}
+        journal.record("c", [paths[2]], name="mesh_2")
+
+    with open(journal_path) as journal_file:
+        lines = journal_file.read().splitlines()
+    assert [json.loads(line)["key"] for line in lines] == ["a", "b", "c"]
+    with RunJournal(tmp_path, resume=True) as journal:
+        assert journal.done_keys() == {"a", "b", "c"}
+
+
+def test_resume_false_starts_a_new_journal(tmp_path):
+    path = _write(tmp_path / "mesh.obj")
+    with RunJournal(tmp_path) as journal:
+        journal.record("a", [path])
+
+    with RunJournal(tmp_path, resume=False) as journal:
+        assert journal.done_keys() == set()
@@ -1,34 +1,165 @@
-import trimesh
 import numpy as np
 import os
 import json
+from collections import OrderedDict
+from render_index import read_index
 
-def beam_generator(shape, split):
+def beam_generator(shape, split, resolution=None):
     """
     Generate a subdivided beam mesh based on the provided shape.
 
     Parameters:
     - shape (tuple): Dimensions of the box (length, width, height).
+    - split (int): Number of uniform subdivision passes, used when resolution is None.
+    - resolution (tuple): Optional (nx, ny, nz) number of segments along each axis. When given, the
+      surface is built directly as a structured grid by structured_beam_generator, e.g. dense along
+      the length and coarse across the section. resolution=(2 ** split,) * 3 gives the same vertices
+      as split subdivision passes.
 
     Returns:
     - cantilever (Trimesh): Subdivided beam mesh.
     """
 
-    # Create a box mesh based on the given shape and position it
-    #position = shape / 2
-    position = (shape[0] / 2, shape[1] / 2, shape[2] / 2)
-    mesh = trimesh.creation.box(shape)
-    beam = trimesh.Trimesh(vertices=mesh.vertices + position, faces=mesh.faces)
+    import trimesh
 
-    # Subdivide the mesh multiple times for refinement
-    for _ in range(split):
-        beam = beam.subdivide()
+    if resolution is not None:
+        beam = structured_beam_generator(shape, resolution)
+    else:
+        # Create a box mesh based on the given shape and position it
+        #position = shape / 2
+        position = (shape[0] / 2, shape[1] / 2, shape[2] / 2)
+        mesh = trimesh.creation.box(shape)
+        beam = trimesh.Trimesh(vertices=mesh.vertices + position, faces=mesh.faces)
+
+        # Subdivide the mesh multiple times for refinement
+        for _ in range(split):
+            beam = beam.subdivide()
 
     print('Number of vertices:', beam.vertices.shape[0])
     print('Number of faces:', beam.faces.shape[0])
     return beam
 
 
+def structured_beam_generator(shape, resolution):
+    """
+    Build the surface mesh of a box beam as a structured grid in one vectorized step.
+
+    Every side of the box is split into a regular grid of quads (two triangles each) with its own
+    number of segments along each axis, and vertices on shared edges are shared between sides.
+
+    Parameters:
+    - shape (tuple): Dimensions of the box along x, y and z.
+    - resolution (tuple): (nx, ny, nz) number of segments along x, y and z.
+
+    Returns:
+    - Trimesh: Watertight beam mesh spanning [0, shape] along each axis, with outward normals.
+    """
+
+    import trimesh
+
+    counts = np.asarray(resolution, dtype=np.int64)
+    assert counts.shape == (3,) and np.all(counts >= 1), "resolution must be three positive integers."
+
+    # Number every lattice point on the surface of the box
+    grid = np.indices(counts + 1).reshape(3, -1).T
+    on_surface = np.any((grid == 0) | (grid == counts), axis=1)
+    index = np.full(len(grid), -1, dtype=np.int64)
+    index[on_surface] = np.arange(on_surface.sum())
+    index = index.reshape(counts + 1)
+    vertices = grid[on_surface] / counts * np.asarray(shape, dtype=np.float64)
+
+    faces = []
+    for axis in range(3):
+        u_axis, v_axis = [a for a in range(3) if a != axis]
+        u, v = np.meshgrid(np.arange(counts[u_axis]), np.arange(counts[v_axis]), indexing='ij')
+        u = u.ravel()
+        v = v.ravel()
+        for side in (0, counts[axis]):
+            # Corners of every quad of this side of the box
+            corners = []
+            for du, dv in ((0, 0), (1, 0), (1, 1), (0, 1)):
+                point = [None, None, None]
+                point[axis] = np.full_like(u, side)
+                point[u_axis] = u + du
+                point[v_axis] = v + dv
+                corners.append(index[tuple(point)])
+            quads = np.stack(corners, axis=1)
+
+            # u x v points along +axis for axis 0 and 2 and along -axis for axis 1; flip to face outwards
+            points_out = (1 if axis != 1 else -1) * (1 if side else -1) > 0
+            if not points_out:
+                quads = quads[:, ::-1]
+            faces.append(quads[:, [0, 1, 2]])
+            faces.append(quads[:, [0, 2, 3]])
+
+    return trimesh.Trimesh(vertices=vertices, faces=np.concatenate(faces), process=False)
+
+
+def batch_cantilever(vertices, loads, modulus_elasticity, moment_inertia, beam_length):
+    """
+    Compute the deflected vertex sets of a cantilevered beam for a batch of point loads
+    at its free end in a single vectorized step.
+
+    Parameters:
+    - vertices (numpy.array): (V, 3) vertices of the undeformed beam. Not modified.
+    - loads (float or array-like): One point load or a vector of n_loads point loads.
+    - modulus_elasticity (float): Modulus of elasticity of the material.
+    - moment_inertia (float): Moment of inertia of the beam's cross-sectional area.
+    - beam_length (float): Length of the cantilevered beam.
+
+    Returns:
+    - numpy.array: (n_loads, V, 3) deflected vertices, one set per load.
+    """
+
+    vertices = np.asarray(vertices, dtype=np.float64)
+    loads = np.atleast_1d(np.asarray(loads, dtype=np.float64))[:, None]
+    x_distance = vertices[None, :, 0]
+
+    y_deflection = (loads * x_distance ** 2 * (3 * beam_length - x_distance)) / (
+                6 * modulus_elasticity * moment_inertia)
+
+    deformed = np.repeat(vertices[None], loads.shape[0], axis=0)
+    deformed[:, :, 1] += y_deflection  # Apply the deflection to the y-coordinate of every vertex
+    return deformed
+
+
+def batch_simple_support_beam(vertices, loads, distances_from_support, modulus_elasticity, moment_inertia):
+    """
+    Compute the deflected vertex sets of a simply supported beam for a batch of point loads
+    in a single vectorized step. The piecewise deflection curve is evaluated with masks.
+
+    Parameters:
+    - vertices (numpy.array): (V, 3) vertices of the undeformed beam. Not modified.
+    - loads (float or array-like): One point load or a vector of n_loads point loads.
+    - distances_from_support (float or array-like): Load location(s) measured from the left
+      support, either one value shared by all loads or one value per load.
+    - modulus_elasticity (float): Modulus of elasticity of the material.
+    - moment_inertia (float): Moment of inertia of the beam's cross-sectional area.
+
+    Returns:
+    - numpy.array: (n_loads, V, 3) deflected vertices, one set per load.
+    """
+
+    L = 1  # Assuming the length of the beam is along the x-axis
+    vertices = np.asarray(vertices, dtype=np.float64)
+    loads, a = np.broadcast_arrays(np.atleast_1d(np.asarray(loads, dtype=np.float64)),
+                                   np.atleast_1d(np.asarray(distances_from_support, dtype=np.float64)))
+    loads = loads[:, None]
+    a = a[:, None]
+    x_distance = vertices[None, :, 0]
+
+    # Deflection left and right of the load, selected per vertex with a mask
+    left = (loads * (L - a) * x_distance *
+            (L ** 2 - x_distance ** 2 - (L - a) ** 2)) / (6 * L * modulus_elasticity * moment_inertia)
+    right = (loads * a * (L - x_distance) *
+             (L ** 2 - (L - x_distance) ** 2 - a ** 2)) / (6 * L * modulus_elasticity * moment_inertia)
+    y_deflection = np.where(x_distance < a, left, right)
+
+    deformed = np.repeat(vertices[None], loads.shape[0], axis=0)
+    deformed[:, :, 1] += y_deflection  # Apply the deflection to the y-coordinate of every vertex
+    return deformed
+
+
 def cantilever(mesh, load, modulus_elasticity, moment_inertia, beam_length):
     """
     Modifies the given mesh to represent the deflection of a cantilevered beam
@@ -45,12 +176,7 @@ def cantilever(mesh, load, modulus_elasticity, moment_inertia, beam_length):
     - Trimesh: Mesh representing the deflected beam.
     """
 
-    for vertex in mesh.vertices:
-        x_distance = vertex[0]
-        y_deflection = (load * x_distance ** 2 * (3 * beam_length - x_distance)) / (
-                    6 * modulus_elasticity * moment_inertia)
-        vertex[1] += y_deflection  # Apply the deflection to the y-coordinate of the vertex
-
+    mesh.vertices = batch_cantilever(mesh.vertices, load, modulus_elasticity, moment_inertia, beam_length)[0]
     return mesh
 
 
@@ -70,21 +196,8 @@ def simple_support_beam(mesh, load, distance_from_support, modulus_elasticity, m
     - Trimesh: Mesh representing the deflected beam.
     """
 
-    L = 1  # Assuming the length of the beam is along the x-axis
-    for vertex in mesh.vertices:
-        x_distance = vertex[0]
-
-        if x_distance < distance_from_support:
-            y_deflection = (load * (L - distance_from_support) * x_distance *
-                            (L ** 2 - x_distance ** 2 - (L - distance_from_support) ** 2)) / (
-                                       6 * L * modulus_elasticity * moment_inertia)
-        else:
-            y_deflection = (load * distance_from_support * (L - x_distance) *
-                            (L ** 2 - (L - x_distance) ** 2 - distance_from_support ** 2)) / (
-                                       6 * L * modulus_elasticity * moment_inertia)
-
-        vertex[1] += y_deflection  # Apply the deflection to the y-coordinate of the vertex
-
+    mesh.vertices = batch_simple_support_beam(mesh.vertices, load, distance_from_support,
+                                              modulus_elasticity, moment_inertia)[0]
     return mesh
 
 
@@ -93,6 +206,9 @@ def cantilever_power_estimation(beam_length, tip_displacement, modulus_elasticit
     Estimate the power (or force) for a cantilever based on its length,
     displacement at the free end, and material properties.
 
+    The arguments may be NumPy arrays, which are broadcast against each other to estimate a whole
+    grid of forces at once.
+
     Parameters:
     - beam_length (float): Length of the cantilevered beam.
     - tip_displacement (float): Displacement at the free end of the cantilever.
@@ -100,11 +216,11 @@ def cantilever_power_estimation(beam_length, tip_displacement, modulus_elasticit
     - moment_inertia (float): Moment of inertia of the beam's cross-sectional area.
 
     Returns:
-    - int: Estimated power (or force).
+    - float or numpy.array: Estimated power (or force), not rounded, so the small forces of thin
+                            beams stay distinct.
     """
 
-    power_estimate = int(
-        (6 * beam_length * modulus_elasticity * moment_inertia * tip_displacement) / (beam_length ** 3))
+    power_estimate = (6 * beam_length * modulus_elasticity * moment_inertia * tip_displacement) / (beam_length ** 3)
     return power_estimate
 
 
@@ -113,6 +229,9 @@ def simple_support_beam_force_estimation(beam_length, displacement, modulus_elas
     Estimate the force applied on a simply supported beam based on its length,
     displacement at a specific location, and material properties.
 
+    The arguments may be NumPy arrays, which are broadcast against each other to estimate a whole
+    grid of forces at once.
+
     Parameters:
     - beam_length (float): Length of the simply supported beam.
     - displacement (float): Displacement at the specified location on the beam.
@@ -121,19 +240,15 @@ def simple_support_beam_force_estimation(beam_length, displacement, modulus_elas
     - load_location (float): Location on the beam where the load is applied.
 
     Returns:
-    - int: Estimated force.
+    - float or numpy.array: Estimated force, not rounded.
     """
 
-    force_estimate = int((6 * beam_length * modulus_elasticity * moment_inertia * displacement) /
-                         (load_location * (beam_length - load_location) *
-                          (beam_length ** 2 - (beam_length - load_location) ** 2 - load_location ** 2)))
+    force_estimate = ((6 * beam_length * modulus_elasticity * moment_inertia * displacement) /
+                      (load_location * (beam_length - load_location) *
+                       (beam_length ** 2 - (beam_length - load_location) ** 2 - load_location ** 2)))
     return force_estimate
 
 
-import trimesh
-import numpy as np
-
-
 def mesh_stats(mesh):
     """
     Computes statistics of a Trimesh object's vertices and returns as {num,min,max,centroid}
@@ -170,16 +285,92 @@ def normalize_mesh(input_mesh):
     return input_mesh
 
 
-def generate_image_mesh_dictionary(base_path = '/home/qilin/3DGEN/Beam-dataset-generation', mesh_subdir='./deformed_beam',
-                                   image_subdir='./imgs', output_filename='mesh_img_dictionary.json', file_type = '.obj'):
+class BaseMeshCache:
+    """
+    In-memory LRU cache of base beam meshes, keyed by path or by any other hashable key
+    such as the beam shape.
+
+    Cached meshes are shared, so callers must not modify them in place. Deformations should
+    be computed on copies of the vertices, e.g. with batch_cantilever/batch_simple_support_beam.
+    """
+
+    def __init__(self, max_size=32):
+        """
+        Args:
+        - max_size (int): Maximum number of meshes kept in memory. The least recently used
+                          mesh is evicted first.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._meshes = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._meshes
+
+    def __len__(self):
+        return len(self._meshes)
+
+    def put(self, key, mesh):
+        """Add a mesh to the cache, e.g. one created by generate_beam_meshes."""
+        self._meshes[key] = mesh
+        self._meshes.move_to_end(key)
+        while len(self._meshes) > self.max_size:
+            self._meshes.popitem(last=False)
+
+    def get(self, key, loader=None):
+        """
+        Return the cached mesh for a key, loading it on a miss.
+
+        Args:
+        - key (hashable): Path of the mesh file, or any key understood by loader.
+        - loader (callable): Called with the key on a miss. Defaults to mesh_io.load_mesh_file, which
+                             loads mesh files of any format of mesh_io.MESH_FORMATS.
+
+        Returns:
+        - Trimesh: The cached mesh.
+        """
+        if key in self._meshes:
+            self.hits += 1
+            self._meshes.move_to_end(key)
+            return self._meshes[key]
+
+        self.misses += 1
+        if loader is None:
+            from mesh_io import load_mesh_file
+            loader = load_mesh_file
+        mesh = loader(key)
+        self.put(key, mesh)
+        return mesh
+
+
+def _is_color_view(filename):
+    """Whether a file of an image directory is the color image of a view, image_<k>.png, and not its depth
+    map or an extra pass."""
+    filename = os.path.basename(filename)
+    return filename.startswith("image_") and filename.endswith(('.png', '.jpg'))
+
+
+def generate_image_mesh_dictionary(base_path='.', mesh_subdir='./deformed_beam',
+                                   image_subdir='./imgs', output_filename='mesh_img_dictionary.json', file_type = '.obj',
+                                   scan_mesh_dir=False):
     """
     Generate a dictionary mapping meshes to their corresponding images and write to a JSON file.
 
+    The dictionary is built from the render index written by generate_cantilever_images, in one pass
+    over its records. Views written to shards are listed as '<shard path>#<sample key>'. Image
+    directories rendered by earlier versions, which have no index, are found by listing the mesh and
+    image directories. Either way only the color images of the views are listed.
+
     Args:
-    - base_path (str): The absolute path to the parent directory.
-    - mesh_subdir (str): The subdirectory containing mesh files.
+    - base_path (str): The path to the parent directory.
+    - mesh_subdir (str): The subdirectory containing mesh files. Only used without a render index,
+                         or with scan_mesh_dir.
     - image_subdir (str): The subdirectory containing image directories corresponding to meshes.
     - output_filename (str): Name of the output JSON file.
+    - scan_mesh_dir (bool): Also list the meshes of mesh_subdir that have no views in the render index,
+                            e.g. image directories of earlier versions next to indexed ones. This lists
+                            the mesh directory, which the index otherwise avoids.
 
     Returns:
     None
@@ -187,27 +378,40 @@ def generate_image_mesh_dictionary(base_path = '/home/qilin/3DGEN/Beam-dataset-g
 
     # Define directories
     mesh_dir = os.path.join(base_path, mesh_subdir)
-    image_base_dir = os.path.join(base_path, image_subdir)
+    image_base_dir = os.path.abspath(os.path.join(base_path, image_subdir))
 
     # Initialize the dictionary
     mesh_to_images = {}
 
-    # Traverse the mesh directory
-    for mesh_file in os.listdir(mesh_dir):
-        if mesh_file.endswith(file_type):
-            # Remove .obj extension to get the mesh name
-            mesh_name = os.path.splitext(mesh_file)[0]
-
-            # Corresponding image directory
-            image_dir = os.path.join(image_base_dir, mesh_name)
-
-            if os.path.exists(image_dir):  # Ensure the image directory exists
-                # List all images in the directory with their absolute paths
-                images = [os.path.join(image_dir, img) for img in os.listdir(image_dir) if
-                          img.endswith(('.png', '.jpg'))]  # Assumes images are PNG or JPG. Modify as needed.
-
-                # Update the dictionary
-                mesh_to_images[mesh_name] = images
+    records = read_index(image_base_dir) if os.path.isdir(image_base_dir) else {}
+    for record in sorted(records.values(), key=lambda record: (record["Mesh"], record["View"])):
+        if record.get("Image") is not None:
+            if not _is_color_view(record["Image"]):
+                continue
+            image = os.path.join(image_base_dir, record["Image"])
+        else:
+            image = f"{os.path.join(image_base_dir, record['Shard'])}#{record['Key']}"
+        mesh_to_images.setdefault(record["Mesh"], []).append(image)
+
+    # Traverse the mesh directory for the meshes without an index
+    if not records or scan_mesh_dir:
+        for mesh_file in os.listdir(mesh_dir):
+            if mesh_file.endswith(file_type):
+                # Remove .obj extension to get the mesh name
+                mesh_name = os.path.splitext(mesh_file)[0]
+                if mesh_name in mesh_to_images:
+                    continue
+
+                # Corresponding image directory
+                image_dir = os.path.join(image_base_dir, mesh_name)
+
+                if os.path.exists(image_dir):  # Ensure the image directory exists
+                    # List all images in the directory with their absolute paths
+                    images = [os.path.join(image_dir, img) for img in sorted(os.listdir(image_dir)) if
+                              _is_color_view(img)]
+
+                    # Update the dictionary
+                    mesh_to_images[mesh_name] = images
 
     # Write the dictionary to a JSON file
     with open(output_filename, 'w') as outfile: